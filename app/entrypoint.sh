@@ -40,6 +40,7 @@ function show_help {
     restore_dump       : restore db dump (${BACKUPS_FOLDER}/${DB_NAME}-backup.sql)
 
     start              : start webserver behind nginx
+    start_asgi         : start ASGI webserver (non blocking proxy to Aether apps)
     start_dev          : start webserver for development
 
     health             : checks the system healthy
@@ -233,6 +234,20 @@ case "$1" in
         ./conf/uwsgi/start.sh
     ;;
 
+    start_asgi )
+        # ensure that DEBUG mode is disabled
+        export DEBUG=
+
+        setup
+
+        uvicorn \
+            --host 0.0.0.0 \
+            --port $WEB_SERVER_PORT \
+            --workers ${ASGI_WORKERS:-4} \
+            --no-access-log \
+            gather.asgi:application
+    ;;
+
     start_dev )
         # ensure that DEBUG mode is enabled
         export DEBUG=true
@@ -17,18 +17,40 @@
 # under the License.
 
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, SEARCH_VAR
 
 from .api.models import Survey, Mask
+from .api.search import get_similarity_ordering, search
 
 
-class SurveyAdmin(admin.ModelAdmin):
+class TrigramSearchMixin(object):
+    '''
+    Index backed search sorted by similarity (see ``gather.api.search``).
+    '''
+
+    def get_search_results(self, request, queryset, search_term):
+        terms = search_term.split()
+        if not terms:
+            return queryset, False
+        return search(queryset, self.get_search_fields(request), terms), False
+
+    def get_ordering(self, request):
+        ordering = super(TrigramSearchMixin, self).get_ordering(request)
+        if ORDER_VAR in request.GET:
+            return ordering
+
+        terms = request.GET.get(SEARCH_VAR, '').split()
+        return [*get_similarity_ordering(self.model, self.get_search_fields(request), terms), *ordering]
+
+
+class SurveyAdmin(TrigramSearchMixin, admin.ModelAdmin):
 
     list_display = ('project_id', 'name',)
     search_fields = ('name',)
     ordering = list_display
 
 
-class MaskAdmin(admin.ModelAdmin):
+class MaskAdmin(TrigramSearchMixin, admin.ModelAdmin):
 
     list_display = ('survey', 'name', 'columns',)
     search_fields = ('survey__name', 'name', 'columns',)
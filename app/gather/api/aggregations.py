@@ -0,0 +1,415 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import math
+import re
+
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .exports import get_value
+from .masks import AVRO_FLAGS
+
+'''
+Aggregates the mask columns over all the survey entities.
+
+The entities are requested to kernel page by page and each page is processed
+column by column as one batch (the values are split by type and aggregated
+with the built-in functions), so the memory used does not depend on the
+number of entities but on the number of distinct values, and that one is
+also limited (``AGGREGATION_EXACT_LIMIT``):
+
+    - categories (strings and booleans): count by value, the least common
+      values beyond the limit are counted together as ``other``,
+    - numbers: count, min, max, mean, quartiles and histogram,
+    - dates (ISO strings): count, min, max and count by day, week, month or year,
+    - all of them: distinct values.
+
+The distinct values and the quartiles and histogram of the numbers are exact
+till the column has more than ``AGGREGATION_EXACT_LIMIT`` distinct values,
+then (or from the beginning with ``approximate``) they are estimated with
+constant memory sketches:
+
+    - distinct values: HyperLogLog (standard error ~1%),
+    - numbers: logarithmic buckets (DDSketch), the quartiles are within 1% of the real values.
+'''
+
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+YEAR = 'year'
+INTERVALS = [DAY, WEEK, MONTH, YEAR]
+
+QUARTILES = [('p25', 0.25), ('p50', 0.5), ('p75', 0.75)]
+
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def flatten(values):
+    for value in values:
+        if isinstance(value, list):
+            yield from flatten(value)
+        else:
+            yield value
+
+
+def hash_value(value):
+    # 64 bits hash, the same in all processes
+    return int.from_bytes(hashlib.blake2b(repr(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def parse_dates(values):
+    '''
+    Splits the strings into dates and the rest.
+    '''
+
+    dates, others = [], []
+    for value in values:
+        parsed = None
+        if DATE_RE.match(value):
+            try:
+                parsed = parse_datetime(value) or parse_date(value)
+            except ValueError:  # well formatted but not valid
+                pass
+
+        if parsed is None:
+            others.append(value)
+        else:
+            dates.append(parsed.date() if hasattr(parsed, 'date') else parsed)
+    return dates, others
+
+
+def get_date_bucket(value, interval):
+    if interval == DAY:
+        return value.isoformat()
+    if interval == WEEK:  # starting on Monday
+        return (value - timedelta(days=value.weekday())).isoformat()
+    if interval == MONTH:
+        return f'{value.year:04}-{value.month:02}'
+    return f'{value.year:04}'
+
+
+class HyperLogLog(object):
+    '''
+    Distinct count estimation with ``2 ^ precision`` one byte registers.
+    '''
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, hashed):
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / math.fsum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:  # small cardinalities
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+
+
+class QuantileSketch(object):
+    '''
+    Numbers in logarithmic buckets (DDSketch), each bucket value is
+    within ``relative_accuracy`` of the values it represents.
+    '''
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zeros = 0
+
+    def add(self, value, count=1):
+        if value > 0:
+            self.positive[math.ceil(math.log(value) / self.log_gamma)] += count
+        elif value < 0:
+            self.negative[math.ceil(math.log(-value) / self.log_gamma)] += count
+        else:
+            self.zeros += count
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def items(self):
+        '''
+        Yields the bucket values and counts in ascending order.
+        '''
+
+        for key in sorted(self.negative, reverse=True):
+            yield -self._value(key), self.negative[key]
+        if self.zeros:
+            yield 0, self.zeros
+        for key in sorted(self.positive):
+            yield self._value(key), self.positive[key]
+
+
+def get_quantiles(items, count, low, high):
+    '''
+    Returns the quartiles of the sorted ``(value, count)`` items (nearest rank).
+    '''
+
+    quantiles = {}
+    pending = [(name, max(1, math.ceil(q * count))) for name, q in QUARTILES]
+    seen = 0
+    for value, value_count in items:
+        seen += value_count
+        while pending and pending[0][1] <= seen:
+            quantiles[pending.pop(0)[0]] = min(max(value, low), high)
+    return quantiles
+
+
+def get_histogram(items, count, low, high, bins):
+    '''
+    Returns the counts of the sorted ``(value, count)`` items
+    in ``bins`` intervals of the same width between ``low`` and ``high``.
+    '''
+
+    if low == high:
+        return [{'start': low, 'end': high, 'count': count}]
+
+    width = (high - low) / bins
+    counts = [0] * bins
+    for value, value_count in items:
+        index = int((min(max(value, low), high) - low) / width)
+        counts[min(index, bins - 1)] += value_count
+
+    return [
+        {'start': low + index * width, 'end': low + (index + 1) * width, 'count': value_count}
+        for index, value_count in enumerate(counts)
+    ]
+
+
+class DistinctStats(object):
+
+    def __init__(self, limit, approximate):
+        self.limit = limit
+        self.hashes = None if approximate else set()
+        self.sketch = HyperLogLog() if approximate else None
+
+    @property
+    def approximate(self):
+        return self.sketch is not None
+
+    def update(self, values):
+        hashes = [hash_value(value) for value in values]
+        if self.hashes is not None:
+            self.hashes.update(hashes)
+            if len(self.hashes) <= self.limit:
+                return
+
+            # too many, from now on estimated
+            hashes, self.hashes = self.hashes, None
+            self.sketch = HyperLogLog()
+
+        for hashed in hashes:
+            self.sketch.add(hashed)
+
+    def count(self):
+        return self.sketch.count() if self.approximate else len(self.hashes)
+
+
+class CategoryStats(object):
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.counts = Counter()
+        self.count = 0
+        self.approximate = False
+
+    def update(self, values):
+        self.count += len(values)
+        self.counts.update(values)
+        if len(self.counts) > self.limit * 2:
+            # keep only the most common ones, the rest go to "other"
+            self.counts = Counter(dict(self.counts.most_common(self.limit)))
+            self.approximate = True
+
+    def as_dict(self, top):
+        values = self.counts.most_common(top)
+        return {
+            'count': self.count,
+            'top': [{'value': value, 'count': count} for value, count in values],
+            'other': self.count - sum(count for _, count in values),
+            'approximate': self.approximate,
+        }
+
+
+class NumericStats(object):
+
+    def __init__(self, limit, approximate):
+        self.limit = limit
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.values = None if approximate else Counter()
+        self.sketch = QuantileSketch() if approximate else None
+
+    @property
+    def approximate(self):
+        return self.sketch is not None
+
+    def update(self, values):
+        self.count += len(values)
+        self.sum += math.fsum(values)
+        low, high = min(values), max(values)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+        if self.values is not None:
+            self.values.update(values)
+            if len(self.values) <= self.limit:
+                return
+
+            # too many, from now on in the sketch
+            self.sketch = QuantileSketch()
+            for value, count in self.values.items():
+                self.sketch.add(value, count)
+            self.values = None
+            return
+
+        for value in values:
+            self.sketch.add(value)
+
+    def items(self):
+        return self.sketch.items() if self.approximate else sorted(self.values.items())
+
+    def as_dict(self, bins):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count,
+            'quartiles': get_quantiles(self.items(), self.count, self.min, self.max),
+            'histogram': get_histogram(self.items(), self.count, self.min, self.max, bins),
+            'approximate': self.approximate,
+        }
+
+
+class DateStats(object):
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.buckets = Counter()
+
+    def update(self, values):
+        self.count += len(values)
+        low, high = min(values), max(values)
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self.buckets.update([get_date_bucket(value, self.interval) for value in values])
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'min': self.min.isoformat(),
+            'max': self.max.isoformat(),
+            'interval': self.interval,
+            'buckets': [{'start': key, 'count': self.buckets[key]} for key in sorted(self.buckets)],
+        }
+
+
+class ColumnAggregation(object):
+    '''
+    Aggregations of the values of one mask column (jsonpath).
+    '''
+
+    def __init__(self, column, approximate=False, interval=MONTH, limit=None):
+        limit = limit or settings.AGGREGATION_EXACT_LIMIT
+        self.column = column
+        self.keys = [key for key in column.split('.') if key and key not in AVRO_FLAGS]
+        self.missing = 0
+        self.distinct = DistinctStats(limit, approximate)
+        self.categories = CategoryStats(limit)
+        self.numbers = NumericStats(limit, approximate)
+        self.dates = DateStats(interval)
+
+    def update(self, payloads):
+        values = [get_value(payload, self.keys) for payload in payloads]
+        values = [value for value in values if value not in (None, [])]
+        self.missing += len(payloads) - len(values)
+
+        # the lists items are aggregated one by one, the objects are skipped
+        values = [value for value in flatten(values) if value is not None and not isinstance(value, dict)]
+        if not values:
+            return
+        self.distinct.update(values)
+
+        numbers = [
+            value
+            for value in values
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+        ]
+        if numbers:
+            self.numbers.update(numbers)
+
+        dates, strings = parse_dates([value for value in values if isinstance(value, str)])
+        if dates:
+            self.dates.update(dates)
+
+        categories = strings + [value for value in values if isinstance(value, bool)]
+        if categories:
+            self.categories.update(categories)
+
+    def as_dict(self, bins=10, top=20):
+        return {
+            'column': self.column,
+            'missing': self.missing,
+            'distinct': self.distinct.count(),
+            'approximate': self.distinct.approximate,
+            'categories': self.categories.as_dict(top) if self.categories.count else None,
+            'numbers': self.numbers.as_dict(bins) if self.numbers.count else None,
+            'dates': self.dates.as_dict() if self.dates.count else None,
+        }
+
+
+def aggregate(pages, columns, approximate=False, bins=10, interval=MONTH, top=20):
+    '''
+    Aggregates the columns of the entities payload page by page.
+
+    Returns the number of entities and the aggregations of each column.
+    '''
+
+    aggregations = [ColumnAggregation(column, approximate, interval) for column in columns]
+    rows = 0
+    for page in pages:
+        payloads = [entity.get('payload') or {} for entity in page.get('results') or []]
+        rows += len(payloads)
+        for aggregation in aggregations:
+            aggregation.update(payloads)
+
+    return {
+        'rows': rows,
+        'columns': [aggregation.as_dict(bins, top) for aggregation in aggregations],
+    }
@@ -0,0 +1,218 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import logging
+
+from http.cookiejar import DefaultCookiePolicy
+from time import time
+
+from django.conf import settings
+
+from ..middleware import FLUSH_SIZE, get_compressor, get_encoding, is_compressible
+from . import cache, metrics, tokens
+from .proxy import get_exposed_headers
+
+'''
+Non blocking calls to the external apps used by the ASGI server (see ``gather.asgi``).
+
+Each process keeps one ``httpx.AsyncClient`` per external app, the waits for
+the upstream responses do not hold any thread, only the event loop, so
+a single process can keep up to ``ASYNC_PROXY_MAX_CONNECTIONS`` calls
+with each external app at the same time.
+
+Requires ``httpx``.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+_clients = {}
+
+
+def get_client(app_name):
+    '''
+    Returns the current process client linked to the external app.
+    '''
+
+    if app_name not in _clients:
+        import httpx
+
+        client = httpx.AsyncClient(
+            timeout=(settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT),
+            pool_limits=httpx.PoolLimits(
+                soft_limit=settings.UPSTREAM_POOL_SIZE,
+                hard_limit=settings.ASYNC_PROXY_MAX_CONNECTIONS,
+            ),
+        )
+        # the client is shared among users, never keep their cookies
+        client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        _clients[app_name] = client
+
+    return _clients[app_name]
+
+
+async def close_clients():
+    '''
+    Closes all the pooled connections.
+    '''
+
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def encode_headers(headers):
+    return [(key.lower().encode('latin1'), value.encode('latin1')) for key, value in headers]
+
+
+def is_timeout(error):
+    import httpx
+
+    # in the latest Python versions the socket timeouts are raised as network errors
+    return isinstance(error, httpx.TimeoutException) or isinstance(error.__cause__, TimeoutError)
+
+
+async def send_error(send, status, headers, message):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': encode_headers([*headers, ('Content-Type', 'text/plain; charset=utf-8')]),
+    })
+    await send({'type': 'http.response.body', 'body': message.encode('utf-8')})
+
+
+async def compress_stream(chunks, encoding):
+    '''
+    Compresses the chunks as they come, like ``gather.middleware.compress_sequence``.
+    '''
+
+    process, flush, finish = get_compressor(encoding)
+    pending = 0
+    async for chunk in chunks:
+        data = process(chunk)
+        pending += len(chunk)
+        if pending >= FLUSH_SIZE:
+            data += flush()
+            pending = 0
+        if data:
+            yield data
+    yield finish()
+
+
+async def forward(call, headers, send):
+    '''
+    Executes the proxy ``UpstreamCall`` and streams the upstream response
+    to the client without decoding it.
+
+    The ``headers`` are the ones added by the Django middlewares
+    (``Set-Cookie``, ``Vary``...), the exposed upstream ones are added to them.
+
+    The body is compressed, as the ``CompressionMiddleware`` would do,
+    unless the external app already did it.
+    '''
+
+    import httpx
+
+    client = get_client(call.app_name)
+    route = metrics.get_route(call.url)
+    in_flight = metrics.UPSTREAM_IN_FLIGHT.labels(call.app_name)
+
+    # without it the client would ask for compressed content on behalf of the user
+    request_headers = {'Accept-Encoding': 'identity', **call.headers}
+    request = client.build_request(
+        method=call.method,
+        url=call.url,
+        data=call.body or None,
+        headers=request_headers,
+    )
+
+    start = time()
+    in_flight.inc()
+    try:
+        response = await client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        logger.warning(f'{call.method}  {call.url}: {str(e) or type(e).__name__}')
+        if is_timeout(e):
+            metrics.UPSTREAM_TIMEOUTS.labels(call.app_name, route).inc()
+            await send_error(send, 504, headers, 'Gateway Timeout')
+        else:
+            await send_error(send, 502, headers, 'Bad Gateway')
+        return
+    finally:
+        in_flight.dec()
+
+    metrics.observe_response(response, call.app_name, route, time() - start, streamed=True)
+
+    loop = asyncio.get_event_loop()
+    if call.path and response.status_code < 400:
+        await loop.run_in_executor(None, cache.invalidate, call.app_name, call.realm, call.path)
+    if call.user_id and response.status_code == 401:
+        # the app token is not valid anymore
+        await loop.run_in_executor(None, tokens.invalidate, call.user_id, call.app_name)
+
+    response_headers = [*headers, *get_exposed_headers(response.headers)]
+    if 'Content-Type' in response.headers:
+        response_headers.append(('Content-Type', response.headers['Content-Type']))
+
+    has_body = response.status_code not in (204, 304) and call.method != 'HEAD'
+    content_length = response.headers.get('Content-Length')
+    encoding = None
+    if (
+        call.accept_encoding is not None and
+        has_body and
+        is_compressible(response.headers, int(content_length) if content_length else None)
+    ):
+        varies = [value for key, value in response_headers if key.lower() == 'vary']
+        response_headers = [(key, value) for key, value in response_headers if key.lower() != 'vary']
+        response_headers.append(('Vary', ', '.join([*varies, 'Accept-Encoding'])))
+        encoding = get_encoding(call.accept_encoding)
+    if encoding:
+        response_headers = [
+            # the compressed content is not byte by byte the same
+            (key, 'W/' + value if key.lower() == 'etag' and value.startswith('"') else value)
+            for key, value in response_headers
+            if key.lower() != 'content-length'
+        ]
+        response_headers.append(('Content-Encoding', encoding))
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': encode_headers(response_headers),
+    })
+
+    size = 0
+
+    async def read():
+        nonlocal size
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+            yield chunk
+
+    try:
+        if has_body:
+            chunks = compress_stream(read(), encoding) if encoding else read()
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        await response.aclose()
+        metrics.observe_size(response, size)
+
+    await send({'type': 'http.response.body', 'body': b''})
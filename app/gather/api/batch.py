@@ -0,0 +1,227 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+from time import time
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.http import Http404
+from django.urls import Resolver404, get_script_prefix, get_urlconf, resolve, set_script_prefix, set_urlconf
+from django.utils import translation
+from django.utils.translation import gettext as _
+
+'''
+Executes a list of GET calls to the API (Gather, Aether Kernel and Aether ODK)
+concurrently within the server and returns all their responses at once.
+
+Only the surveys and masks list and detail routes and the external apps
+proxy routes are allowed, and their responses can not be bigger than
+``BATCH_MAX_BODY_SIZE`` bytes (the streaming ones are read up to that size).
+
+Each call is dispatched directly to its view (without going through the
+middlewares again) with the same user, session and headers of the batch
+request, in a pool of ``BATCH_MAX_WORKERS`` threads shared by all the batches,
+and must finish within ``BATCH_DEADLINE`` seconds since the batch started.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+EXCLUDED_META = [
+    # the batch request body
+    'CONTENT_LENGTH',
+    'CONTENT_TYPE',
+    'HTTP_X_METHOD',
+    'wsgi.input',
+    # the bodies are returned decoded and complete
+    'HTTP_ACCEPT_ENCODING',
+    'HTTP_IF_MODIFIED_SINCE',
+    'HTTP_IF_NONE_MATCH',
+    'HTTP_RANGE',
+]
+
+# the GET list and detail routes of the API (url names)
+GATHER_ROUTES = ['survey-list', 'survey-detail', 'mask-list', 'mask-detail']
+PROXY_ROUTES = [f'{app}-proxy-{kind}' for app in settings.AETHER_APPS for kind in ('root', 'path')]
+ALLOWED_ROUTES = GATHER_ROUTES + PROXY_ROUTES
+
+# the threads are started on demand and reused by the next batches
+executor = ThreadPoolExecutor(max_workers=settings.BATCH_MAX_WORKERS, thread_name_prefix='batch')
+
+
+def resolve_path(path):
+    '''
+    Returns the resolver match of the API path or ``None`` if it is not allowed.
+    '''
+
+    url = urlparse(path)
+    if url.scheme or url.netloc:  # same origin only
+        return None
+
+    prefix = get_script_prefix()
+    if not url.path.startswith(prefix):
+        return None
+
+    try:
+        match = resolve('/' + url.path[len(prefix):])
+    except Resolver404:
+        return None
+
+    if 'api/' not in match.route or match.url_name not in ALLOWED_ROUTES:
+        return None
+    return match
+
+
+def build_request(request, path):
+    '''
+    Builds the GET request of the path based on the batch request.
+    '''
+
+    url = urlparse(path)
+    prefix = get_script_prefix()
+
+    meta = {key: value for key, value in request.META.items() if key not in EXCLUDED_META}
+    meta.update({
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': prefix.rstrip('/'),
+        'PATH_INFO': '/' + url.path[len(prefix):],
+        'QUERY_STRING': url.query,
+        'wsgi.input': BytesIO(),
+    })
+
+    sub_request = WSGIRequest(meta)
+    # already authenticated
+    sub_request.user = request.user
+    sub_request.session = request.session
+    return sub_request
+
+
+def get_content(response):
+    '''
+    Returns the response content or ``None`` if it is bigger than ``BATCH_MAX_BODY_SIZE``,
+    the streaming content is read up to that size.
+    '''
+
+    max_size = settings.BATCH_MAX_BODY_SIZE
+    if not response.streaming:
+        return response.content if len(response.content) <= max_size else None
+
+    chunks = []
+    size = 0
+    try:
+        for chunk in response.streaming_content:
+            size += len(chunk)
+            if size > max_size:
+                return None
+            chunks.append(chunk)
+    finally:
+        # releases the upstream connection
+        response.close()
+    return b''.join(chunks)
+
+
+def get_body(response, content):
+    if not content:
+        return None
+
+    if 'json' in response.get('Content-Type', ''):
+        try:
+            return json.loads(content)
+        except ValueError:
+            pass
+    return content.decode(response.charset or 'utf-8', errors='replace')
+
+
+def execute(request, paths, deadline=None):
+    '''
+    Executes the GET calls to the given paths and returns
+    the list of results in the same order:
+
+        {"url": "/api/...", "status": 200, "body": {...}}
+
+    The not allowed paths get the ``400`` status, the too large responses
+    the ``413`` status and the calls that did not finish in time
+    (``BATCH_DEADLINE`` by default) the ``504`` status.
+    '''
+
+    # the thread locals of the current request
+    prefix = get_script_prefix()
+    urlconf = get_urlconf()
+    language = translation.get_language()
+
+    def call(path, match):
+        set_script_prefix(prefix)
+        set_urlconf(urlconf)
+        translation.activate(language)
+
+        try:
+            sub_request = build_request(request, path)
+            sub_request.resolver_match = match
+            response = match.func(sub_request, *match.args, **match.kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+            content = get_content(response)
+            if content is None:
+                return {'status': 413, 'body': {'detail': _('Response too large.')}}
+            return {'status': response.status_code, 'body': get_body(response, content)}
+
+        except Http404 as e:
+            return {'status': 404, 'body': {'detail': str(e)}}
+
+        except PermissionDenied as e:
+            return {'status': 403, 'body': {'detail': str(e)}}
+
+        except Exception as e:
+            logger.exception(e)
+            return {'status': 500, 'body': {'detail': str(e)}}
+
+        finally:
+            # each thread opens its own database connections
+            connections.close_all()
+
+    start = time()
+    results = [{'url': path, 'status': None, 'body': None} for path in paths]
+    futures = {}
+
+    for index, path in enumerate(paths):
+        match = resolve_path(path)
+        if match is None:
+            results[index].update({'status': 400, 'body': {'detail': _('Not allowed URL.')}})
+        else:
+            futures[executor.submit(call, path, match)] = index
+
+    done, not_done = wait(futures.keys(), timeout=deadline or settings.BATCH_DEADLINE)
+    for future in done:
+        results[futures[future]].update(future.result())
+
+    for future in not_done:
+        future.cancel()
+        results[futures[future]].update({'status': 504, 'body': {'detail': _('Deadline exceeded.')}})
+
+    # the running calls are not awaited
+    logger.debug(f'Batch of {len(paths)} calls in {time() - start:.3f} seconds')
+
+    return results
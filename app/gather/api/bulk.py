@@ -0,0 +1,204 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from django.db import IntegrityError, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+
+from aether.sdk.multitenancy.utils import filter_by_realm
+
+from . import querycache
+from .models import Survey, Mask
+from .serializers import MASK_VALUES, MaskBulkItemSerializer, masks_to_representation
+
+'''
+Creates, updates and deletes masks in bulk.
+
+All the masks are validated together, the survey realm and the mask names
+uniqueness by survey (``unique_mask_name_by_survey`` constraint) take into
+account the rest of masks of the bulk operation and the existing ones.
+
+If any mask is not valid nothing is written, otherwise all the changes are
+written with ``bulk_update`` and ``bulk_create`` within one transaction.
+
+Each mask gets its own result:
+
+    {"status": 201, "data": {...}}          created
+    {"status": 200, "data": {...}}          updated
+    {"status": 204, "id": 1}                deleted
+    {"status": 400, "errors": {...}}        invalid
+    {"status": 404, "errors": {...}}        not found in the current realm
+    {"status": 424}                         valid but not written due to other errors
+'''
+
+MSG_NOT_FOUND = _('Not found.')
+MSG_UNIQUE_NAME = _('The fields survey, name must make a unique set.')
+MSG_SURVEY_NOT_FOUND = _('Invalid pk "{}" - object does not exist.')
+
+FIELDS = ('survey', 'name', 'columns')
+
+
+def _error(status_code, errors):
+    return {'status': status_code, 'errors': errors}
+
+
+def _validate_items(items, context, partial):
+    results = []
+    for item in items:
+        serializer = MaskBulkItemSerializer(data=item, context=context, partial=partial)
+        if not serializer.is_valid():
+            results.append(_error(status.HTTP_400_BAD_REQUEST, serializer.errors))
+        elif partial and 'id' not in serializer.validated_data:
+            results.append(_error(status.HTTP_400_BAD_REQUEST, {'id': [_('This field is required.')]}))
+        else:
+            results.append(serializer.validated_data)
+    return results
+
+
+def _is_valid(result):
+    return 'errors' not in result
+
+
+def execute(request, data):
+    '''
+    Executes the bulk operation, expects the validated ``MaskBulkSerializer`` data.
+
+    Returns the tuple ``(status code, results)``.
+    '''
+
+    context = {'request': request}
+    created = _validate_items(data['create'], context, partial=False)
+    updated = _validate_items(data['update'], context, partial=True)
+
+    # the masks to update or delete must be accessible in the current realm
+    ids = [item['id'] for item in updated if _is_valid(item)] + data['delete']
+    masks = {
+        mask.pk: mask
+        for mask in filter_by_realm(request, Mask.objects.filter(pk__in=ids), 'survey')
+    }
+
+    for index, item in enumerate(updated):
+        if _is_valid(item) and item['id'] not in masks:
+            updated[index] = _error(status.HTTP_404_NOT_FOUND, {'id': [MSG_NOT_FOUND]})
+
+    deleted = [
+        {'status': status.HTTP_204_NO_CONTENT, 'id': pk}
+        if pk in masks
+        else _error(status.HTTP_404_NOT_FOUND, {'id': [MSG_NOT_FOUND]})
+        for pk in data['delete']
+    ]
+
+    # the new surveys must be accessible in the current realm
+    surveys_ids = set([item['survey'] for item in created + updated if _is_valid(item) and 'survey' in item])
+    surveys = set(filter_by_realm(request, Survey.objects.filter(pk__in=surveys_ids)).values_list('pk', flat=True))
+    for results in (created, updated):
+        for index, item in enumerate(results):
+            if _is_valid(item) and 'survey' in item and item['survey'] not in surveys:
+                results[index] = _error(status.HTTP_400_BAD_REQUEST, {
+                    'survey': [MSG_SURVEY_NOT_FOUND.format(item['survey'])],
+                })
+
+    _validate_unique_names(masks, created, updated, deleted)
+
+    results = {'create': created, 'update': updated, 'delete': deleted}
+    if not all([_is_valid(item) for item in created + updated + deleted]):
+        return status.HTTP_400_BAD_REQUEST, _failed_dependency(results)
+
+    try:
+        with transaction.atomic():
+            results = _write(masks, created, updated, deleted)
+    except IntegrityError as ie:
+        # i.e. swapping names between masks of the same survey
+        for items in results.values():
+            for index, item in enumerate(items):
+                items[index] = _error(status.HTTP_400_BAD_REQUEST, {'non_field_errors': [str(ie)]})
+        return status.HTTP_400_BAD_REQUEST, results
+
+    return status.HTTP_200_OK, results
+
+
+def _validate_unique_names(masks, created, updated, deleted):
+    '''
+    Checks that the resulting masks names are unique by survey.
+    '''
+
+    deleted_ids = set([item['id'] for item in deleted if _is_valid(item)])
+    changes = {item['id']: item for item in updated if _is_valid(item)}
+
+    def get_key(item, mask=None):
+        survey_id = item.get('survey', mask.survey_id if mask else None)
+        name = item.get('name', mask.name if mask else None)
+        return (survey_id, name)
+
+    # the existing masks of the involved surveys that are not going to change
+    surveys_ids = set(
+        [item['survey'] for item in created + updated if _is_valid(item) and 'survey' in item] +
+        [mask.survey_id for mask in masks.values()]
+    )
+    names = {}
+    existing = Mask.objects.filter(survey_id__in=surveys_ids).exclude(pk__in=deleted_ids | set(changes.keys()))
+    for survey_id, name in existing.values_list('survey_id', 'name'):
+        names[(survey_id, name)] = None
+
+    for results in (updated, created):
+        for index, item in enumerate(results):
+            if not _is_valid(item):
+                continue
+
+            key = get_key(item, masks.get(item.get('id')))
+            if key in names:
+                results[index] = _error(status.HTTP_400_BAD_REQUEST, {'non_field_errors': [MSG_UNIQUE_NAME]})
+            else:
+                names[key] = index
+
+
+def _failed_dependency(results):
+    return {
+        key: [item if not _is_valid(item) else {'status': status.HTTP_424_FAILED_DEPENDENCY} for item in items]
+        for key, items in results.items()
+    }
+
+
+def _write(masks, created, updated, deleted):
+    Mask.objects.filter(pk__in=[item['id'] for item in deleted]).delete()
+
+    to_update = []
+    for item in updated:
+        mask = masks[item['id']]
+        for field in FIELDS:
+            if field in item:
+                setattr(mask, 'survey_id' if field == 'survey' else field, item[field])
+        to_update.append(mask)
+    if to_update:
+        Mask.objects.bulk_update(to_update, fields=FIELDS)
+
+    to_create = Mask.objects.bulk_create([
+        Mask(survey_id=item['survey'], name=item['name'], columns=item['columns'])
+        for item in created
+    ])
+    # the bulk operations do not invalidate the cached queries
+    transaction.on_commit(lambda: querycache.invalidate(Mask))
+
+    def represent(mask):
+        return masks_to_representation([{field: getattr(mask, field) for field in MASK_VALUES}])[0]
+
+    return {
+        'create': [{'status': status.HTTP_201_CREATED, 'data': represent(mask)} for mask in to_create],
+        'update': [{'status': status.HTTP_200_OK, 'data': represent(mask)} for mask in to_update],
+        'delete': deleted,
+    }
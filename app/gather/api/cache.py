@@ -0,0 +1,237 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import logging
+import pickle
+import re
+import threading
+
+from collections import OrderedDict
+from time import time
+
+from django.conf import settings
+
+'''
+Two tiers cache for the proxied GET responses:
+
+    - in process LRU cache (``PROXY_CACHE_SIZE`` entries),
+    - shared REDIS cache (if ``PROXY_CACHE_REDIS`` is enabled).
+
+Entries are keyed by app + realm + user + url (without user for the
+``PROXY_CACHE_SHARED_ROUTES``) and by the current "generation"
+of the requested resource (the first path segment like ``projects``),
+any write call to a resource moves on its generation and
+makes unreachable all the previous entries.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+
+class LRUCache(object):
+    '''
+    Thread safe "Least Recently Used" cache with expiration time.
+    '''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                return default
+
+            if expires is not None and expires < time():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._data[key] = (value, time() + timeout if timeout else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local = LRUCache(settings.PROXY_CACHE_SIZE)
+_generations = {}
+_generations_lock = threading.Lock()
+_redis = None
+
+
+def get_redis():
+    if not settings.PROXY_CACHE_REDIS:
+        return None
+    return get_redis_client()
+
+
+def get_redis_client():
+    '''
+    Returns the process REDIS client (also used by other caches).
+    '''
+
+    global _redis
+
+    if _redis is None:
+        import redis
+
+        _redis = redis.Redis(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=settings.REDIS_DB,
+            password=settings.REDIS_PASSWORD,
+            socket_timeout=settings.PROXY_CACHE_REDIS_TIMEOUT,
+        )
+    return _redis
+
+
+def _redis_call(method, *args):
+    client = get_redis()
+    if client is None:
+        return None
+
+    try:
+        return getattr(client, method)(*args)
+    except Exception as e:
+        # degrade to the local cache
+        logger.warning(f'Proxy cache REDIS error: {str(e)}')
+        return None
+
+
+def clear():
+    _local.clear()
+    with _generations_lock:
+        _generations.clear()
+
+
+def is_cacheable(app_name, path):
+    '''
+    Indicates if the GET responses of the external app path can be cached.
+    '''
+
+    if not settings.PROXY_CACHE_ENABLED:
+        return False
+    return _match_routes(settings.PROXY_CACHE_ROUTES, app_name, path)
+
+
+def is_shared(app_name, path):
+    '''
+    Indicates if the cached responses of the external app path
+    depend only on the realm and are shared by all its users.
+    '''
+
+    return _match_routes(settings.PROXY_CACHE_SHARED_ROUTES, app_name, path)
+
+
+def _match_routes(routes, app_name, path):
+    app = app_name.replace(settings.AETHER_PREFIX, '', 1)
+    return any([
+        re.match(route, path.lstrip('/'))
+        for route in routes.get(app, [])
+        if route
+    ])
+
+
+def get_resource(path):
+    '''
+    Returns the resource name of the path: the first segment without
+    the format or the "stats" suffix.
+
+        projects-stats.json                => projects
+        projects/{id}/schemas-skeleton.json => projects
+    '''
+
+    name = path.lstrip('/').split('/')[0].split('.')[0]
+    return re.sub(r'-stats$', '', name)
+
+
+def _generation_key(app, realm, resource):
+    return f'gather:proxy:gen:{app}:{realm}:{resource}'
+
+
+def get_generation(app, realm, resource):
+    key = _generation_key(app, realm, resource)
+    value = _redis_call('get', key)
+    if value is not None:
+        return int(value)
+    return _generations.get(key, 0)
+
+
+def invalidate(app, realm, path):
+    '''
+    Moves on the generation of the path resource.
+    '''
+
+    key = _generation_key(app, realm, get_resource(path))
+    with _generations_lock:
+        _generations[key] = _generations.get(key, 0) + 1
+    _redis_call('incr', key)
+
+
+def build_key(app, realm, user_id, path, url):
+    generation = get_generation(app, realm, get_resource(path))
+    value = f'{app}|{realm}|{user_id}|{generation}|{url}'
+    return 'gather:proxy:' + hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def get_entry(key):
+    entry = _local.get(key)
+    if entry is None:
+        value = _redis_call('get', key)
+        if value is not None:
+            entry = pickle.loads(value)
+            _local.set(key, entry, settings.PROXY_CACHE_STALE_TTL)
+    return entry
+
+
+def get_shared_entry(key):
+    '''
+    Returns the REDIS entry skipping the in process one, that might be outdated.
+    '''
+
+    value = _redis_call('get', key)
+    if value is None:
+        return None
+
+    entry = pickle.loads(value)
+    _local.set(key, entry, settings.PROXY_CACHE_STALE_TTL)
+    return entry
+
+
+def set_entry(key, entry):
+    _local.set(key, entry, settings.PROXY_CACHE_STALE_TTL)
+    _redis_call('setex', key, settings.PROXY_CACHE_STALE_TTL, pickle.dumps(entry))
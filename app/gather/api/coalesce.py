@@ -0,0 +1,133 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+import threading
+
+from time import sleep, time
+
+from django.conf import settings
+
+from .cache import get_redis
+
+'''
+Single flight execution of the identical concurrent calls.
+
+The first call with a key executes it, the rest of concurrent calls with
+the same key wait for it and take its result instead of executing it again.
+
+In process the calls wait for the running one in the same process, with
+``PROXY_COALESCE_REDIS`` only one process executes it (the one that takes
+the REDIS lock) and the rest wait till its result is available (in the
+shared cache).
+
+If the running call fails or takes longer than ``PROXY_COALESCE_TIMEOUT``
+the waiting calls are executed as usual.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+POLL_INTERVAL = 0.05  # seconds
+
+_flights = {}
+_lock = threading.Lock()
+
+
+class Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.failed = False
+        self.result = None
+
+
+def run(key, func, lookup=None):
+    '''
+    Executes ``func`` or waits for the running call with the same key.
+
+    ``lookup`` returns the result of the call executed by another process
+    if already available, ``None`` otherwise.
+
+    Returns the result and whether it comes from another call.
+    '''
+
+    if not settings.PROXY_COALESCE_ENABLED:
+        return func(), False
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+
+    if not leader:
+        if flight.done.wait(settings.PROXY_COALESCE_TIMEOUT) and not flight.failed:
+            return flight.result, True
+        return func(), False
+
+    try:
+        flight.result, coalesced = _run_once(key, func, lookup)
+        return flight.result, coalesced
+    except Exception:
+        flight.failed = True
+        raise
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def _run_once(key, func, lookup):
+    client = get_redis() if settings.PROXY_COALESCE_REDIS and lookup else None
+    if client is None:
+        return func(), False
+
+    try:
+        lock = client.lock(f'{key}:lock', timeout=settings.PROXY_COALESCE_TIMEOUT)
+        acquired = lock.acquire(blocking=False)
+    except Exception as e:
+        logger.warning(f'Coalesce REDIS error: {str(e)}')
+        return func(), False
+
+    if acquired:
+        try:
+            return func(), False
+        finally:
+            try:
+                lock.release()
+            except Exception as e:  # expired
+                logger.warning(f'Coalesce REDIS error: {str(e)}')
+
+    # another process is executing the call
+    deadline = time() + settings.PROXY_COALESCE_TIMEOUT
+    while time() < deadline:
+        sleep(POLL_INTERVAL)
+        try:
+            locked = lock.locked()
+        except Exception as e:
+            logger.warning(f'Coalesce REDIS error: {str(e)}')
+            break
+
+        result = lookup()
+        if result is not None:
+            return result, True
+        if not locked:  # the call failed or its result cannot be shared
+            break
+
+    return func(), False
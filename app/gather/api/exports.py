@@ -0,0 +1,463 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import csv
+import hashlib
+import io
+import json
+import logging
+import re
+import tempfile
+import zipfile
+
+from contextlib import contextmanager
+from datetime import timedelta
+from time import time
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .masks import AVRO_FLAGS, apply_mask
+from .models import ExportFile
+
+'''
+Exports the kernel entities of a survey as CSV, NDJSON or XLSX files.
+
+The entities are requested to kernel page by page and each page is written
+and yielded before requesting the next one, so the memory used does not
+depend on the number of entities. The file content can be streamed in the
+response or written, through a temporary file, into the storage.
+
+CSV and XLSX files contain one column per mask column (jsonpath) besides
+the entity id, NDJSON files contain the masked entities one per line.
+
+The generated files are kept in the storage (``ExportFile``) and serve the
+next identical export requests till the survey entities change, the least
+recently used ones are deleted beyond ``EXPORT_CACHE_MAX_FILES`` files or
+``EXPORT_CACHE_MAX_SIZE`` bytes.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+CSV_FORMAT = 'csv'
+NDJSON_FORMAT = 'ndjson'
+XLSX_FORMAT = 'xlsx'
+
+CONTENT_TYPES = {
+    CSV_FORMAT: 'text/csv',
+    NDJSON_FORMAT: 'application/x-ndjson',
+    XLSX_FORMAT: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+EXPORT_FORMATS = list(CONTENT_TYPES.keys())
+
+# Excel 2007 limit (the header takes one row)
+XLSX_MAX_ROWS = 1048575
+
+# characters not allowed in XML 1.0 documents
+XML_ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_FILES = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="entities" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+XLSX_SHEET = 'xl/worksheets/sheet1.xml'
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+
+class ExportStats(object):
+    '''
+    Number of exported rows and throughput.
+    '''
+
+    def __init__(self):
+        self.rows = 0
+        self.start = time()
+        self.end = None
+
+    @property
+    def seconds(self):
+        return (self.end or time()) - self.start
+
+    @property
+    def rows_per_second(self):
+        seconds = self.seconds
+        return self.rows / seconds if seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def get_max_rows(file_format):
+    max_rows = int(settings.EXPORT_MAX_ROWS_SIZE or 0)
+    if file_format == XLSX_FORMAT:
+        return min(max_rows, XLSX_MAX_ROWS) if max_rows > 0 else XLSX_MAX_ROWS
+    return max(max_rows, 0)
+
+
+def get_value(value, keys):
+    '''
+    Returns the value of the jsonpath keys, the lists are traversed item by item.
+    '''
+
+    for index, key in enumerate(keys):
+        if isinstance(value, list):
+            return [get_value(item, keys[index:]) for item in value]
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def to_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def iter_entities(pages, max_rows, stats):
+    '''
+    Yields the entities of each page (as a list) up to ``max_rows`` entities.
+    '''
+
+    for page in pages:
+        results = page.get('results') or []
+        if max_rows:
+            results = results[:max_rows - stats.rows]
+
+        if results:
+            stats.rows += len(results)
+            yield results
+
+        if max_rows and stats.rows >= max_rows:
+            break
+
+    if hasattr(pages, 'close'):
+        pages.close()  # no more upstream calls
+
+
+class _Buffer(object):
+    '''
+    Write only file object that keeps the written content until it is taken.
+    '''
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        content = b''.join(self.chunks)
+        self.chunks = []
+        return content
+
+
+def _csv_content(columns, entities):
+    keys = [[key for key in column.split('.') if key not in AVRO_FLAGS] for column in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(['id'] + columns)
+    yield buffer.getvalue().encode('utf-8')
+
+    for results in entities:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([
+            [entity.get('id')] + [to_cell(get_value(entity.get('payload'), k)) for k in keys]
+            for entity in results
+        ])
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_content(tree, entities):
+    for results in entities:
+        yield ''.join([json.dumps(apply_mask(entity, tree)) + '\n' for entity in results]).encode('utf-8')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        text = escape(XML_ILLEGAL_CHARS.sub('', str(to_cell(value))))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+    return f'<c><v>{value}</v></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join([_xlsx_cell(value) for value in values]) + '</row>'
+
+
+def _xlsx_content(columns, entities):
+    keys = [[key for key in column.split('.') if key not in AVRO_FLAGS] for column in columns]
+    buffer = _Buffer()
+
+    # the zip file is written without seeking back (sizes go after each file)
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as xlsx:
+        for name, content in XLSX_FILES.items():
+            xlsx.writestr(name, content)
+
+        with xlsx.open(XLSX_SHEET, mode='w', force_zip64=True) as sheet:
+            sheet.write((XLSX_SHEET_START + _xlsx_row(['id'] + columns)).encode('utf-8'))
+            yield buffer.take()
+
+            for results in entities:
+                sheet.write(''.join([
+                    _xlsx_row([entity.get('id')] + [get_value(entity.get('payload'), k) for k in keys])
+                    for entity in results
+                ]).encode('utf-8'))
+                yield buffer.take()
+
+            sheet.write(XLSX_SHEET_END.encode('utf-8'))
+
+    yield buffer.take()
+
+
+def export_content(pages, columns, tree, file_format, stats=None):
+    '''
+    Yields the file content in chunks, one per page of entities.
+
+    Expects:
+        - ``pages``:       the kernel entities pages iterator,
+        - ``columns``:     the mask columns,
+        - ``tree``:        the mask columns tree (see ``gather.api.masks``),
+        - ``file_format``: one of ``EXPORT_FORMATS``,
+        - ``stats``:       the ``ExportStats`` instance to update (optional).
+    '''
+
+    stats = stats or ExportStats()
+    entities = iter_entities(pages, get_max_rows(file_format), stats)
+
+    if file_format == CSV_FORMAT:
+        content = _csv_content(columns, entities)
+    elif file_format == NDJSON_FORMAT:
+        content = _ndjson_content(tree, entities)
+    elif file_format == XLSX_FORMAT:
+        content = _xlsx_content(columns, entities)
+    else:
+        raise ValueError(f'Unknown export format "{file_format}"')
+
+    yield from content
+
+    stats.end = time()
+    logger.info(
+        f'Exported {stats.rows} rows as {file_format} in {stats.seconds:.3f} seconds '
+        f'({stats.rows_per_second:.1f} rows/s)'
+    )
+
+
+@contextmanager
+def temporary_file(content):
+    '''
+    Writes the content chunks into a temporary file and returns it.
+    '''
+
+    with tempfile.TemporaryFile() as fp:
+        for chunk in content:
+            fp.write(chunk)
+        fp.seek(0)
+        yield fp
+
+
+def write_to_storage(content, name):
+    '''
+    Writes the content chunks into the storage file
+    and returns the name of the stored file.
+    '''
+
+    with temporary_file(content) as fp:
+        return default_storage.save(name, File(fp))
+
+
+def build_key(mask, file_format, params, version):
+    '''
+    Returns the export file key.
+
+    Expects:
+        - ``mask``:        the mask instance (survey + columns),
+        - ``file_format``: one of ``EXPORT_FORMATS``,
+        - ``params``:      the kernel entity filters,
+        - ``version``:     the entities version (see ``get_version``).
+    '''
+
+    value = json.dumps([
+        str(mask.survey_id),
+        mask.pk,
+        mask.columns,
+        file_format,
+        sorted(params.items()),
+        get_max_rows(file_format),
+        version,
+    ])
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def get_version(page):
+    '''
+    Returns the entities version based on the kernel entities page
+    sorted by the latest modified: count + last modified date.
+    '''
+
+    results = page.get('results') or [{}]
+    return f'{page.get("count", 0)}|{results[0].get("modified")}'
+
+
+def get_export_file(key):
+    '''
+    Returns the export file with the given key (if any) and marks it as used.
+    '''
+
+    export_file = ExportFile.objects.filter(key=key).first()
+    if export_file:
+        ExportFile.objects.filter(pk=export_file.pk).update(accessed=timezone.now())
+    return export_file
+
+
+def save_export_file(key, mask, file_format, fp, filename, stats):
+    '''
+    Saves the file content into the storage and
+    deletes the least recently used files if needed.
+
+    Returns the export file with the given key.
+    '''
+
+    export_file = ExportFile(key=key, mask=mask, file_format=file_format, rows=stats.rows)
+    export_file.file.save(filename, File(fp), save=False)
+    export_file.size = export_file.file.size
+
+    try:
+        with transaction.atomic():
+            export_file.save()
+    except IntegrityError:
+        # a concurrent request stored the same export
+        export_file.file.delete(save=False)
+        return ExportFile.objects.get(key=key)
+
+    prune_export_files(
+        max_files=settings.EXPORT_CACHE_MAX_FILES,
+        max_size=settings.EXPORT_CACHE_MAX_SIZE,
+        keep=export_file.pk,
+    )
+    return export_file
+
+
+def cache_content(content, save):
+    '''
+    Yields the content chunks while writing them into a temporary file,
+    once the content is complete calls ``save`` with the file.
+
+    If the content is not consumed till the end (the client goes away)
+    nothing is saved.
+    '''
+
+    with tempfile.TemporaryFile() as fp:
+        for chunk in content:
+            fp.write(chunk)
+            yield chunk
+
+        fp.seek(0)
+        save(fp)
+
+
+def delete_export_file(export_file):
+    try:
+        export_file.file.delete(save=False)
+    except Exception as e:  # the file is already gone
+        logger.warning(f'Export file "{export_file.file.name}" not deleted: {str(e)}')
+    export_file.delete()
+
+
+def prune_export_files(max_files=None, max_size=None, max_age=None, keep=None):
+    '''
+    Deletes the least recently used export files beyond ``max_files`` files
+    or ``max_size`` bytes and the ones not used in the last ``max_age`` days,
+    but the ``keep`` one.
+
+    Returns the number of deleted files.
+    '''
+
+    oldest = timezone.now() - timedelta(days=max_age) if max_age is not None else None
+    files = 0
+    size = 0
+    to_delete = []
+
+    # the most recently used first
+    queryset = ExportFile.objects.order_by('-accessed').values_list('pk', 'size', 'accessed')
+    for pk, file_size, accessed in queryset.iterator():
+        files += 1
+        size += file_size
+        if (
+            (max_files is not None and files > max_files) or
+            (max_size is not None and size > max_size) or
+            (oldest is not None and accessed < oldest)
+        ) and pk != keep:
+            to_delete.append(pk)
+
+    for export_file in ExportFile.objects.filter(pk__in=to_delete):
+        delete_export_file(export_file)
+
+    if to_delete:
+        logger.info(f'Deleted {len(to_delete)} export files')
+    return len(to_delete)
@@ -0,0 +1,101 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+from rest_framework.settings import api_settings
+
+from .search import get_similarity_ordering, search
+
+
+def get_list_param(request, name):
+    '''
+    Returns the list of values of the query parameter,
+    repeated (``?a=1&a=2``) or comma separated (``?a=1,2``).
+    '''
+
+    return [
+        value.strip()
+        for param in request.query_params.getlist(name)
+        for value in param.split(',')
+        if value.strip()
+    ]
+
+
+class ColumnsFilter(BaseFilterBackend):
+    '''
+    Filters the masks by their columns using the array operators
+    (indexed with the ``mask_columns_gin`` index):
+
+        - ``?column=a.b``            masks that include the column,
+        - ``?columns_any=a.b,c``     masks that include any of the columns,
+        - ``?columns_all=a.b,c``     masks that include all the columns.
+    '''
+
+    def filter_queryset(self, request, queryset, view):
+        column = get_list_param(request, 'column')
+        if column:
+            queryset = queryset.filter(columns__contains=column)
+
+        columns_any = get_list_param(request, 'columns_any')
+        if columns_any:
+            queryset = queryset.filter(columns__overlap=columns_any)
+
+        columns_all = get_list_param(request, 'columns_all')
+        if columns_all:
+            queryset = queryset.filter(columns__contains=columns_all)
+
+        return queryset
+
+
+class TrigramSearchFilter(SearchFilter):
+    '''
+    Same as ``SearchFilter`` (``?search=term``) but with the index backed conditions
+    of ``gather.api.search`` and, unless other ``ordering`` is requested,
+    sorted by similarity with the terms.
+
+    Goes after the ``OrderingFilter``, that sets the order of the ties.
+    '''
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms:
+            return queryset
+
+        # the array fields keep the ``SearchFilter`` substring match
+        queryset = search(queryset, search_fields, search_terms)
+        if api_settings.ORDERING_PARAM in request.query_params:
+            return queryset
+
+        ordering = get_similarity_ordering(queryset.model, search_fields, search_terms)
+        if ordering:
+            queryset = queryset.order_by(*ordering, *queryset.query.order_by)
+        return queryset
+
+
+def get_filter_backends(*backends):
+    '''
+    Returns the default filter backends with the ``TrigramSearchFilter``,
+    instead of the ``SearchFilter`` and after the rest, followed by the given ones.
+    '''
+
+    return [
+        *[backend for backend in api_settings.DEFAULT_FILTER_BACKENDS if not issubclass(backend, SearchFilter)],
+        TrigramSearchFilter,
+        *backends,
+    ]
@@ -0,0 +1,215 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+import math
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+from django.conf import settings
+from django.http import HttpResponse
+from requests.exceptions import ChunkedEncodingError, ConnectionError, HTTPError, Timeout
+from rest_framework.exceptions import PermissionDenied
+
+from aether.sdk.auth.apptoken.views import ERR_MSG_NO_TOKEN
+from aether.sdk.health.utils import get_external_app_url
+from aether.sdk.multitenancy.utils import add_current_realm_in_headers, get_path_realm
+from aether.sdk.utils import get_meta_http_name
+
+from . import metrics, tokens, upstream
+
+'''
+Helpers to fetch data from Aether Kernel on behalf of the current user
+(like the ``TokenProxyView`` does) using the pooled connections.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+KERNEL_APP = f'{settings.AETHER_PREFIX}kernel'
+
+
+def get_headers(request, app_name=KERNEL_APP):
+    '''
+    Returns the authorization and realm headers of the upstream request.
+    '''
+
+    headers = {}
+
+    # if the current url refers to any of the gateway protected ones
+    # instead of using the App User Token we rely security in the Gateway
+    needs_token = True
+    if settings.GATEWAY_ENABLED:
+        realm = get_path_realm(request, default_realm=settings.GATEWAY_PUBLIC_REALM)
+        needs_token = (realm == settings.GATEWAY_PUBLIC_REALM)
+
+    if needs_token:
+        app_token = tokens.get_or_create_token(request.user, app_name)
+        if app_token is None:
+            err = ERR_MSG_NO_TOKEN.format(request.user, app_name)
+            logger.error(err)
+            raise PermissionDenied(err)
+        headers['Authorization'] = f'Token {app_token.token}'
+    else:
+        token = request.META.get(get_meta_http_name(settings.GATEWAY_HEADER_TOKEN))
+        if token:
+            headers[settings.GATEWAY_HEADER_TOKEN] = token
+
+    return add_current_realm_in_headers(request, headers)
+
+
+def get_page(request, path, params=None, headers=None, app_name=KERNEL_APP):
+    '''
+    Returns the JSON content of the upstream path,
+    raises ``requests.HTTPError`` if the call fails.
+    '''
+
+    url = f'{get_external_app_url(app_name, request)}/{path.lstrip("/")}'
+    response = upstream.request(
+        app_name=app_name,
+        method='get',
+        url=url,
+        params=params,
+        headers=headers or get_headers(request, app_name),
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_page(request, path, params, headers, app_name=KERNEL_APP):
+    '''
+    Like ``get_page`` but retries the call (``UPSTREAM_RETRIES`` times) if
+    the connection fails or the content arrives incomplete. The connection
+    pool retries only the failed connections and the 502/503/504 responses.
+    '''
+
+    retries = settings.UPSTREAM_RETRIES
+    while True:
+        try:
+            return get_page(request, path, params, headers, app_name)
+        except (ChunkedEncodingError, ConnectionError, Timeout, ValueError) as e:
+            if retries <= 0:
+                raise e
+            logger.warning(f'Retrying page {params.get("page")} of {path}: {str(e)}')
+            metrics.UPSTREAM_RETRIES.labels(app_name, metrics.get_route(path)).inc()
+            retries -= 1
+            sleep(settings.UPSTREAM_RETRIES_BACKOFF)
+
+
+def fetch_pages(request, path, params=None, page_size=None, workers=None, app_name=KERNEL_APP, headers=None):
+    '''
+    Yields the pages of the upstream paginated path in order.
+
+    The first page indicates the total count and the number of pages,
+    the rest are fetched with at most ``workers`` (``KERNEL_FETCH_WORKERS``)
+    calls at the same time and at most twice as many pages waiting to be
+    consumed, the next calls are scheduled as the pages are consumed.
+
+    Raises the upstream errors (``requests.HTTPError``...) in the page order.
+    '''
+
+    headers = headers or get_headers(request, app_name)
+    page_size = page_size or settings.KERNEL_PAGE_SIZE
+    workers = max(1, workers or settings.KERNEL_FETCH_WORKERS)
+    params = {**(params or {}), 'page_size': page_size}
+
+    first_page = fetch_page(request, path, {**params, 'page': 1}, headers, app_name)
+    yield first_page
+    if not first_page.get('next'):
+        return
+
+    # kernel might limit the page size
+    page_size = len(first_page.get('results') or []) or page_size
+    pages = math.ceil(first_page.get('count', 0) / page_size)
+    next_page = 2
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=min(workers, max(pages - 1, 1)))
+
+    def schedule():
+        nonlocal next_page
+        # backpressure: no more than twice the workers pages waiting
+        while next_page <= pages and len(pending) < workers * 2:
+            pending.append(executor.submit(fetch_page, request, path, {**params, 'page': next_page}, headers, app_name))
+            next_page += 1
+
+    try:
+        schedule()
+        while pending:
+            page = pending.popleft().result()
+            yield page
+            if not page.get('next'):  # the entities changed meanwhile
+                break
+            schedule()
+    finally:
+        # the consumer is gone or all pages were fetched
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def fetch_entities(request, path, params=None, page_size=None, workers=None, app_name=KERNEL_APP):
+    '''
+    Yields the entities of all the pages in order (see ``fetch_pages``).
+    '''
+
+    for page in fetch_pages(request, path, params, page_size, workers, app_name):
+        yield from page.get('results') or []
+
+
+def get_pages(request, calls, app_name=KERNEL_APP):
+    '''
+    Executes concurrently the given upstream calls, a list of ``(path, params)``,
+    with at most ``UPSTREAM_MAX_WORKERS`` calls at the same time.
+
+    Returns the list of results in the same order, the JSON content or
+    the raised exception (``requests.HTTPError``...) of each call.
+    '''
+
+    # the token lookup needs the database, do it before leaving the current thread
+    headers = get_headers(request, app_name)
+
+    def fetch(call):
+        path, params = call
+        try:
+            return get_page(request, path, params, headers, app_name)
+        except Exception as e:
+            return e
+
+    if len(calls) < 2:
+        return [fetch(call) for call in calls]
+
+    with ThreadPoolExecutor(max_workers=min(len(calls), settings.UPSTREAM_MAX_WORKERS)) as executor:
+        return list(executor.map(fetch, calls))
+
+
+def error_response(error):
+    '''
+    Returns the upstream error response as it is,
+    raises again the connection errors.
+    '''
+
+    if not isinstance(error, HTTPError) or error.response is None:
+        raise error
+
+    return HttpResponse(
+        content=error.response.content,
+        status=error.response.status_code,
+        content_type=error.response.headers.get('Content-Type'),
+    )
@@ -0,0 +1,105 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+
+'''
+Applies the survey masks to the kernel entities.
+
+The mask columns are the entity payload jsonpaths (``a.b.c``) to keep,
+the rest of the payload is removed. The columns are converted into a tree
+where each leaf indicates that the whole value must be kept:
+
+    ['a.b', 'a.c.d', 'e']  =>  {'a': {'b': None, 'c': {'d': None}}, 'e': None}
+
+Lists are not part of the jsonpaths, the tree is applied to each item.
+'''
+
+# AVRO jsonpaths flags for array items, map values and union types (skipped)
+AVRO_FLAGS = ['#', '*', '?']
+
+
+def build_columns_tree(columns):
+    tree = {}
+    # the shorter paths first, they include all the longer ones
+    for column in sorted(columns, key=lambda column: column.count('.')):
+        keys = [key for key in column.split('.') if key and key not in AVRO_FLAGS]
+        if not keys:
+            continue
+
+        node = tree
+        for key in keys[:-1]:
+            if key in node and node[key] is None:  # the parent is already complete
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+
+    return tree
+
+
+def apply_columns_tree(value, tree):
+    if tree is None:
+        return value
+
+    if isinstance(value, list):
+        return [apply_columns_tree(item, tree) for item in value]
+
+    if isinstance(value, dict):
+        return {
+            key: apply_columns_tree(value[key], node)
+            for key, node in tree.items()
+            if key in value
+        }
+
+    # the value is not a container, there is nothing to look into
+    return None
+
+
+def apply_mask(entity, tree):
+    '''
+    Returns the entity with only the mask columns in its payload.
+    '''
+
+    return {**entity, 'payload': apply_columns_tree(entity.get('payload') or {}, tree)}
+
+
+def stream_entities(pages, tree):
+    '''
+    Yields the JSON content ``{"count": n, "results": [...]}`` of the
+    masked entities page by page as they are fetched from kernel.
+    '''
+
+    count = None
+    first = True
+    for page in pages:
+        if count is None:
+            count = page.get('count', 0)
+            yield f'{{"count": {json.dumps(count)}, "results": ['
+
+        results = page.get('results') or []
+        if results:
+            yield ('' if first else ', ') + ', '.join([
+                json.dumps(apply_mask(entity, tree))
+                for entity in results
+            ])
+            first = False
+
+    if count is None:
+        yield '{"count": 0, "results": ['
+    yield ']}'
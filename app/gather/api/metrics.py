@@ -0,0 +1,156 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import re
+
+from urllib.parse import urlparse
+
+from prometheus_client import Counter, Gauge, Histogram
+
+'''
+Prometheus metrics of the calls to the external apps and of the caches
+in the request path.
+
+The metrics are registered in the default registry, the same one exposed
+by the ``~prometheus/metrics`` endpoint along with the ``django_prometheus`` ones.
+'''
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float('inf'))
+SIZE_BUCKETS = tuple(10 ** exp for exp in range(2, 10)) + (float('inf'),)  # 100B ... 1GB
+
+UPSTREAM_LATENCY = Histogram(
+    'gather_upstream_latency_seconds',
+    'Time till the external app response headers arrive.',
+    ['app', 'route', 'status'],
+    buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_RESPONSE_BYTES = Histogram(
+    'gather_upstream_response_bytes',
+    'Size of the external app response bodies.',
+    ['app', 'route', 'status'],
+    buckets=SIZE_BUCKETS,
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'gather_upstream_in_flight_requests',
+    'External app requests waiting for the response.',
+    ['app'],
+)
+UPSTREAM_TIMEOUTS = Counter(
+    'gather_upstream_timeouts_total',
+    'External app requests that timed out.',
+    ['app', 'route'],
+)
+UPSTREAM_RETRIES = Counter(
+    'gather_upstream_retries_total',
+    'External app requests retried after a failed connection or a 502/503/504 response.',
+    ['app', 'route'],
+)
+UPSTREAM_COALESCED = Counter(
+    'gather_upstream_coalesced_requests_total',
+    'Requests that shared the response of an identical concurrent external app request.',
+    ['app', 'route'],
+)
+CACHE_REQUESTS = Counter(
+    'gather_cache_requests_total',
+    'Cache lookups by cache and result (hit, miss, revalidated, coalesced).',
+    ['cache', 'result'],
+)
+
+_ID_RE = re.compile(
+    r'^(\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(\.\w+)?$',
+    re.IGNORECASE,
+)
+
+# the external apps resources and actions used by gather (and its app),
+# any other path is reported as ``OTHER_ROUTE``
+ROUTE_RESOURCES = [
+    'attachments',
+    'entities',
+    'export-tasks',
+    'mappings',
+    'mappingsets',
+    'media-files',
+    'projects',
+    'projects-stats',
+    'schemadecorators',
+    'schemas',
+    'submissions',
+    'surveyors',
+    'token',
+    'xforms',
+]
+ROUTE_ACTIONS = [
+    'content',
+    'csv',
+    'propagate',
+    'query',
+    'schemas-skeleton',
+    'xlsx',
+]
+OTHER_ROUTE = 'other'
+
+_ROUTE_RE = re.compile(
+    r'(^|/)(?P<route>({resources})(/\{{id\}})?(/({actions}))?(\.json|/)?)$'.format(
+        resources='|'.join([re.escape(resource) for resource in ROUTE_RESOURCES]),
+        actions='|'.join([re.escape(action) for action in ROUTE_ACTIONS]),
+    )
+)
+
+
+def get_route(url):
+    '''
+    Returns the route template of the url: the known resource path without
+    the app prefix and the query string, and with the numeric and UUID
+    segments replaced with ``{id}``, the rest of urls are reported as ``other``.
+    This keeps the number of label values bounded.
+
+        http://kernel/projects/1234/schemas-skeleton.json?page=2 => /projects/{id}/schemas-skeleton.json
+        http://kernel/realm/kernel/entities/{uuid}.json          => /entities/{id}.json
+        http://kernel/admin/login/                               => other
+    '''
+
+    path = '/'.join([
+        _ID_RE.sub(r'{id}\2', segment)
+        for segment in urlparse(url).path.split('/')
+    ])
+    match = _ROUTE_RE.search(path)
+    return '/' + match.group('route') if match else OTHER_ROUTE
+
+
+def observe_response(response, app, route, seconds, streamed=False):
+    '''
+    Reports the response latency and, if the body is already read,
+    its size. The streamed bodies are reported with ``observe_size``
+    once they are consumed, for that the labels go along with the response.
+    '''
+
+    status = str(response.status_code)
+    UPSTREAM_LATENCY.labels(app, route, status).observe(seconds)
+    response.metrics_labels = (app, route, status)
+    if not streamed:
+        observe_size(response, len(response.content))
+
+
+def observe_size(response, size):
+    labels = getattr(response, 'metrics_labels', None)
+    if labels:
+        UPSTREAM_RESPONSE_BYTES.labels(*labels).observe(size)
+
+
+def count_cache(cache, result):
+    CACHE_REQUESTS.labels(cache, result.lower()).inc()
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.11 on 2020-03-16 10:00
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gather', '0102_mask_unique_together'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mask',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['columns'], name='mask_columns_gin'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.11 on 2020-03-17 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import gather.api.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gather', '0103_mask_columns_gin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True, verbose_name='key')),
+                ('file_format', models.CharField(max_length=10, verbose_name='file format')),
+                ('file', models.FileField(max_length=255, upload_to=gather.api.models.export_file_path, verbose_name='file')),
+                ('size', models.BigIntegerField(default=0, verbose_name='size')),
+                ('rows', models.IntegerField(default=0, verbose_name='rows')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('accessed', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='accessed')),
+                ('mask', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_files', to='gather.Mask', verbose_name='mask')),
+            ],
+            options={
+                'verbose_name': 'export file',
+                'verbose_name_plural': 'export files',
+                'default_related_name': 'export_files',
+            },
+        ),
+    ]
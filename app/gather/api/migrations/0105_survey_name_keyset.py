@@ -0,0 +1,17 @@
+# Generated by Django 2.2.11 on 2020-03-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gather', '0104_export_file'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['name', 'project_id'], name='survey_name_keyset'),
+        ),
+    ]
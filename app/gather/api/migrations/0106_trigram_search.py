@@ -0,0 +1,31 @@
+# Generated by Django 2.2.11 on 2020-03-19 10:00
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    '''
+    Trigram indexes of the ``icontains`` lookups (``UPPER(name) LIKE UPPER('%term%')``)
+    used by the search (see ``gather.api.search``).
+
+    ``TrigramExtension`` runs ``CREATE EXTENSION IF NOT EXISTS pg_trgm``,
+    unless the extension is already installed the database user needs
+    the privileges to create it.
+    '''
+
+    dependencies = [
+        ('gather', '0105_survey_name_keyset'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            sql='CREATE INDEX survey_name_trgm ON gather_survey USING gin (UPPER(name) gin_trgm_ops);',
+            reverse_sql='DROP INDEX survey_name_trgm;',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX mask_name_trgm ON gather_mask USING gin (UPPER(name) gin_trgm_ops);',
+            reverse_sql='DROP INDEX mask_name_trgm;',
+        ),
+    ]
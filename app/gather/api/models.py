@@ -19,7 +19,9 @@
 import uuid
 
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from django_prometheus.models import ExportModelOperationsMixin
@@ -38,6 +40,20 @@ Data model schema:
                            |   +::::::::::::::::::+
                            +--<| survey           |
                                +------------------+
+                                        ^
+                               +--------|---------+
+                               | ExportFile       |
+                               +==================+
+                               | key              |
+                               | file_format      |
+                               | file             |
+                               | size             |
+                               | rows             |
+                               | created          |
+                               | accessed         |
+                               +::::::::::::::::::+
+                               | mask             |
+                               +------------------+
 
 '''
 
@@ -69,6 +85,10 @@ class Survey(ExportModelOperationsMixin('gather_survey'), MtModelAbstract):
         default_related_name = 'surveys'
         verbose_name = _('survey')
         verbose_name_plural = _('surveys')
+        indexes = [
+            # keyset pagination (see `gather.api.pagination`)
+            models.Index(fields=['name', 'project_id'], name='survey_name_keyset'),
+        ]
 
 
 class Mask(ExportModelOperationsMixin('gather_mask'), MtModelChildAbstract):
@@ -99,5 +119,44 @@ class Mask(ExportModelOperationsMixin('gather_mask'), MtModelChildAbstract):
         verbose_name = _('mask')
         verbose_name_plural = _('masks')
         constraints = [
+            # also the index of the keyset pagination (see `gather.api.pagination`)
             models.UniqueConstraint(fields=['survey', 'name'], name='unique_mask_name_by_survey'),
         ]
+        indexes = [
+            # array operators: contains (@>), contained by (<@) and overlap (&&)
+            GinIndex(fields=['columns'], name='mask_columns_gin'),
+        ]
+
+
+def export_file_path(instance, filename):
+    return f'exports/{instance.mask.survey_id}/{filename}'
+
+
+class ExportFile(models.Model):
+    '''
+    Export file of the survey entities with the mask columns.
+
+    Kept in the storage to serve the identical export requests
+    while the survey entities do not change (see ``gather.api.exports``).
+    '''
+
+    # survey + mask + columns + format + filters + entities version
+    key = models.CharField(max_length=40, unique=True, verbose_name=_('key'))
+    mask = models.ForeignKey(to=Mask, on_delete=models.CASCADE, verbose_name=_('mask'))
+
+    file_format = models.CharField(max_length=10, verbose_name=_('file format'))
+    file = models.FileField(upload_to=export_file_path, max_length=255, verbose_name=_('file'))
+    size = models.BigIntegerField(default=0, verbose_name=_('size'))
+    rows = models.IntegerField(default=0, verbose_name=_('rows'))
+
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
+    accessed = models.DateTimeField(default=timezone.now, db_index=True, verbose_name=_('accessed'))
+
+    def __str__(self):
+        return self.file.name
+
+    class Meta:
+        app_label = 'gather'
+        default_related_name = 'export_files'
+        verbose_name = _('export file')
+        verbose_name_plural = _('export files')
@@ -0,0 +1,234 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import reduce
+from operator import and_, or_
+
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from aether.sdk.drf.pagination import CustomPagination
+
+'''
+Keyset (cursor) pagination, opt-in with the ``cursor`` query parameter:
+
+    ?cursor=&page_size=100            => first page
+    ?cursor={next}&page_size=100      => next page (as indicated in the ``next`` link)
+
+The rows are ordered by the view ``keyset_fields`` (the last one unique, like the pk)
+and each page continues after the last row of the previous one:
+
+    WHERE name >= :name AND ((name > :name) OR (name = :name AND project_id > :project_id))
+    ORDER BY name, project_id
+    LIMIT :page_size
+
+so, with the composite index, the deep pages cost the same as the first one
+(the redundant ``name >= :name`` is the start of the index range scan).
+
+There is no ``COUNT(*)`` unless requested with ``count``:
+
+    - ``?count=estimated``  the query planner estimation,
+    - ``?count=exact``      the real count.
+
+Without ``cursor`` the views keep the page number pagination.
+'''
+
+CURSOR_PARAM = 'cursor'
+COUNT_PARAM = 'count'
+COUNT_EXACT = 'exact'
+COUNT_ESTIMATED = 'estimated'
+
+
+def encode_cursor(values, reverse=False):
+    data = json.dumps([[str(value) if value is not None else None for value in values], reverse])
+    return b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    '''
+    Returns the keyset values and the direction of the cursor.
+    '''
+
+    try:
+        values, reverse = json.loads(b64decode(cursor.encode('ascii'), validate=True).decode('utf-8'))
+        assert isinstance(values, list) and len(values) == size and isinstance(reverse, bool)
+        # only the first field can be NULL (the name), the last one is unique
+        assert all(value is not None for value in values[1:])
+    except Exception:
+        raise NotFound(_('Invalid cursor.'))
+
+    return values, reverse
+
+
+def get_keyset_filter(fields, values, reverse=False):
+    '''
+    Returns the condition of the rows after (or before with ``reverse``)
+    the keyset values in the ``fields`` order (NULLs last).
+
+        (a, b, c) > (x, y, z)  =>  a >= x AND (a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z))
+
+    The leading bound ``a >= x`` (``a <= x`` with ``reverse``) is redundant but, unlike
+    the ORed conditions, the database can use it to start an index range scan.
+    Because of it the NULLs of the first field after a not NULL value are not included
+    (see ``get_keyset_rows``).
+    '''
+
+    lookup = 'lt' if reverse else 'gt'
+    conditions = []
+    for index, (field, value) in enumerate(zip(fields, values)):
+        equals = [Q(**{prev_field: prev_value}) for prev_field, prev_value in zip(fields[:index], values[:index])]
+        if value is None:
+            # the NULLs go last, after them there are only the NULLs
+            if reverse:
+                conditions.append(reduce(and_, equals, Q(**{f'{field}__isnull': False})))
+            continue
+        conditions.append(reduce(and_, equals, Q(**{f'{field}__{lookup}': value})))
+
+    keyset = reduce(or_, conditions)
+    if values[0] is not None:
+        keyset = Q(**{f'{fields[0]}__{lookup}e': values[0]}) & keyset
+    return keyset
+
+
+def get_keyset_rows(queryset, fields, values=None, reverse=False, limit=None):
+    '''
+    Returns the first ``limit`` rows after (or before with ``reverse``)
+    the keyset values in the ``fields`` order (NULLs last).
+
+    The NULLs of the first field are fetched apart, only when the rest of
+    the rows are exhausted, so both queries are index range scans.
+    '''
+
+    ordering = get_keyset_ordering(fields, reverse)
+    if values is None:
+        return list(queryset.order_by(*ordering)[:limit])
+
+    rows = list(queryset.filter(get_keyset_filter(fields, values, reverse)).order_by(*ordering)[:limit])
+    nullable = queryset.model._meta.get_field(fields[0]).null
+    if nullable and not reverse and values[0] is not None and (limit is None or len(rows) < limit):
+        nulls = queryset.filter(**{f'{fields[0]}__isnull': True}).order_by(*ordering)
+        rows += list(nulls[:limit - len(rows)] if limit is not None else nulls)
+    return rows
+
+
+def get_keyset_ordering(fields, reverse=False):
+    if reverse:
+        return [F(field).desc(nulls_first=True) for field in fields]
+    return [F(field).asc(nulls_last=True) for field in fields]
+
+
+def estimate_count(queryset):
+    '''
+    Returns the number of rows estimated by the query planner (PostgreSQL).
+    '''
+
+    # ``queryset.explain`` returns the text representation of the JSON plan,
+    # the database driver already decodes it into a list
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_value(row, field):
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+
+class KeysetPagination(CustomPagination):
+    '''
+    Page number pagination unless the ``cursor`` query parameter is present,
+    then the keyset pagination with the view ``keyset_fields``.
+
+    The keyset order replaces the requested ``ordering``.
+    '''
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        keyset_fields = getattr(view, 'keyset_fields', None)
+        if not keyset_fields or CURSOR_PARAM not in request.query_params:
+            return super(KeysetPagination, self).paginate_queryset(queryset, request, view)
+
+        self.keyset = keyset_fields
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        # the count of all the rows, not only the ones after the cursor
+        count_mode = request.query_params.get(COUNT_PARAM)
+        if count_mode == COUNT_EXACT:
+            self.count = queryset.order_by().count()
+        elif count_mode == COUNT_ESTIMATED:
+            self.count = estimate_count(queryset)
+        else:
+            self.count = None
+
+        cursor = request.query_params[CURSOR_PARAM]
+        values, reverse = None, False
+        if cursor:
+            values, reverse = decode_cursor(cursor, len(keyset_fields))
+
+        rows = get_keyset_rows(queryset, keyset_fields, values, reverse, limit=self.page_size + 1)
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not reverse else True
+        self.has_previous = bool(cursor) if not reverse else has_more
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.keyset is None:
+            return super(KeysetPagination, self).get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if self.keyset is None:
+            return super(KeysetPagination, self).get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        values = [get_value(self.page[-1], field) for field in self.keyset]
+        return self._get_link(encode_cursor(values))
+
+    def get_previous_link(self):
+        if self.keyset is None:
+            return super(KeysetPagination, self).get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        values = [get_value(self.page[0], field) for field in self.keyset]
+        return self._get_link(encode_cursor(values, reverse=True))
+
+    def _get_link(self, cursor):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, CURSOR_PARAM, cursor)
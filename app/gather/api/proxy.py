@@ -0,0 +1,386 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+
+from time import time
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+
+from django.views import View
+
+from rest_framework.permissions import SAFE_METHODS
+
+from aether.sdk.auth.apptoken.views import ERR_MSG_APP_UNKNOWN, ERR_MSG_NO_TOKEN, TokenProxyView
+from aether.sdk.health.utils import get_external_app_url
+from aether.sdk.multitenancy.utils import add_current_realm_in_headers, get_current_realm, get_path_realm
+from aether.sdk.utils import get_meta_http_name, normalize_meta_http_name
+
+from . import cache, coalesce, metrics, tokens, upstream
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+# https://tools.ietf.org/html/rfc2616#section-13.5.1
+HOP_BY_HOP_HEADERS = [
+    'connection',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-authorization',
+    'te',
+    'trailers',
+    'transfer-encoding',
+    'upgrade',
+]
+
+# WSGI environ key set by the ASGI server, the proxy leaves the upstream call to it
+ASYNC_PROXY_KEY = 'gather.async_proxy'
+
+# the body is forwarded as it comes from upstream (not decoded),
+# these headers describe it and must go along with it
+STREAMING_HEADERS = [
+    'Accept-Ranges',
+    'Content-Encoding',
+    'Content-Length',
+    'Content-Range',
+    'ETag',
+    'Last-Modified',
+]
+
+
+def _valid_header(name):
+    '''
+    Validates if the header can be passed within the request headers.
+    '''
+
+    # bugfix: We need to remove the "Host" from the header
+    # since the request goes to another host, otherwise
+    # the webserver returns a 404 because the domain is
+    # not hosted on that server.
+    return (
+        name in settings.EXPOSE_HEADERS_WHITELIST or
+        (name.startswith('CSRF_') and name not in ['CSRF_COOKIE_USED']) or
+        (name.startswith('HTTP_') and name not in ['HTTP_HOST'])
+    )
+
+
+def get_method(request):
+    # Django does not read twice the `request.body` on `POST` calls,
+    # the Ajax call changed it from `POST` to `PUT`,
+    # here it's changed back to its real value.
+    if request.method == 'PUT' and request.META.get('HTTP_X_METHOD', '').upper() == 'POST':
+        return 'POST'
+    return request.method
+
+
+def get_headers(request):
+    '''
+    Builds the upstream request headers based on the current request ones.
+    '''
+
+    headers = {
+        normalize_meta_http_name(header): str(value)
+        for header, value in request.META.items()
+        if _valid_header(header) and str(value)
+    }
+    return add_current_realm_in_headers(request, headers)
+
+
+def get_exposed_headers(headers):
+    '''
+    Returns the upstream response headers that are passed to the client.
+    '''
+
+    # copy the exposed headers from the original response ones
+    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Access-Control-Expose-Headers
+    expose_headers = (
+        [normalize_meta_http_name(header) for header in settings.EXPOSE_HEADERS_WHITELIST] +
+        STREAMING_HEADERS +
+        headers.get('Access-Control-Expose-Headers', '').split(', ')
+    )
+    if '*' in expose_headers:  # include all headers but "Authorization"
+        expose_headers = [key for key in headers if key.lower() != 'authorization']
+
+    return [
+        (key, headers[key])
+        for key in expose_headers
+        if key in headers and key.lower() not in HOP_BY_HOP_HEADERS
+    ]
+
+
+def etag_matches(if_none_match, etag):
+    '''
+    Indicates if the ``If-None-Match`` header value matches the ETag.
+
+    Uses the weak comparison (as ``django.utils.cache`` does), the compressed
+    responses come with the weak version of the ETag (see ``CompressionMiddleware``).
+    '''
+
+    if not if_none_match or not etag:
+        return False
+
+    etags = parse_etags(if_none_match)
+    if etags == ['*']:
+        return True
+
+    def strip_weak(value):
+        return value[2:] if value.startswith('W/') else value
+
+    return strip_weak(etag) in [strip_weak(value) for value in etags]
+
+
+def stream_content(response, chunk_size):
+    '''
+    Yields the upstream response body as it arrives, without decoding it,
+    and releases the upstream connection once the body is consumed
+    or the client goes away.
+    '''
+
+    size = 0
+    try:
+        for chunk in response.raw.stream(chunk_size, decode_content=False):
+            size += len(chunk)
+            yield chunk
+    finally:
+        response.close()
+        metrics.observe_size(response, size)
+
+
+class UpstreamCall(StreamingHttpResponse):
+    '''
+    Response of the proxy when the request comes from the ASGI server
+    (see ``gather.asgi``), it goes through the middlewares like any other
+    response but the upstream call is done asynchronously by the server.
+    '''
+
+    def __init__(self, app_name, method, url, headers, body, realm=None, path=None, user_id=None):
+        super(UpstreamCall, self).__init__(streaming_content=[])
+        self.app_name = app_name
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+        # realm and path of the resource to invalidate in the cache after a successful write
+        self.realm = realm
+        self.path = path
+        # user whose app token is forgotten if the external app rejects it
+        self.user_id = user_id
+        # the client one if the response can be compressed (see ``gather.middleware``)
+        self.accept_encoding = None
+
+
+class ProxyView(TokenProxyView):
+    '''
+    Extends the SDK ``TokenProxyView`` to forward the upstream response body
+    in chunks instead of loading it in memory, using the pooled connections
+    with the external app.
+
+    The upstream ``Content-Length``, ``Content-Range``, ``ETag``... headers
+    are passed through, and so are the client ``Range`` and ``If-*`` ones,
+    so partial and conditional requests behave as if there was no proxy.
+
+    The GET responses of the ``PROXY_CACHE_ROUTES`` are cached
+    (see ``gather.api.cache``) and revalidated with their ``ETag``,
+    the identical concurrent requests share the same upstream call
+    (see ``gather.api.coalesce``).
+
+    Served by the ASGI server the rest of the calls are left to it (``UpstreamCall``).
+
+    The user app tokens come from the cache (see ``gather.api.tokens``).
+    '''
+
+    def dispatch(self, request, path='', *args, **kwargs):
+        # same as `TokenProxyView.dispatch` but with the cached app tokens
+        self.path = path or ''
+        self.token_user_id = None
+
+        if self.app_name not in settings.EXTERNAL_APPS:
+            err = ERR_MSG_APP_UNKNOWN.format(self.app_name)
+            logger.error(err)
+            raise RuntimeError(err)
+
+        # if the current url refers to any of the gateway protected ones
+        # instead of using the App User Token we rely security in the Gateway
+        needs_token = True
+        if settings.GATEWAY_ENABLED:
+            realm = get_path_realm(request, default_realm=settings.GATEWAY_PUBLIC_REALM)
+            needs_token = (realm == settings.GATEWAY_PUBLIC_REALM)
+
+        if needs_token:
+            app_token = tokens.get_or_create_token(request.user, self.app_name)
+            if app_token is None:
+                err = ERR_MSG_NO_TOKEN.format(request.user, self.app_name)
+                logger.error(err)
+                raise RuntimeError(err)
+            request.META[get_meta_http_name('authorization')] = f'Token {app_token.token}'
+            self.token_user_id = request.user.pk
+
+        _path = self.path if self.path.startswith('/') else '/' + self.path
+        base_url = get_external_app_url(self.app_name, request)
+        query_string = request.GET.urlencode()
+        request.external_url = f'{base_url}{_path}' + (f'?{query_string}' if query_string else '')
+
+        try:
+            response = View.dispatch(self, request, *args, **kwargs)
+        except upstream.PoolTimeout as e:
+            # too many concurrent calls to the app, do not keep the user waiting
+            logger.warning(f'{request.method}  {request.external_url}: {str(e)}')
+            return HttpResponse(status=503, content='Service Unavailable')
+
+        if response.status_code == 401 and self.token_user_id:
+            # the app token is not valid anymore
+            tokens.invalidate(self.token_user_id, self.app_name)
+        return response
+
+    def _handle(self, request):
+        method = get_method(request)
+        headers = get_headers(request)
+
+        if method == 'GET' and cache.is_cacheable(self.app_name, self.path):
+            return self._handle_cached(request, headers)
+
+        if request.META.get(ASYNC_PROXY_KEY):
+            writes = method not in SAFE_METHODS and settings.PROXY_CACHE_ENABLED
+            return UpstreamCall(
+                app_name=self.app_name,
+                method=method,
+                url=request.external_url,
+                headers=headers,
+                body=request.body,
+                realm=get_current_realm(request) if writes else None,
+                path=self.path if writes else None,
+                user_id=self.token_user_id,
+            )
+
+        response = self._request(request, method, headers)
+        if method not in SAFE_METHODS and response.status_code < 400 and settings.PROXY_CACHE_ENABLED:
+            cache.invalidate(self.app_name, get_current_realm(request), self.path)
+
+        return self._build_response(request, response, settings.PROXY_STREAMING)
+
+    def _request(self, request, method, headers):
+        logger.debug(f'{method}  {request.external_url}')
+        return upstream.request(app_name=self.app_name,
+                                method=method,
+                                url=request.external_url,
+                                data=request.body if request.body else None,
+                                headers=headers,
+                                stream=True,
+                                )
+
+    def _handle_cached(self, request, headers):
+        key = cache.build_key(
+            app=self.app_name,
+            realm=get_current_realm(request),
+            # the shared responses are the same for all the realm users
+            user_id=None if cache.is_shared(self.app_name, self.path) else request.user.pk,
+            path=self.path,
+            url=request.external_url,
+        )
+        entry = cache.get_entry(key)
+        if entry and entry['expires'] > time():
+            metrics.count_cache('proxy', 'HIT')
+            return self._build_cached_response(request, entry, 'HIT')
+
+        def lookup():
+            shared_entry = cache.get_shared_entry(key)
+            if shared_entry and shared_entry['expires'] > time():
+                return shared_entry, 'COALESCED'
+            return None
+
+        # the identical concurrent requests share the same upstream call
+        (entry, cache_status), coalesced = coalesce.run(
+            key=key,
+            func=lambda: self._fetch_entry(request, headers, key, entry),
+            lookup=lookup,
+        )
+        if coalesced:
+            cache_status = 'COALESCED'
+            metrics.UPSTREAM_COALESCED.labels(self.app_name, metrics.get_route(request.external_url)).inc()
+
+        metrics.count_cache('proxy', cache_status)
+        return self._build_cached_response(request, entry, cache_status)
+
+    def _fetch_entry(self, request, headers, key, entry):
+        '''
+        Requests the upstream response (revalidating the stale entry if any)
+        and caches it if possible.
+
+        Returns the response as a cache entry and the cache status.
+        '''
+
+        # the cached content is always the decoded one
+        headers['Accept-Encoding'] = 'identity'
+        headers.pop('If-None-Match', None)
+        headers.pop('If-Modified-Since', None)
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+
+        response = self._request(request, 'GET', headers)
+        if entry and response.status_code == 304:
+            response.close()
+            entry = {**entry, 'expires': time() + settings.PROXY_CACHE_TTL}
+            cache.set_entry(key, entry)
+            return entry, 'REVALIDATED'
+
+        http_response = self._build_response(request, response, streaming=False)
+        entry = {
+            'status': http_response.status_code,
+            'headers': list(http_response.items()),
+            'content': http_response.content,
+            'etag': response.headers.get('ETag'),
+            'expires': time() + settings.PROXY_CACHE_TTL,
+        }
+        if response.status_code == 200 and len(http_response.content) <= settings.PROXY_CACHE_MAX_BODY_SIZE:
+            cache.set_entry(key, entry)
+        return entry, 'MISS'
+
+    def _build_cached_response(self, request, entry, cache_status):
+        if entry['status'] == 200 and etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), entry['etag']):
+            http_response = HttpResponse(status=304)
+            http_response['ETag'] = entry['etag']
+        else:
+            http_response = HttpResponse(content=entry['content'], status=entry['status'])
+            for key, value in entry['headers']:
+                http_response[key] = value
+
+        http_response['X-Gather-Cache'] = cache_status
+        return http_response
+
+    def _build_response(self, request, response, streaming):
+        if response.status_code in (204, 304) or request.method == 'HEAD':  # NO-CONTENT
+            response.close()
+            http_response = HttpResponse(status=response.status_code)
+        elif streaming:
+            http_response = StreamingHttpResponse(
+                streaming_content=stream_content(response, settings.PROXY_STREAMING_CHUNK_SIZE),
+                status=response.status_code,
+                content_type=response.headers.get('Content-Type'),
+            )
+        else:
+            http_response = HttpResponse(
+                content=b''.join(stream_content(response, settings.PROXY_STREAMING_CHUNK_SIZE)),
+                status=response.status_code,
+                content_type=response.headers.get('Content-Type'),
+            )
+
+        for key, value in get_exposed_headers(response.headers):
+            http_response[key] = value
+        return http_response
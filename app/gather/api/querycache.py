@@ -0,0 +1,87 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+
+from django.conf import settings
+from django.db.models.signals import post_migrate
+
+from . import metrics
+
+'''
+Cached ORM reads (``django-cacheops``, enabled with ``DJANGO_USE_CACHE``).
+
+The surveys and masks reads (``get``, ``fetch``, ``count`` and ``exists``)
+are cached for ``SURVEY_CACHE_TTL`` and ``MASK_CACHE_TTL`` seconds,
+the queries include the realm filter so each tenant has its own entries.
+
+The saves and deletes invalidate the cached queries automatically,
+but not the bulk operations (``bulk_create``, ``bulk_update``, ``update``)
+nor the migrations, these call ``invalidate`` explicitly.
+
+The lookups are counted in the ``gather_cache_requests_total`` metric
+with the ``orm:{app}.{model}`` cache label.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+
+def is_enabled():
+    return settings.DJANGO_USE_CACHE and settings.CACHEOPS_ENABLED
+
+
+def invalidate(*models):
+    '''
+    Invalidates all the cached queries of the models.
+    '''
+
+    if not is_enabled():
+        return
+
+    from cacheops import invalidate_model
+
+    for model in models:
+        try:
+            invalidate_model(model)
+        except Exception as e:
+            # the entries expire anyway
+            logger.warning(f'Queryset cache invalidation error: {str(e)}')
+
+
+def count_read(sender, func=None, hit=False, **kwargs):
+    # `sender` is the queryset model, `None` for the cached functions
+    if sender is not None:
+        metrics.count_cache(f'orm:{sender._meta.label_lower}', 'HIT' if hit else 'MISS')
+
+
+def invalidate_on_migrate(sender, **kwargs):
+    if sender.label != 'gather':
+        return
+
+    from .models import Survey, Mask
+
+    # the migrations use their own models that do not invalidate anything
+    invalidate(Survey, Mask)
+
+
+if settings.DJANGO_USE_CACHE:
+    from cacheops.signals import cache_read
+
+    cache_read.connect(count_read)
+    post_migrate.connect(invalidate_on_migrate)
@@ -0,0 +1,203 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from requests.exceptions import HTTPError
+
+from aether.sdk.health.utils import get_external_app_auth_header
+from aether.sdk.multitenancy.models import MtInstance
+
+from . import kernel, querycache
+from .models import Survey
+
+'''
+Reconciles the Gather surveys with the Aether Kernel projects of a realm.
+
+Goes through the kernel projects page by page and, for each page, creates
+the missing surveys and renames the outdated ones with one query per page.
+Optionally deletes afterwards the realm surveys without kernel project.
+
+The deletion is skipped if the number of listed projects does not match
+the kernel count (pages changed meanwhile, listing stopped early...) and
+each candidate is checked again with kernel before deleting it.
+
+With ``since`` only the projects modified after that date are upserted,
+the deletions still need to go through the whole list of projects.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+
+def get_headers(realm):
+    '''
+    Returns the kernel admin headers for the given realm (no user involved).
+    '''
+
+    headers = get_external_app_auth_header(kernel.KERNEL_APP)
+    if settings.MULTITENANCY:
+        headers[settings.REALM_COOKIE] = realm
+    return headers
+
+
+def get_realms():
+    '''
+    Returns the realms with surveys and the default one.
+    '''
+
+    if not settings.MULTITENANCY:
+        return [None]
+
+    realms = set(MtInstance.objects.values_list('realm', flat=True).distinct())
+    realms.add(settings.DEFAULT_REALM)
+    return sorted(realms)
+
+
+def get_surveys(realm):
+    queryset = Survey.objects.all()
+    if settings.MULTITENANCY:
+        queryset = queryset.filter(mt__realm=realm)
+    return queryset
+
+
+def is_modified_since(project, since):
+    modified = parse_datetime(project.get('modified') or '')
+    return modified is None or modified > since
+
+
+def upsert(realm, projects, stats, dry_run=False):
+    '''
+    Creates the missing surveys and renames the outdated ones.
+    '''
+
+    projects = {project['id']: project.get('name') or '' for project in projects}
+    queryset = Survey.objects.filter(pk__in=projects.keys())
+    if settings.MULTITENANCY:
+        queryset = queryset.select_related('mt')
+    surveys = {str(survey.pk): survey for survey in queryset}
+
+    to_create = []
+    to_update = []
+    for project_id, name in projects.items():
+        survey = surveys.get(project_id)
+        if survey is None:
+            to_create.append(Survey(project_id=project_id, name=name))
+        elif settings.MULTITENANCY and survey.get_realm() != realm:
+            # the project belongs to other realm
+            logger.warning(f'Survey {project_id} of realm "{survey.get_realm()}" skipped')
+            stats['skipped'] += 1
+        elif survey.name != name:
+            survey.name = name
+            to_update.append(survey)
+        else:
+            stats['unchanged'] += 1
+
+    stats['created'] += len(to_create)
+    stats['updated'] += len(to_update)
+    if dry_run:
+        return
+
+    with transaction.atomic():
+        Survey.objects.bulk_create(to_create)
+        Survey.objects.bulk_update(to_update, ['name'])
+        if settings.MULTITENANCY:
+            MtInstance.objects.bulk_create([MtInstance(instance=survey, realm=realm) for survey in to_create])
+        # the bulk operations do not invalidate the cached queries
+        transaction.on_commit(lambda: querycache.invalidate(Survey, MtInstance))
+
+
+def is_missing(realm, project_id, headers, request=None):
+    '''
+    Checks with kernel that the project does not exist.
+    '''
+
+    try:
+        kernel.get_page(request, f'projects/{project_id}.json', {'fields': 'id'}, headers=headers)
+    except HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
+            return True
+        raise e
+    logger.warning(f'Project {project_id} of realm "{realm}" not listed but found')
+    return False
+
+
+def delete_missing(realm, project_ids, headers, stats, dry_run=False, request=None):
+    '''
+    Deletes the realm surveys that are not among the given project ids
+    and that kernel confirms as missing one by one.
+    '''
+
+    candidates = [
+        pk
+        for pk in get_surveys(realm).values_list('pk', flat=True).iterator()
+        if str(pk) not in project_ids
+    ]
+    to_delete = [pk for pk in candidates if is_missing(realm, pk, headers, request)]
+
+    stats['deleted'] += len(to_delete)
+    if dry_run:
+        return
+
+    for index in range(0, len(to_delete), settings.KERNEL_PAGE_SIZE):
+        Survey.objects.filter(pk__in=to_delete[index:index + settings.KERNEL_PAGE_SIZE]).delete()
+
+
+def reconcile(realm=None, since=None, delete=False, dry_run=False, request=None):
+    '''
+    Reconciles the surveys with the kernel projects of the realm.
+
+    Expects:
+        - ``realm``:   the realm (ignored without multitenancy),
+        - ``since``:   only the projects modified after this datetime are upserted,
+        - ``delete``:  indicates if the surveys without project are deleted,
+        - ``dry_run``: counts the changes without applying them,
+        - ``request``: if given the calls to kernel are done on behalf of
+          the current user, otherwise with the kernel admin token.
+
+    Returns the number of created, updated, deleted, unchanged and skipped surveys.
+    '''
+
+    headers = kernel.get_headers(request) if request else get_headers(realm)
+    stats = {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0, 'skipped': 0}
+    project_ids = set()
+    counts = set()
+
+    params = {'fields': 'id,name,modified'}
+    for page in kernel.fetch_pages(request, 'projects.json', params, headers=headers):
+        counts.add(page.get('count'))
+        projects = page.get('results') or []
+        project_ids.update([project['id'] for project in projects])
+
+        if since:
+            projects = [project for project in projects if is_modified_since(project, since)]
+        upsert(realm, projects, stats, dry_run)
+
+    if delete:
+        if counts == {len(project_ids)}:
+            delete_missing(realm, project_ids, headers, stats, dry_run, request)
+        else:
+            # the listing is not reliable, some existing projects could be missing
+            logger.warning(f'Deletion skipped, {len(project_ids)} projects listed of {counts} in realm "{realm}"')
+
+    logger.info(f'Surveys of realm "{realm}" reconciled: {stats}')
+    return stats
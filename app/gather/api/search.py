@@ -0,0 +1,119 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from functools import reduce
+from operator import or_
+
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import FloatField, OuterRef, Q, Subquery
+from django.db.models.functions import Greatest
+
+'''
+Substring search backed by the ``pg_trgm`` GIN indexes (see migration ``0106``)
+and sorted by similarity with the search terms.
+
+The indexes are built on ``UPPER(name)``, the expression of the ``icontains``
+lookups in PostgreSQL, so each search field condition is an index scan:
+
+    - text fields:      ``name__icontains=term``
+    - related fields:   ``survey__in=Survey.objects.filter(name__icontains=term)``
+                        (no join, the related table uses its own index)
+    - array fields:     ``columns__icontains=term`` (substring of any value, no index)
+'''
+
+
+def _get_field(model, field_name):
+    '''
+    Returns the model field following the relations (``survey__name``).
+    '''
+
+    *path, name = field_name.split('__')
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    return model._meta.get_field(name)
+
+
+def get_search_filter(model, search_fields, term):
+    '''
+    Returns the condition of the rows with the term in any of the search fields.
+    '''
+
+    conditions = []
+    for field_name in search_fields:
+        relation, _, name = field_name.partition('__')
+        if name:
+            related_model = model._meta.get_field(relation).related_model
+            related = related_model.objects.filter(**{f'{name}__icontains': term}).values('pk')
+            conditions.append(Q(**{f'{relation}__in': related}))
+        else:
+            conditions.append(Q(**{f'{field_name}__icontains': term}))
+
+    return reduce(or_, conditions)
+
+
+def search(queryset, search_fields, terms):
+    '''
+    Filters the queryset by all the terms, each of them in any of the search fields.
+    '''
+
+    for term in terms:
+        queryset = queryset.filter(get_search_filter(queryset.model, search_fields, term))
+    return queryset
+
+
+def get_similarity(model, field_name, value):
+    '''
+    Returns the similarity of the text field with the value,
+    the related fields with a subquery (no join).
+    '''
+
+    relation, _, name = field_name.partition('__')
+    if not name:
+        return TrigramSimilarity(field_name, value)
+
+    related_model = model._meta.get_field(relation).related_model
+    return Subquery(
+        related_model.objects
+                     .filter(pk=OuterRef(relation))
+                     .annotate(similarity=TrigramSimilarity(name, value))
+                     .values('similarity')[:1],
+        output_field=FloatField(),
+    )
+
+
+def get_similarity_ordering(model, search_fields, terms):
+    '''
+    Returns the ordering by the best similarity of the text search fields
+    with the terms.
+    '''
+
+    if not terms:
+        return []
+
+    value = ' '.join(terms)
+    similarities = [
+        get_similarity(model, field_name, value)
+        for field_name in search_fields
+        if not isinstance(_get_field(model, field_name), ArrayField)
+    ]
+    if not similarities:
+        return []
+
+    similarity = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+    return [similarity.desc(nulls_last=True)]
@@ -16,12 +16,17 @@
 # specific language governing permissions and limitations
 # under the License.
 
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
 from aether.sdk.multitenancy.serializers import (
     DynamicFieldsModelSerializer,
     MtPrimaryKeyRelatedField,
     MtModelSerializer,
 )
 
+from .aggregations import INTERVALS, MONTH
 from .models import Survey, Mask
 
 
@@ -37,6 +42,70 @@ class MaskSerializer(DynamicFieldsModelSerializer):
         fields = '__all__'
 
 
+class MaskBulkItemSerializer(MaskSerializer):
+    '''
+    Validates each mask of the bulk actions.
+
+    The survey and the mask name uniqueness are validated
+    with all the bulk masks together (see ``gather.api.bulk``).
+    '''
+
+    id = serializers.IntegerField(required=False)
+    survey = serializers.UUIDField(required=True)
+
+
+class MaskBulkSerializer(serializers.Serializer):
+
+    create = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    update = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+    def validate(self, data):
+        if not any(data.values()):
+            raise serializers.ValidationError(_('Nothing to create, update or delete.'))
+        return data
+
+
+class BatchSerializer(serializers.Serializer):
+
+    urls = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        max_length=settings.BATCH_MAX_URLS,
+    )
+
+
+class ReconcileSerializer(serializers.Serializer):
+
+    since = serializers.DateTimeField(required=False)
+    delete = serializers.BooleanField(default=False)
+    dry_run = serializers.BooleanField(default=False)
+
+
+class AggregationsSerializer(serializers.Serializer):
+    '''
+    Expects the mask in the context.
+    '''
+
+    columns = serializers.CharField(required=False)
+    approximate = serializers.BooleanField(default=False)
+    bins = serializers.IntegerField(default=10, min_value=1, max_value=100)
+    interval = serializers.ChoiceField(choices=INTERVALS, default=MONTH)
+    top = serializers.IntegerField(default=20, min_value=1, max_value=1000)
+
+    def validate_columns(self, value):
+        columns = [column.strip() for column in value.split(',') if column.strip()]
+        unknown = [column for column in columns if column not in self.context['mask'].columns]
+        if unknown:
+            raise serializers.ValidationError(_('Unknown columns: {}.').format(', '.join(unknown)))
+        return columns
+
+    def validate(self, data):
+        if not data.get('columns'):
+            data['columns'] = self.context['mask'].columns
+        return data
+
+
 class SurveySerializer(MtModelSerializer):
 
     masks = MaskSerializer(omit=('survey', ), many=True, read_only=True)
@@ -44,3 +113,49 @@ class SurveySerializer(MtModelSerializer):
     class Meta:
         model = Survey
         fields = '__all__'
+
+
+'''
+Read only and faster versions of the serializers above.
+
+Build the same representation (same JSON) from ``values()`` querysets
+skipping the DRF fields machinery, used by the list and retrieve endpoints.
+'''
+
+MASK_VALUES = ('id', 'survey_id', 'name', 'columns')
+SURVEY_VALUES = ('project_id', 'name')
+
+
+def masks_to_representation(rows, omit=()):
+    return [
+        {
+            key: value
+            for key, value in (
+                ('id', row['id']),
+                ('survey', str(row['survey_id'])),
+                ('name', row['name']),
+                ('columns', row['columns']),
+            )
+            if key not in omit
+        }
+        for row in rows
+    ]
+
+
+def surveys_to_representation(rows):
+    rows = list(rows)
+
+    # all the masks in one query
+    masks = {}
+    masks_rows = Mask.objects.filter(survey_id__in=[row['project_id'] for row in rows]).values(*MASK_VALUES)
+    for mask in masks_rows:
+        masks.setdefault(mask['survey_id'], []).append(mask)
+
+    return [
+        {
+            'project_id': str(row['project_id']),
+            'masks': masks_to_representation(masks.get(row['project_id'], []), omit=('survey',)),
+            'name': row['name'],
+        }
+        for row in rows
+    ]
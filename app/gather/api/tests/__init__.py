@@ -15,3 +15,85 @@
 # KIND, either express or implied.  See the License for the
 # specific language governing permissions and limitations
 # under the License.
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Stand-in for the external apps servers.
+
+    Replies with the ``server.routes`` entry that matches the request path:
+    a ``(status, headers, body)`` tuple or a callable that returns it.
+    '''
+
+    protocol_version = 'HTTP/1.1'  # keep alive
+
+    def _reply(self):
+        self.server.requests.append((self.command, self.path, self.client_address, dict(self.headers)))
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        route = self.server.routes.get(self.path.split('?')[0], (404, {}, {'detail': 'Not found.'}))
+        status, headers, content = route(self, body) if callable(route) else route
+        if not isinstance(content, bytes):
+            content = json.dumps(content).encode('utf-8')
+            headers = {'Content-Type': 'application/json', **headers}
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_DELETE = do_GET = do_HEAD = do_OPTIONS = do_PATCH = do_POST = do_PUT = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, routes=None):
+        super(StubServer, self).__init__(('127.0.0.1', 0), StubHandler)
+        self.routes = routes or {}
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def build_pages(payloads, page_size):
+    '''
+    Returns the kernel entities pages of the payloads.
+    '''
+
+    return [
+        {
+            'count': len(payloads),
+            'next': 'next' if start + page_size < len(payloads) else None,
+            'results': [
+                {'id': start + i, 'payload': payload}
+                for i, payload in enumerate(payloads[start:start + page_size])
+            ],
+        }
+        for start in range(0, len(payloads), page_size)
+    ]
@@ -0,0 +1,227 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import random
+
+from datetime import date
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from aether.sdk.auth.apptoken.models import AppToken
+from aether.sdk.multitenancy.models import MtInstance
+from aether.sdk.unittest import MockResponse
+
+from .. import aggregations
+from ..models import Survey, Mask
+from . import build_pages
+from .test_proxy import upstream_response
+
+
+PAYLOADS = [
+    {'name': 'John', 'age': 30, 'visit': '2020-01-15', 'tags': ['a', 'b'], 'ok': True},
+    {'name': 'Jane', 'age': 20.5, 'visit': '2020-01-31T10:00:00Z', 'tags': ['a'], 'ok': False},
+    {'name': 'John', 'age': 40, 'visit': '2020-02-01', 'tags': [], 'ok': True},
+    {'name': None, 'age': 'unknown', 'visit': '2020-13-01', 'tags': None},
+    {'age': float('nan'), 'visit': {'date': '2020-01-01'}},
+]
+
+
+class AggregationsTests(TestCase):
+
+    def test__parse_dates(self):
+        dates, others = aggregations.parse_dates(['2020-01-15', '2020-01-31T23:00:00+01:00', '2020-13-01', 'John'])
+        self.assertEqual(dates, [date(2020, 1, 15), date(2020, 1, 31)])
+        self.assertEqual(others, ['2020-13-01', 'John'])
+
+    def test__get_date_bucket(self):
+        value = date(2020, 3, 5)  # Thursday
+        self.assertEqual(aggregations.get_date_bucket(value, aggregations.DAY), '2020-03-05')
+        self.assertEqual(aggregations.get_date_bucket(value, aggregations.WEEK), '2020-03-02')
+        self.assertEqual(aggregations.get_date_bucket(value, aggregations.MONTH), '2020-03')
+        self.assertEqual(aggregations.get_date_bucket(value, aggregations.YEAR), '2020')
+
+    def test__aggregate(self):
+        result = aggregations.aggregate(
+            iter(build_pages(PAYLOADS, 2)),
+            columns=['name', 'age', 'visit', 'tags', 'ok', 'other'],
+            bins=2,
+        )
+        self.assertEqual(result['rows'], 5)
+        name, age, visit, tags, ok, other = result['columns']
+
+        self.assertEqual(name['missing'], 2)
+        self.assertEqual(name['distinct'], 2)
+        self.assertFalse(name['approximate'])
+        self.assertEqual(name['categories'], {
+            'count': 3,
+            'top': [{'value': 'John', 'count': 2}, {'value': 'Jane', 'count': 1}],
+            'other': 0,
+            'approximate': False,
+        })
+        self.assertIsNone(name['numbers'])
+        self.assertIsNone(name['dates'])
+
+        self.assertEqual(age['missing'], 0)
+        self.assertEqual(age['categories']['top'], [{'value': 'unknown', 'count': 1}])
+        self.assertEqual(age['numbers'], {
+            'count': 3,
+            'min': 20.5,
+            'max': 40,
+            'mean': (30 + 20.5 + 40) / 3,
+            'quartiles': {'p25': 20.5, 'p50': 30, 'p75': 40},
+            'histogram': [
+                {'start': 20.5, 'end': 30.25, 'count': 2},
+                {'start': 30.25, 'end': 40.0, 'count': 1},
+            ],
+            'approximate': False,
+        })
+
+        self.assertEqual(visit['missing'], 0)  # the objects are skipped, not missing
+        self.assertEqual(visit['dates'], {
+            'count': 3,
+            'min': '2020-01-15',
+            'max': '2020-02-01',
+            'interval': 'month',
+            'buckets': [{'start': '2020-01', 'count': 2}, {'start': '2020-02', 'count': 1}],
+        })
+        self.assertEqual(visit['categories']['top'], [{'value': '2020-13-01', 'count': 1}])
+
+        # list items one by one
+        self.assertEqual(tags['missing'], 3)
+        self.assertEqual(tags['categories']['top'], [{'value': 'a', 'count': 2}, {'value': 'b', 'count': 1}])
+
+        self.assertEqual(ok['categories']['top'], [{'value': True, 'count': 2}, {'value': False, 'count': 1}])
+
+        self.assertEqual(other, {
+            'column': 'other',
+            'missing': 5,
+            'distinct': 0,
+            'approximate': False,
+            'categories': None,
+            'numbers': None,
+            'dates': None,
+        })
+
+    def test__aggregate__approximate(self):
+        rnd = random.Random(42)
+        payloads = [{'value': rnd.gauss(100, 15), 'code': f'code {rnd.randint(0, 3000)}'} for _ in range(20000)]
+        values = sorted([payload['value'] for payload in payloads])
+        codes = set([payload['code'] for payload in payloads])
+
+        def check(result):
+            value, code = result['columns']
+            self.assertTrue(value['approximate'])
+            self.assertTrue(value['numbers']['approximate'])
+            self.assertAlmostEqual(value['distinct'], 20000, delta=20000 * 0.03)
+            self.assertEqual(value['numbers']['min'], values[0])
+            self.assertEqual(value['numbers']['max'], values[-1])
+            for name, index in (('p25', 4999), ('p50', 9999), ('p75', 14999)):
+                self.assertAlmostEqual(value['numbers']['quartiles'][name], values[index], delta=values[index] * 0.01)
+            self.assertEqual(sum([item['count'] for item in value['numbers']['histogram']]), 20000)
+
+            self.assertAlmostEqual(code['distinct'], len(codes), delta=len(codes) * 0.03)
+            self.assertEqual(code['categories']['count'], 20000)
+            self.assertEqual(len(code['categories']['top']), 5)
+
+        # from the beginning
+        check(aggregations.aggregate(iter(build_pages(payloads, 1000)), ['value', 'code'], approximate=True, top=5))
+
+        # beyond the limit
+        with self.settings(AGGREGATION_EXACT_LIMIT=1000):
+            result = aggregations.aggregate(iter(build_pages(payloads, 1000)), ['value', 'code'], top=5)
+        check(result)
+        self.assertTrue(result['columns'][1]['categories']['approximate'])
+
+    def test__hyperloglog(self):
+        for size in (10, 1000, 100000):
+            sketch = aggregations.HyperLogLog()
+            for i in range(size):
+                sketch.add(aggregations.hash_value(i))
+            self.assertAlmostEqual(sketch.count(), size, delta=max(1, size * 0.03))
+
+    def test__quantile_sketch(self):
+        sketch = aggregations.QuantileSketch()
+        for value in (-10, -1, 0, 0, 1, 10, 100):
+            sketch.add(value)
+        items = list(sketch.items())
+        self.assertEqual([count for _, count in items], [1, 1, 2, 1, 1, 1])
+        for (estimated, _), value in zip(items, (-10, -1, 0, 1, 10, 100)):
+            self.assertAlmostEqual(estimated, value, delta=abs(value) * 0.01)
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class AggregationsViewTests(TestCase):
+
+    def setUp(self):
+        super(AggregationsViewTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        self.survey = Survey.objects.create(name='My Survey')
+        MtInstance.objects.create(instance=self.survey, realm=settings.DEFAULT_REALM)
+        self.mask = Mask.objects.create(survey=self.survey, name='Mask', columns=['name', 'age'])
+        self.url = reverse('mask-aggregations', kwargs={'pk': self.mask.pk})
+
+    def kernel_request(self, *args, **kwargs):
+        pages = build_pages(PAYLOADS, 2)
+        return MockResponse(200, pages[kwargs['params']['page'] - 1])
+
+    def test__aggregations(self, *args):
+        with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request) as mock_req:
+            response = self.client.get(self.url, {'status': 'Publishable', 'bins': 3, 'top': 1})
+            self.assertEqual(mock_req.call_count, 3)
+            params = mock_req.call_args[1]['params']
+            self.assertEqual(params['status'], 'Publishable')
+            self.assertEqual(params['project'], str(self.survey.pk))
+            self.assertEqual(params['fields'], 'payload')
+            self.assertNotIn('bins', params)
+            self.assertNotIn('top', params)
+
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual(content['rows'], 5)
+        self.assertEqual([column['column'] for column in content['columns']], ['name', 'age'])
+        self.assertEqual(content['columns'][0]['categories']['top'], [{'value': 'John', 'count': 2}])
+        self.assertEqual(len(content['columns'][1]['numbers']['histogram']), 3)
+
+        with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request):
+            response = self.client.get(self.url, {'columns': 'age', 'approximate': 'true'})
+        self.assertEqual([column['column'] for column in response.json()['columns']], ['age'])
+        self.assertTrue(response.json()['columns'][0]['numbers']['approximate'])
+
+    def test__errors(self, *args):
+        for params in ({'columns': 'name,unknown'}, {'bins': 0}, {'interval': 'hour'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
+
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(500, b'error', {'Content-Type': 'text/plain'})):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.content, b'error')
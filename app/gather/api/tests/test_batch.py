@@ -0,0 +1,156 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from time import sleep, time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from ..models import Survey
+from .test_proxy import upstream_response
+from .test_views import create_surveys
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class BatchTests(TransactionTestCase):
+
+    def setUp(self):
+        super(BatchTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        self.url = reverse('batch')
+
+    def batch(self, urls):
+        return self.client.post(self.url, data={'urls': urls}, content_type='application/json')
+
+    def test__batch(self, *args):
+        create_surveys(surveys=1, masks=1)
+        survey = Survey.objects.get(name='survey 000000')
+
+        def kernel(*args, **kwargs):
+            if 'projects' in kwargs['url']:
+                return upstream_response(200, b'{"id": 1}', {'Content-Type': 'application/json'})
+            return upstream_response(200, b'surveyors', {'Content-Type': 'text/plain'})
+
+        with mock.patch('gather.api.upstream.request', side_effect=kernel) as mock_req:
+            response = self.batch([
+                '/api/kernel/projects/1.json?a=1',
+                f'/api/gather/surveys/{survey.pk}/',
+                '/api/odk/surveyors.json',
+                '/api/gather/surveys/00000000-0000-0000-0000-000000000000/',
+            ])
+            self.assertEqual(mock_req.call_count, 2)
+            self.assertEqual(mock_req.call_args_list[0][1]['method'], 'GET')
+            self.assertEqual(mock_req.call_args_list[0][1]['url'], 'http://kernel-test/projects/1.json?a=1')
+            self.assertEqual(mock_req.call_args_list[0][1]['headers']['Authorization'], 'Token ABCDEFGH')
+            self.assertNotIn('Accept-Encoding', mock_req.call_args_list[0][1]['headers'])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()
+        self.assertEqual(results[0], {'url': '/api/kernel/projects/1.json?a=1', 'status': 200, 'body': {'id': 1}})
+        self.assertEqual(results[1]['status'], 200)
+        self.assertEqual(results[1]['body']['name'], 'survey 000000')
+        self.assertEqual(len(results[1]['body']['masks']), 1)
+        self.assertEqual(results[2]['body'], 'surveyors')
+        self.assertEqual(results[3]['status'], 404)
+
+    def test__batch__not_allowed(self, *args):
+        create_surveys(surveys=1, masks=1)
+        survey = Survey.objects.get(name='survey 000000')
+        mask = survey.masks.first()
+
+        urls = [
+            'http://other.server/api/gather/surveys/',
+            '/assets-settings',
+            '/api/batch',
+            '/api/unknown',
+            # only the list and detail routes
+            '/api/gather/surveys/overview/',
+            f'/api/gather/masks/{mask.pk}/entities/',
+            f'/api/gather/masks/{mask.pk}/export/?storage',
+            f'/api/gather/masks/{mask.pk}/aggregations/',
+        ]
+        with mock.patch('gather.api.upstream.request') as mock_req:
+            response = self.batch(urls)
+            mock_req.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()], [400] * len(urls))
+
+    def test__batch__too_large(self, *args):
+        create_surveys(surveys=3, masks=1)
+        max_size = len(self.client.get('/api/gather/masks/?page_size=1').content)
+        self.assertGreater(len(self.client.get('/api/gather/surveys/').content), max_size)
+
+        body = b'{"a": "' + b'a' * max_size + b'"}'
+        upstream = upstream_response(200, body, {'Content-Type': 'application/json'})
+
+        with override_settings(BATCH_MAX_BODY_SIZE=max_size), \
+                mock.patch('gather.api.upstream.request', return_value=upstream):
+            response = self.batch([
+                '/api/kernel/projects.json',
+                '/api/gather/surveys/',
+                '/api/gather/masks/?page_size=1',
+            ])
+
+        results = response.json()
+        self.assertEqual(results[0], {
+            'url': '/api/kernel/projects.json',
+            'status': 413,
+            'body': {'detail': 'Response too large.'},
+        })
+        self.assertEqual(results[1]['status'], 413)
+        self.assertEqual(results[2]['status'], 200)
+        # the upstream connection is released
+        self.assertTrue(upstream.raw.closed)
+
+    def test__batch__validation(self, *args):
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.batch(['/api/gather/surveys/'] * 100).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+        self.client.logout()
+        self.assertEqual(self.batch(['/api/gather/surveys/']).status_code, 403)
+
+    @override_settings(BATCH_DEADLINE=0.5)
+    def test__batch__concurrency(self, *args):
+        def slow(*args, **kwargs):
+            sleep(0.2 if 'fast' in kwargs['url'] else 2)
+            return upstream_response(200, b'{}', {'Content-Type': 'application/json'})
+
+        with mock.patch('gather.api.upstream.request', side_effect=slow):
+            start = time()
+            response = self.batch([
+                '/api/kernel/fast-1.json',
+                '/api/kernel/fast-2.json',
+                '/api/kernel/slow.json',
+            ])
+            self.assertLess(time() - start, 1)
+
+        self.assertEqual([result['status'] for result in response.json()], [200, 200, 504])
@@ -0,0 +1,145 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import Survey, Mask
+from .test_views import create_surveys
+
+
+class BulkTests(TestCase):
+
+    def setUp(self):
+        super(BulkTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        create_surveys(surveys=2, masks=2)
+        self.survey_1 = Survey.objects.get(name='survey 000000')
+        self.survey_2 = Survey.objects.get(name='survey 000001')
+        self.other = Survey.objects.get(name='other')
+        self.url = reverse('mask-bulk')
+
+    def bulk(self, data):
+        return self.client.post(self.url, data=data, content_type='application/json')
+
+    def test__bulk(self):
+        mask_1 = Mask.objects.get(survey=self.survey_1, name='mask 0')
+        mask_2 = Mask.objects.get(survey=self.survey_1, name='mask 1')
+        mask_3 = Mask.objects.get(survey=self.survey_2, name='mask 0')
+
+        response = self.bulk({
+            'create': [
+                {'survey': str(self.survey_1.pk), 'name': 'mask 0', 'columns': ['a']},  # freed by the update
+                {'survey': str(self.survey_1.pk), 'name': 'mask 1', 'columns': ['b']},  # freed by the delete
+                {'survey': str(self.survey_2.pk), 'name': 'new', 'columns': ['c', 'd.e']},
+            ],
+            'update': [
+                {'id': mask_1.pk, 'name': 'renamed'},
+                {'id': mask_3.pk, 'columns': ['z']},
+            ],
+            'delete': [mask_2.pk],
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+
+        content = response.json()
+        self.assertEqual([item['status'] for item in content['create']], [201, 201, 201])
+        self.assertEqual([item['data']['name'] for item in content['create']], ['mask 0', 'mask 1', 'new'])
+        self.assertEqual(content['update'][0], {
+            'status': 200,
+            'data': {'id': mask_1.pk, 'survey': str(self.survey_1.pk), 'name': 'renamed', 'columns': mask_1.columns},
+        })
+        self.assertEqual(content['delete'], [{'status': 204, 'id': mask_2.pk}])
+
+        self.assertEqual(
+            sorted(Mask.objects.filter(survey=self.survey_1).values_list('name', flat=True)),
+            ['mask 0', 'mask 1', 'renamed'],
+        )
+        self.assertFalse(Mask.objects.filter(pk=mask_2.pk).exists())
+        self.assertEqual(Mask.objects.get(pk=mask_3.pk).columns, ['z'])
+        self.assertEqual(Mask.objects.get(survey=self.survey_2, name='new').columns, ['c', 'd.e'])
+
+    def test__bulk__invalidate(self):
+        with mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func()), \
+                mock.patch('gather.api.querycache.invalidate') as mock_invalidate:
+            response = self.bulk({'create': [{'survey': str(self.survey_1.pk), 'name': 'new', 'columns': ['a']}]})
+        self.assertEqual(response.status_code, 200)
+        mock_invalidate.assert_called_once_with(Mask)
+
+    def test__bulk__invalid(self):
+        mask_1 = Mask.objects.get(survey=self.survey_1, name='mask 0')
+        other_mask = Mask.objects.get(survey=self.other)
+        count = Mask.objects.count()
+
+        response = self.bulk({
+            'create': [
+                {'survey': str(self.survey_1.pk), 'name': 'valid', 'columns': ['a']},
+                {'survey': str(self.survey_1.pk), 'name': 'mask 1', 'columns': ['a']},  # existing name
+                {'survey': str(self.survey_2.pk), 'name': 'twice', 'columns': ['a']},
+                {'survey': str(self.survey_2.pk), 'name': 'twice', 'columns': ['a']},  # repeated name
+                {'survey': str(self.other.pk), 'name': 'other realm', 'columns': ['a']},
+                {'survey': 'not-uuid', 'name': 'wrong'},
+            ],
+            'update': [
+                {'id': mask_1.pk, 'name': 'mask 1'},  # existing name
+                {'id': other_mask.pk, 'name': 'other realm'},
+                {'name': 'no id'},
+            ],
+            'delete': [other_mask.pk, 0],
+        })
+        self.assertEqual(response.status_code, 400)
+
+        content = response.json()
+        self.assertEqual([item['status'] for item in content['create']], [424, 400, 424, 400, 400, 400])
+        self.assertIn('non_field_errors', content['create'][1]['errors'])
+        self.assertIn('non_field_errors', content['create'][3]['errors'])
+        self.assertIn('survey', content['create'][4]['errors'])
+        self.assertIn('survey', content['create'][5]['errors'])
+        self.assertIn('columns', content['create'][5]['errors'])
+        self.assertEqual([item['status'] for item in content['update']], [400, 404, 400])
+        self.assertEqual([item['status'] for item in content['delete']], [404, 404])
+
+        # nothing was written
+        self.assertEqual(Mask.objects.count(), count)
+        self.assertEqual(Mask.objects.get(pk=mask_1.pk).name, 'mask 0')
+
+    def test__bulk__empty(self):
+        response = self.bulk({})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.bulk({'create': 'wrong'})
+        self.assertEqual(response.status_code, 400)
+
+    def test__bulk__queries(self):
+        items = [
+            {'survey': str(self.survey_1.pk), 'name': f'bulk {i}', 'columns': ['a', 'b']}
+            for i in range(100)
+        ]
+        # session + user + surveys + names + (savepoint + insert + release)
+        with self.assertNumQueries(7):
+            response = self.bulk({'create': items})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Mask.objects.filter(survey=self.survey_1).count(), 102)
@@ -0,0 +1,285 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from time import sleep
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from .. import cache
+from .test_proxy import upstream_response
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, timeout, value):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+
+class BrokenRedis(object):
+
+    def __getattr__(self, name):
+        raise ConnectionError('REDIS is down')
+
+
+class CacheTests(TestCase):
+
+    def setUp(self):
+        super(CacheTests, self).setUp()
+        cache.clear()
+
+    def test__lru_cache(self):
+        lru = cache.LRUCache(maxsize=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)  # "a" is now the most recent one
+
+        lru.set('c', 3)
+        self.assertEqual(len(lru), 2)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+
+        lru.set('d', 4, timeout=0.01)
+        sleep(0.02)
+        self.assertEqual(lru.get('d', 'expired'), 'expired')
+        self.assertEqual(len(lru), 1)
+
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+    def test__get_resource(self):
+        self.assertEqual(cache.get_resource('projects-stats.json'), 'projects')
+        self.assertEqual(cache.get_resource('/projects/1234/schemas-skeleton.json'), 'projects')
+        self.assertEqual(cache.get_resource('projects.json'), 'projects')
+        self.assertEqual(cache.get_resource('surveyors/'), 'surveyors')
+        self.assertEqual(cache.get_resource(''), '')
+
+    def test__is_cacheable(self):
+        self.assertFalse(cache.is_cacheable('aether-kernel', 'projects-stats.json'))
+
+        with override_settings(PROXY_CACHE_ENABLED=True):
+            self.assertTrue(cache.is_cacheable('aether-kernel', 'projects-stats.json'))
+            self.assertTrue(cache.is_cacheable('kernel', 'projects/1234/schemas-skeleton.json'))
+            self.assertFalse(cache.is_cacheable('kernel', 'projects/1234.json'))
+            self.assertFalse(cache.is_cacheable('kernel', 'entities.json'))
+            self.assertTrue(cache.is_cacheable('aether-odk', '/surveyors.json'))
+            self.assertFalse(cache.is_cacheable('other', 'surveyors.json'))
+
+    def test__is_shared(self):
+        self.assertTrue(cache.is_shared('aether-kernel', 'projects-stats.json'))
+        self.assertTrue(cache.is_shared('kernel', '/projects/1234/schemas-skeleton.json'))
+        self.assertFalse(cache.is_shared('kernel', 'entities.json'))
+        self.assertFalse(cache.is_shared('aether-odk', 'surveyors.json'))
+
+        with override_settings(PROXY_CACHE_SHARED_ROUTES={'odk': ['surveyors']}):
+            self.assertTrue(cache.is_shared('aether-odk', 'surveyors.json'))
+            self.assertFalse(cache.is_shared('aether-kernel', 'projects-stats.json'))
+
+    def test__build_key(self):
+        key = cache.build_key('kernel', 'eha', 1, 'projects.json', 'http://kernel/projects.json')
+        self.assertEqual(key, cache.build_key('kernel', 'eha', 1, 'projects.json', 'http://kernel/projects.json'))
+        self.assertNotEqual(key, cache.build_key('kernel', 'eha', 2, 'projects.json', 'http://kernel/projects.json'))
+        self.assertNotEqual(key, cache.build_key('kernel', 'aaa', 1, 'projects.json', 'http://kernel/projects.json'))
+
+        cache.invalidate('kernel', 'eha', 'projects/1234.json')
+        self.assertNotEqual(key, cache.build_key('kernel', 'eha', 1, 'projects.json', 'http://kernel/projects.json'))
+
+    @override_settings(PROXY_CACHE_REDIS=True)
+    def test__redis(self):
+        redis = FakeRedis()
+        with mock.patch('gather.api.cache.get_redis', return_value=redis):
+            cache.set_entry('a', {'content': b'a'})
+            self.assertEqual(cache.get_entry('a'), {'content': b'a'})
+
+            # other process
+            cache.clear()
+            self.assertEqual(cache.get_entry('a'), {'content': b'a'})
+
+            self.assertEqual(cache.get_generation('kernel', 'eha', 'projects'), 0)
+            cache.invalidate('kernel', 'eha', 'projects')
+            cache.clear()
+            self.assertEqual(cache.get_generation('kernel', 'eha', 'projects'), 1)
+
+        with mock.patch('gather.api.cache.get_redis', return_value=BrokenRedis()):
+            cache.set_entry('b', {'content': b'b'})
+            self.assertEqual(cache.get_entry('b'), {'content': b'b'})
+            cache.invalidate('kernel', 'eha', 'projects')
+            self.assertEqual(cache.get_generation('kernel', 'eha', 'projects'), 1)
+
+    @override_settings(
+        PROXY_CACHE_REDIS=True,
+        REDIS_HOST='localhost',
+        REDIS_PORT=6379,
+        REDIS_DB=0,
+        REDIS_PASSWORD=None,
+    )
+    def test__get_redis(self):
+        self.assertIsNotNone(cache.get_redis())
+        self.assertEqual(cache.get_redis(), cache.get_redis())
+
+        with override_settings(PROXY_CACHE_REDIS=False):
+            self.assertIsNone(cache.get_redis())
+
+
+@override_settings(PROXY_CACHE_ENABLED=True)
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class CacheProxyTests(TestCase):
+
+    def setUp(self):
+        super(CacheProxyTests, self).setUp()
+        cache.clear()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        self.url = reverse('kernel-proxy-path', kwargs={'path': 'projects-stats.json'})
+
+    def tearDown(self):
+        cache.clear()
+        super(CacheProxyTests, self).tearDown()
+
+    def test__cache(self, *args):
+        headers = {'Content-Type': 'application/json', 'ETag': '"v1"'}
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(200, b'{"count": 1}', headers)) as mock_req:
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['X-Gather-Cache'], 'MISS')
+            self.assertEqual(response.content, b'{"count": 1}')
+            self.assertEqual(mock_req.call_args[1]['headers']['Accept-Encoding'], 'identity')
+
+            response = self.client.get(self.url)
+            self.assertEqual(response['X-Gather-Cache'], 'HIT')
+            self.assertEqual(response.content, b'{"count": 1}')
+            self.assertEqual(response['ETag'], '"v1"')
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+            # conditional request
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"v1"')
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['X-Gather-Cache'], 'HIT')
+
+            # other query string, other entry
+            response = self.client.get(self.url + '?page=2')
+            self.assertEqual(response['X-Gather-Cache'], 'MISS')
+
+            self.assertEqual(mock_req.call_count, 2)
+
+    def test__cache__compressed_etag(self, *args):
+        content = b'{"results": [%s]}' % b', '.join([b'{"id": 1}'] * 200)
+        headers = {'Content-Type': 'application/json', 'ETag': '"v1"'}
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(200, content, headers)) as mock_req:
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['X-Gather-Cache'], 'MISS')
+            # the compression middleware makes the ETag weak
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['ETag'], 'W/"v1"')
+
+            for if_none_match in ('W/"v1"', '"v1"', '"v0", W/"v1"', '*'):
+                response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=if_none_match)
+                self.assertEqual(response.status_code, 304, if_none_match)
+                self.assertEqual(response['X-Gather-Cache'], 'HIT')
+                self.assertEqual(response.content, b'')
+
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH='W/"v0", "v2"')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['ETag'], 'W/"v1"')
+
+            self.assertEqual(mock_req.call_count, 1)
+
+    def test__cache__revalidate(self, *args):
+        headers = {'Content-Type': 'application/json', 'ETag': '"v1"'}
+        with override_settings(PROXY_CACHE_TTL=0):
+            with mock.patch('gather.api.upstream.request',
+                            return_value=upstream_response(200, b'{"count": 1}', headers)):
+                response = self.client.get(self.url)
+                self.assertEqual(response['X-Gather-Cache'], 'MISS')
+
+            with mock.patch('gather.api.upstream.request',
+                            return_value=upstream_response(304, b'', headers)) as mock_req:
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH='"v0"')
+                self.assertEqual(response['X-Gather-Cache'], 'REVALIDATED')
+                self.assertEqual(response.content, b'{"count": 1}')
+                self.assertEqual(mock_req.call_args[1]['headers']['If-None-Match'], '"v1"')
+
+            with mock.patch('gather.api.upstream.request',
+                            return_value=upstream_response(200, b'{"count": 2}', {'ETag': '"v2"'})):
+                response = self.client.get(self.url)
+                self.assertEqual(response['X-Gather-Cache'], 'MISS')
+                self.assertEqual(response.content, b'{"count": 2}')
+                self.assertEqual(response['ETag'], '"v2"')
+
+    def test__cache__invalidate(self, *args):
+        with mock.patch('gather.api.upstream.request',
+                        side_effect=lambda *args, **kwargs: upstream_response(200, b'{}')) as mock_req:
+            self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'MISS')
+            self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'HIT')
+
+            # failed writes do not invalidate
+            mock_req.side_effect = lambda *args, **kwargs: upstream_response(400, b'{}')
+            self.client.patch(reverse('kernel-proxy-path', kwargs={'path': 'projects/1.json'}))
+            self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'HIT')
+
+            # writes in other resources do not invalidate
+            mock_req.side_effect = lambda *args, **kwargs: upstream_response(200, b'{}')
+            self.client.patch(reverse('kernel-proxy-path', kwargs={'path': 'schemas/1.json'}))
+            self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'HIT')
+
+            self.client.patch(reverse('kernel-proxy-path', kwargs={'path': 'projects/1.json'}))
+            self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'MISS')
+
+    def test__cache__not_cacheable(self, *args):
+        with mock.patch('gather.api.upstream.request',
+                        side_effect=lambda *args, **kwargs: upstream_response(500, b'{}')):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 500)
+            self.assertEqual(response['X-Gather-Cache'], 'MISS')
+            self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'MISS')
+
+        with override_settings(PROXY_CACHE_MAX_BODY_SIZE=1):
+            with mock.patch('gather.api.upstream.request',
+                            side_effect=lambda *args, **kwargs: upstream_response(200, b'{}')):
+                self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'MISS')
+                self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'MISS')
+
+        with mock.patch('gather.api.upstream.request',
+                        side_effect=lambda *args, **kwargs: upstream_response(200, b'{}')):
+            response = self.client.get(reverse('kernel-proxy-path', kwargs={'path': 'entities.json'}))
+            self.assertFalse(response.has_header('X-Gather-Cache'))
+            self.assertTrue(response.streaming)
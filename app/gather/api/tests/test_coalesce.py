@@ -0,0 +1,233 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+from time import sleep
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from prometheus_client import REGISTRY
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from .. import cache, coalesce
+from .test_proxy import upstream_response
+
+
+def run_concurrently(func, times):
+    results = []
+
+    def target():
+        try:
+            results.append(func())
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=target) for _ in range(times)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class FakeLock(object):
+
+    def __init__(self, acquired, locked):
+        self._acquired = acquired
+        self._locked = list(locked)
+        self.released = False
+
+    def acquire(self, blocking=True):
+        return self._acquired
+
+    def locked(self):
+        return self._locked.pop(0) if self._locked else False
+
+    def release(self):
+        self.released = True
+
+
+class CoalesceTests(TestCase):
+
+    def test__run(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            sleep(0.2)
+            return 'result'
+
+        results = run_concurrently(lambda: coalesce.run('a', func), 10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [('result', False)] + [('result', True)] * 9)
+
+        # not running anymore
+        self.assertEqual(coalesce.run('a', func), ('result', False))
+        self.assertEqual(len(calls), 2)
+
+        with override_settings(PROXY_COALESCE_ENABLED=False):
+            run_concurrently(lambda: coalesce.run('a', func), 5)
+            self.assertEqual(len(calls), 7)
+
+    def test__run__failed(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            sleep(0.2)
+            if len(calls) == 1:
+                raise RuntimeError('upstream error')
+            return 'result'
+
+        results = run_concurrently(lambda: coalesce.run('b', func), 3)
+        self.assertIsInstance(results[0], RuntimeError)
+        # the waiting calls are executed on their own
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(results[1:], [('result', False)] * 2)
+
+    @override_settings(PROXY_COALESCE_TIMEOUT=0.1)
+    def test__run__timeout(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            sleep(0.3)
+            return 'result'
+
+        results = run_concurrently(lambda: coalesce.run('c', func), 3)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(results, [('result', False)] * 3)
+
+    @override_settings(PROXY_COALESCE_REDIS=True)
+    def test__run__redis(self):
+        func = mock.Mock(return_value='result')
+        redis = mock.Mock()
+
+        # this process takes the lock
+        lock = FakeLock(acquired=True, locked=[])
+        redis.lock.return_value = lock
+        with mock.patch('gather.api.coalesce.get_redis', return_value=redis):
+            self.assertEqual(coalesce.run('d', func, lookup=lambda: None), ('result', False))
+        self.assertTrue(lock.released)
+        self.assertEqual(func.call_count, 1)
+
+        # other process has the lock and shares the result
+        lookup = mock.Mock(side_effect=[None, 'shared'])
+        redis.lock.return_value = FakeLock(acquired=False, locked=[True, True])
+        with mock.patch('gather.api.coalesce.get_redis', return_value=redis):
+            self.assertEqual(coalesce.run('d', func, lookup=lookup), ('shared', True))
+        self.assertEqual(func.call_count, 1)
+
+        # other process released the lock without sharing the result
+        redis.lock.return_value = FakeLock(acquired=False, locked=[True, False])
+        with mock.patch('gather.api.coalesce.get_redis', return_value=redis):
+            self.assertEqual(coalesce.run('d', func, lookup=lambda: None), ('result', False))
+        self.assertEqual(func.call_count, 2)
+
+        # REDIS is down
+        redis.lock.side_effect = ConnectionError('REDIS is down')
+        with mock.patch('gather.api.coalesce.get_redis', return_value=redis):
+            self.assertEqual(coalesce.run('d', func, lookup=lambda: None), ('result', False))
+        self.assertEqual(func.call_count, 3)
+
+
+@override_settings(PROXY_CACHE_ENABLED=True)
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class CoalesceProxyTests(TransactionTestCase):
+
+    def setUp(self):
+        super(CoalesceProxyTests, self).setUp()
+        cache.clear()
+        get_user_model().objects.create_user('test', 'test@example.com', 'testtest')
+        get_user_model().objects.create_user('other', 'other@example.com', 'testtest')
+        self.url = reverse('kernel-proxy-path', kwargs={'path': 'projects/1234/schemas-skeleton.json'})
+
+    def tearDown(self):
+        cache.clear()
+        super(CoalesceProxyTests, self).tearDown()
+
+    def get_concurrently(self, times, usernames=('test',), url=None):
+        clients = []
+        for index in range(times):
+            client = self.client_class()
+            client.login(username=usernames[index % len(usernames)], password='testtest')
+            clients.append(client)
+
+        results = []
+        threads = [threading.Thread(target=lambda c=c: results.append(c.get(url or self.url))) for c in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test__proxy(self, *args):
+        labels = {'app': 'aether-kernel', 'route': '/projects/{id}/schemas-skeleton.json'}
+        coalesced = REGISTRY.get_sample_value('gather_upstream_coalesced_requests_total', labels) or 0
+
+        def slow(*args, **kwargs):
+            sleep(0.3)
+            return upstream_response(200, b'{"name": "skeleton"}', {'Content-Type': 'application/json'})
+
+        with mock.patch('gather.api.upstream.request', side_effect=slow) as mock_req:
+            responses = self.get_concurrently(5)
+
+        self.assertEqual(mock_req.call_count, 1)
+        self.assertEqual([r.content for r in responses], [b'{"name": "skeleton"}'] * 5)
+        self.assertEqual(sorted([r['X-Gather-Cache'] for r in responses]), ['COALESCED'] * 4 + ['MISS'])
+        self.assertEqual(REGISTRY.get_sample_value('gather_upstream_coalesced_requests_total', labels), coalesced + 4)
+
+    def test__proxy__users(self, *args):
+        def slow(*args, **kwargs):
+            sleep(0.3)
+            return upstream_response(200, b'{"name": "shared"}', {'Content-Type': 'application/json'})
+
+        # the kernel skeleton depends only on the realm, the users share it
+        with mock.patch('gather.api.upstream.request', side_effect=slow) as mock_req:
+            responses = self.get_concurrently(6, usernames=('test', 'other'))
+        self.assertEqual(mock_req.call_count, 1)
+        self.assertEqual(sorted([r['X-Gather-Cache'] for r in responses]), ['COALESCED'] * 5 + ['MISS'])
+
+        # the ODK surveyors are not shared, one call per user
+        url = reverse('odk-proxy-path', kwargs={'path': 'surveyors.json'})
+        with mock.patch('gather.api.upstream.request', side_effect=slow) as mock_req:
+            responses = self.get_concurrently(6, usernames=('test', 'other'), url=url)
+        self.assertEqual(mock_req.call_count, 2)
+        self.assertEqual(sorted([r['X-Gather-Cache'] for r in responses]), ['COALESCED'] * 4 + ['MISS'] * 2)
+
+    def test__proxy__errors(self, *args):
+        def slow(*args, **kwargs):
+            sleep(0.3)
+            return upstream_response(500, b'{"detail": "error"}', {'Content-Type': 'application/json'})
+
+        with mock.patch('gather.api.upstream.request', side_effect=slow) as mock_req:
+            responses = self.get_concurrently(3)
+            self.assertEqual(mock_req.call_count, 1)
+            self.assertEqual([r.status_code for r in responses], [500] * 3)
+
+            # not cached
+            self.assertEqual(self.get_concurrently(1)[0]['X-Gather-Cache'], 'MISS')
+            self.assertEqual(mock_req.call_count, 2)
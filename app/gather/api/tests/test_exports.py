@@ -0,0 +1,354 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+
+from datetime import timedelta
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from aether.sdk.auth.apptoken.models import AppToken
+from aether.sdk.multitenancy.models import MtInstance
+from aether.sdk.unittest import MockResponse
+
+from .. import exports
+from ..masks import build_columns_tree
+from ..models import ExportFile, Survey, Mask
+from . import build_pages
+from .test_masks import PAYLOAD
+from .test_proxy import upstream_response
+
+COLUMNS = ['name', 'address.city', 'children.#.name', 'other']
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def export(pages, file_format, columns=COLUMNS):
+    stats = exports.ExportStats()
+    content = b''.join(exports.export_content(
+        iter(pages), columns, build_columns_tree(columns), file_format, stats))
+    return content, stats
+
+
+def read_xlsx(content):
+    with zipfile.ZipFile(io.BytesIO(content)) as xlsx:
+        sheet = ElementTree.fromstring(xlsx.read('xl/worksheets/sheet1.xml'))
+
+    return [
+        [
+            ''.join(cell.itertext()) if cell.get('t') == 'inlineStr' else float(cell.find(f'{XLSX_NS}v').text)
+            for cell in row
+        ]
+        for row in sheet.iter(f'{XLSX_NS}row')
+    ]
+
+
+class ExportsTests(TestCase):
+
+    def test__get_value(self):
+        self.assertEqual(exports.get_value(PAYLOAD, ['name']), 'John')
+        self.assertEqual(exports.get_value(PAYLOAD, ['address', 'city']), 'Berlin')
+        self.assertEqual(exports.get_value(PAYLOAD, ['children', 'name']), ['Ann', 'Tom'])
+        self.assertIsNone(exports.get_value(PAYLOAD, ['name', 'first']))
+        self.assertIsNone(exports.get_value(None, ['name']))
+
+    def test__get_max_rows(self):
+        with override_settings(EXPORT_MAX_ROWS_SIZE='0'):
+            self.assertEqual(exports.get_max_rows('csv'), 0)
+            self.assertEqual(exports.get_max_rows('xlsx'), exports.XLSX_MAX_ROWS)
+
+        with override_settings(EXPORT_MAX_ROWS_SIZE='10'):
+            self.assertEqual(exports.get_max_rows('ndjson'), 10)
+            self.assertEqual(exports.get_max_rows('xlsx'), 10)
+
+    def test__csv(self):
+        content, stats = export(build_pages([PAYLOAD] * 5, 2), 'csv')
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8'))))
+
+        self.assertEqual(rows[0], ['id', 'name', 'address.city', 'children.#.name', 'other'])
+        self.assertEqual(rows[1], ['0', 'John', 'Berlin', '["Ann", "Tom"]', ''])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(stats.rows, 5)
+        self.assertGreater(stats.rows_per_second, 0)
+
+    def test__ndjson(self):
+        content, stats = export(build_pages([PAYLOAD] * 3, 2), 'ndjson')
+        lines = content.decode('utf-8').splitlines()
+
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[2]), {
+            'id': 2,
+            'payload': {'name': 'John', 'address': {'city': 'Berlin'}, 'children': [{'name': 'Ann'}, {'name': 'Tom'}]},
+        })
+
+    def test__xlsx(self):
+        pages = build_pages([PAYLOAD] * 3, 2)
+        pages[0]['results'][0]['payload'] = {'name': '<b>Ann & \x01Tom</b>', 'other': 1.5}
+
+        content, stats = export(pages, 'xlsx')
+        rows = read_xlsx(content)
+
+        self.assertEqual(rows[0], ['id', 'name', 'address.city', 'children.#.name', 'other'])
+        self.assertEqual(rows[1], [0, '<b>Ann & Tom</b>', '', '', 1.5])
+        self.assertEqual(rows[3], [2, 'John', 'Berlin', '["Ann", "Tom"]', ''])
+        self.assertEqual(len(rows), 4)
+
+    @override_settings(EXPORT_MAX_ROWS_SIZE='3')
+    def test__max_rows(self):
+        fetched = []
+
+        def pages():
+            for page in build_pages([PAYLOAD] * 10, 2):
+                fetched.append(page)
+                yield page
+
+        content, stats = export(pages(), 'ndjson')
+        self.assertEqual(stats.rows, 3)
+        self.assertEqual(len(content.decode('utf-8').splitlines()), 3)
+        # no more pages than needed
+        self.assertEqual(len(fetched), 2)
+
+    def test__unknown_format(self):
+        with self.assertRaises(ValueError):
+            export([], 'pdf')
+
+    def test__write_to_storage(self):
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                name = exports.write_to_storage(iter([b'a', b'b']), 'exports/test.csv')
+                with open(os.path.join(media_root, name), 'rb') as fp:
+                    self.assertEqual(fp.read(), b'ab')
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class ExportViewTests(TestCase):
+
+    def setUp(self):
+        super(ExportViewTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        self.survey = Survey.objects.create(name='My Survey')
+        MtInstance.objects.create(instance=self.survey, realm=settings.DEFAULT_REALM)
+        self.mask = Mask.objects.create(survey=self.survey, name='Mask', columns=['name'])
+        self.url = reverse('mask-export', kwargs={'pk': self.mask.pk})
+
+    def kernel_request(self, *args, **kwargs):
+        pages = build_pages([PAYLOAD] * 5, 2)
+        return MockResponse(200, pages[kwargs['params']['page'] - 1])
+
+    @override_settings(EXPORT_CACHE_ENABLED=False)
+    def test__stream(self, *args):
+        with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request) as mock_req:
+            response = self.client.get(self.url, {'file_format': 'csv', 'status': 'Publishable'})
+            self.assertTrue(response.streaming)
+            self.assertFalse(response.has_header('X-Gather-Cache'))
+            content = b''.join(response.streaming_content)
+
+            self.assertEqual(mock_req.call_count, 3)
+            params = mock_req.call_args[1]['params']
+            self.assertEqual(params['status'], 'Publishable')
+            self.assertEqual(params['project'], str(self.survey.pk))
+            self.assertNotIn('file_format', params)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="my-survey-mask.csv"')
+        self.assertEqual(content.decode('utf-8').splitlines(), ['id,name'] + [f'{i},John' for i in range(5)])
+
+    @override_settings(EXPORT_CACHE_ENABLED=False)
+    def test__storage(self, *args):
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request):
+                    response = self.client.get(self.url, {'file_format': 'xlsx', 'storage': 'true'})
+
+                self.assertEqual(response.status_code, 200)
+                content = response.json()
+                self.assertEqual(content['name'], f'exports/{self.survey.pk}/my-survey-mask.xlsx')
+                self.assertEqual(content['rows'], 5)
+                self.assertIn('rows_per_second', content)
+
+                with open(os.path.join(media_root, content['name']), 'rb') as fp:
+                    self.assertEqual(len(read_xlsx(fp.read())), 6)
+
+    def test__errors(self, *args):
+        response = self.client.get(self.url, {'file_format': 'pdf'})
+        self.assertEqual(response.status_code, 400)
+
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(500, b'error', {'Content-Type': 'text/plain'})):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.content, b'error')
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class ExportCacheTests(TestCase):
+
+    def setUp(self):
+        super(ExportCacheTests, self).setUp()
+
+        self.media_root = tempfile.TemporaryDirectory()
+        self.override = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.override.enable()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        self.survey = Survey.objects.create(name='survey')
+        MtInstance.objects.create(instance=self.survey, realm=settings.DEFAULT_REALM)
+        self.mask = Mask.objects.create(survey=self.survey, name='mask', columns=['name'])
+        self.url = reverse('mask-export', kwargs={'pk': self.mask.pk})
+        self.modified = '2020-01-01T00:00:00Z'
+
+    def tearDown(self):
+        self.override.disable()
+        self.media_root.cleanup()
+        super(ExportCacheTests, self).tearDown()
+
+    def kernel_request(self, *args, **kwargs):
+        params = kwargs['params']
+        if params.get('ordering') == '-modified':
+            return MockResponse(200, {'count': 5, 'results': [{'id': 4, 'modified': self.modified}]})
+        return MockResponse(200, build_pages([PAYLOAD] * 5, 2)[params['page'] - 1])
+
+    def create_export_files(self, sizes):
+        now = timezone.now()
+        for i, size in enumerate(sizes):
+            export_file = ExportFile(key=str(i), mask=self.mask, file_format='csv', size=size)
+            export_file.file.save(f'{i}.csv', io.BytesIO(b'a' * size), save=False)
+            export_file.accessed = now - timedelta(days=i)  # the first one is the most recent
+            export_file.save()
+
+    def test__stream(self, *args):
+        with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request) as mock_req:
+            response = self.client.get(self.url, {'status': 'Publishable'})
+            self.assertEqual(response['X-Gather-Cache'], 'MISS')
+            content = b''.join(response.streaming_content)
+            self.assertEqual(mock_req.call_count, 4)  # version + 3 pages
+            self.assertEqual(mock_req.call_args_list[0][1]['params']['status'], 'Publishable')
+
+            export_file = ExportFile.objects.get()
+            self.assertEqual(export_file.rows, 5)
+            self.assertEqual(export_file.size, len(content))
+            self.assertTrue(export_file.file.name.startswith(f'exports/{self.survey.pk}/'))
+
+            response = self.client.get(self.url, {'status': 'Publishable'})
+            self.assertEqual(response['X-Gather-Cache'], 'HIT')
+            self.assertEqual(response['Content-Disposition'], 'attachment; filename="survey-mask.csv"')
+            self.assertEqual(b''.join(response.streaming_content), content)
+            self.assertEqual(mock_req.call_count, 5)  # only the version
+
+            # other filters, other format or new entities
+            self.assertEqual(self.client.get(self.url)['X-Gather-Cache'], 'MISS')
+            self.assertEqual(self.client.get(self.url, {'file_format': 'ndjson'})['X-Gather-Cache'], 'MISS')
+            self.modified = '2020-01-02T00:00:00Z'
+            self.assertEqual(self.client.get(self.url, {'status': 'Publishable'})['X-Gather-Cache'], 'MISS')
+
+            # other mask columns
+            self.mask.columns = ['name', 'age']
+            self.mask.save()
+            self.assertEqual(self.client.get(self.url, {'status': 'Publishable'})['X-Gather-Cache'], 'MISS')
+
+    def test__stream__not_consumed(self, *args):
+        with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request):
+            response = self.client.get(self.url)
+            next(response.streaming_content)
+            # the client goes away (the "request_finished" signal keeps the test database connection)
+            with mock.patch.object(connection, 'close_if_unusable_or_obsolete'):
+                response.close()
+
+        self.assertFalse(ExportFile.objects.exists())
+
+    def test__storage(self, *args):
+        with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request):
+            response = self.client.get(self.url, {'storage': 'true'})
+            self.assertEqual(response['X-Gather-Cache'], 'MISS')
+            content = response.json()
+            self.assertEqual(content['rows'], 5)
+
+            response = self.client.get(self.url, {'storage': 'true'})
+            self.assertEqual(response['X-Gather-Cache'], 'HIT')
+            self.assertEqual(response.json()['name'], content['name'])
+            self.assertEqual(response.json()['rows'], 5)
+
+        self.assertEqual(ExportFile.objects.count(), 1)
+
+    def test__kernel_error(self, *args):
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(404, b'{}', {'Content-Type': 'application/json'})):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+    def test__prune_export_files(self, *args):
+        self.create_export_files([10, 10, 10, 10, 10])
+        names = [export_file.file.name for export_file in ExportFile.objects.order_by('key')]
+
+        self.assertEqual(exports.prune_export_files(max_files=4), 1)
+        self.assertEqual(exports.prune_export_files(max_size=25), 2)
+        self.assertEqual(sorted(ExportFile.objects.values_list('key', flat=True)), ['0', '1'])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root.name, names[0])))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root.name, names[4])))
+
+        self.assertEqual(exports.prune_export_files(max_age=0, keep=ExportFile.objects.get(key='1').pk), 1)
+        self.assertEqual(list(ExportFile.objects.values_list('key', flat=True)), ['1'])
+
+    def test__prune_exports_command(self, *args):
+        self.create_export_files([10, 10, 10])
+
+        output = io.StringIO()
+        call_command('prune_exports', '--max-age=2', stdout=output)
+        self.assertIn('Deleted 1 export files', output.getvalue())
+        self.assertEqual(ExportFile.objects.count(), 2)
+
+        call_command('prune_exports', '--max-files=1', stdout=output)
+        self.assertEqual(ExportFile.objects.count(), 1)
+
+    @override_settings(EXPORT_CACHE_MAX_FILES=1)
+    def test__eviction(self, *args):
+        with mock.patch('gather.api.upstream.request', side_effect=self.kernel_request):
+            self.client.get(self.url, {'storage': 'true', 'file_format': 'csv'})
+            self.client.get(self.url, {'storage': 'true', 'file_format': 'xlsx'})
+
+        self.assertEqual(list(ExportFile.objects.values_list('file_format', flat=True)), ['xlsx'])
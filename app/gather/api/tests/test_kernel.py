@@ -0,0 +1,196 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+from time import sleep, time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase, override_settings
+
+from requests.exceptions import HTTPError
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from . import StubServer
+from .. import kernel, tokens, upstream
+
+
+def stub_kernel(routes):
+    server = StubServer(routes)
+    external_apps = {'aether-kernel': {'test': {'url': f'{server.url}/kernel', 'token': 'kernel'}}}
+    return server, override_settings(EXTERNAL_APPS=external_apps)
+
+
+def entities_route(count, page_size, delay=0):
+    def handler(handler, body):
+        page = int(handler.path.split('page=')[1].split('&')[0])
+        sleep(delay)
+        return 200, {}, {
+            'count': count,
+            'next': 'next' if page * page_size < count else None,
+            'results': list(range((page - 1) * page_size, min(page * page_size, count))),
+        }
+    return handler
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class KernelTests(TestCase):
+
+    def setUp(self):
+        super(KernelTests, self).setUp()
+        upstream.close_sessions()
+        tokens.clear()
+
+        self.request = RequestFactory().get('/')
+        self.request.user = get_user_model().objects.create_user('test', 'test@example.com', 'testtest')
+
+    def tearDown(self):
+        upstream.close_sessions()
+        super(KernelTests, self).tearDown()
+
+    def test__get_headers(self, mock_token):
+        self.assertEqual(kernel.get_headers(self.request)['Authorization'], 'Token ABCDEFGH')
+
+        # the token is cached
+        mock_token.return_value = None
+        self.assertEqual(kernel.get_headers(self.request)['Authorization'], 'Token ABCDEFGH')
+
+        tokens.clear()
+        with self.assertRaises(kernel.PermissionDenied):
+            kernel.get_headers(self.request)
+
+    def test__fetch_pages(self, *args):
+        server, settings = stub_kernel({'/kernel/entities.json': entities_route(count=3, page_size=1)})
+        with server, settings:
+            pages = list(kernel.fetch_pages(self.request, 'entities.json', {'project': 1}, page_size=1))
+
+        self.assertEqual([page['results'] for page in pages], [[0], [1], [2]])
+        self.assertEqual(len(server.requests), 3)
+        self.assertIn('project=1', server.requests[0][1])
+        self.assertIn('page_size=1', server.requests[0][1])
+
+    def test__fetch_pages__in_order(self, *args):
+        def entities(handler, body):
+            page = int(handler.path.split('page=')[1].split('&')[0])
+            sleep(0.01 * (20 - page))  # the first pages are the slowest
+            return 200, {}, {'count': 20, 'next': 'next' if page < 20 else None, 'results': [page]}
+
+        server, settings = stub_kernel({'/kernel/entities.json': entities})
+        with server, settings:
+            entities = list(kernel.fetch_entities(self.request, 'entities.json', page_size=1, workers=4))
+
+        self.assertEqual(entities, list(range(1, 21)))
+
+    def test__fetch_pages__backpressure(self, *args):
+        server, settings = stub_kernel({'/kernel/entities.json': entities_route(count=100, page_size=1)})
+        with server, settings:
+            pages = kernel.fetch_pages(self.request, 'entities.json', page_size=1, workers=2)
+            next(pages)
+            next(pages)
+            sleep(0.2)
+            # the first page + 2 workers x 2 (the consumed one included)
+            self.assertEqual(len(server.requests), 5)
+
+            # the consumer goes away
+            pages.close()
+            sleep(0.2)
+            self.assertEqual(len(server.requests), 5)
+
+    @override_settings(UPSTREAM_RETRIES_BACKOFF=0)
+    def test__fetch_pages__retries(self, *args):
+        calls = []
+
+        def entities(handler, body):
+            page = int(handler.path.split('page=')[1].split('&')[0])
+            calls.append(page)
+            if page == 2 and calls.count(2) == 1:
+                return 200, {'Content-Type': 'application/json'}, b'{"count": 3, "resu'  # incomplete
+            return 200, {}, {'count': 3, 'next': 'next' if page < 3 else None, 'results': [page]}
+
+        server, settings = stub_kernel({'/kernel/entities.json': entities})
+        with server, settings:
+            entities = list(kernel.fetch_entities(self.request, 'entities.json', page_size=1))
+
+        self.assertEqual(entities, [1, 2, 3])
+        self.assertEqual(sorted(calls), [1, 2, 2, 3])
+
+    def test__fetch_pages__error(self, *args):
+        def entities(handler, body):
+            page = int(handler.path.split('page=')[1].split('&')[0])
+            if page == 3:
+                return 500, {}, {'detail': 'error'}
+            return 200, {}, {'count': 4, 'next': 'next', 'results': [page]}
+
+        server, settings = stub_kernel({'/kernel/entities.json': entities})
+        with server, settings, override_settings(UPSTREAM_RETRIES=0):
+            pages = kernel.fetch_pages(self.request, 'entities.json', page_size=1)
+            self.assertEqual(next(pages)['results'], [1])
+            self.assertEqual(next(pages)['results'], [2])
+            with self.assertRaises(HTTPError):
+                next(pages)
+
+    @override_settings(UPSTREAM_MAX_WORKERS=2)
+    def test__get_pages(self, *args):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+
+        def slow(handler, body):
+            with lock:
+                running.append(1)
+                max_running.append(len(running))
+            sleep(0.2)
+            with lock:
+                running.pop()
+            return 200, {}, {'path': handler.path}
+
+        server, settings = stub_kernel({
+            '/kernel/a.json': slow,
+            '/kernel/b.json': slow,
+            '/kernel/c.json': slow,
+            '/kernel/d.json': slow,
+            '/kernel/e.json': (404, {}, {'detail': 'Not found.'}),
+        })
+        with server, settings:
+            start = time()
+            results = kernel.get_pages(self.request, [
+                ('a.json', {'page': 1}),
+                ('b.json', None),
+                ('c.json', None),
+                ('d.json', None),
+                ('e.json', None),
+            ])
+            duration = time() - start
+
+        self.assertEqual(results[0], {'path': '/kernel/a.json?page=1'})
+        self.assertEqual(results[3], {'path': '/kernel/d.json'})
+        self.assertIsInstance(results[4], HTTPError)
+        self.assertEqual(kernel.error_response(results[4]).status_code, 404)
+
+        # two by two
+        self.assertEqual(max(max_running), 2)
+        self.assertLess(duration, 0.8)
+
+    def test__error_response(self, *args):
+        with self.assertRaises(ValueError):
+            kernel.error_response(ValueError())
@@ -0,0 +1,193 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from aether.sdk.auth.apptoken.models import AppToken
+from aether.sdk.multitenancy.models import MtInstance
+from aether.sdk.unittest import MockResponse
+
+from .. import tokens, upstream
+from ..masks import apply_columns_tree, apply_mask, build_columns_tree, stream_entities
+from ..models import Survey, Mask
+from . import StubServer
+from .test_proxy import upstream_response
+
+
+PAYLOAD = {
+    'name': 'John',
+    'age': 30,
+    'address': {'city': 'Berlin', 'street': 'Main', 'number': 1},
+    'children': [{'name': 'Ann', 'age': 1}, {'name': 'Tom', 'age': 3}],
+}
+
+
+class MasksTests(TestCase):
+
+    def test__build_columns_tree(self):
+        self.assertEqual(build_columns_tree([]), {})
+        self.assertEqual(
+            build_columns_tree(['address.city', 'name', 'address.street', 'children.#.name', '']),
+            {'address': {'city': None, 'street': None}, 'name': None, 'children': {'name': None}},
+        )
+        # the whole value is requested
+        self.assertEqual(build_columns_tree(['address.city', 'address']), {'address': None})
+        self.assertEqual(build_columns_tree(['address', 'address.city']), {'address': None})
+
+    def test__apply_columns_tree(self):
+        self.assertEqual(apply_columns_tree(PAYLOAD, None), PAYLOAD)
+        self.assertEqual(apply_columns_tree(PAYLOAD, {}), {})
+        self.assertEqual(
+            apply_columns_tree(PAYLOAD, build_columns_tree(['name', 'address.city', 'children.age', 'other.a'])),
+            {
+                'name': 'John',
+                'address': {'city': 'Berlin'},
+                'children': [{'age': 1}, {'age': 3}],
+            },
+        )
+        self.assertEqual(apply_columns_tree(PAYLOAD, build_columns_tree(['name.first'])), {'name': None})
+
+    def test__apply_mask(self):
+        entity = {'id': 1, 'status': 'Publishable', 'payload': PAYLOAD}
+        self.assertEqual(
+            apply_mask(entity, build_columns_tree(['age'])),
+            {'id': 1, 'status': 'Publishable', 'payload': {'age': 30}},
+        )
+        self.assertEqual(apply_mask({'id': 1}, build_columns_tree(['age'])), {'id': 1, 'payload': {}})
+
+    def test__stream_entities(self):
+        tree = build_columns_tree(['age'])
+        pages = [
+            {'count': 3, 'results': [{'id': 1, 'payload': PAYLOAD}, {'id': 2, 'payload': PAYLOAD}]},
+            {'count': 3, 'results': []},
+            {'count': 3, 'results': [{'id': 3, 'payload': PAYLOAD}]},
+        ]
+        self.assertEqual(
+            json.loads(''.join(stream_entities(pages, tree))),
+            {'count': 3, 'results': [
+                {'id': 1, 'payload': {'age': 30}},
+                {'id': 2, 'payload': {'age': 30}},
+                {'id': 3, 'payload': {'age': 30}},
+            ]},
+        )
+        self.assertEqual(json.loads(''.join(stream_entities([], tree))), {'count': 0, 'results': []})
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class MaskEntitiesViewTests(TestCase):
+
+    def setUp(self):
+        super(MaskEntitiesViewTests, self).setUp()
+        upstream.close_sessions()
+        tokens.clear()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        self.survey = Survey.objects.create(name='survey')
+        MtInstance.objects.create(instance=self.survey, realm=settings.DEFAULT_REALM)
+        self.mask = Mask.objects.create(survey=self.survey, name='mask', columns=['name', 'address.city'])
+        self.url = reverse('mask-entities', kwargs={'pk': self.mask.pk})
+
+    def tearDown(self):
+        upstream.close_sessions()
+        super(MaskEntitiesViewTests, self).tearDown()
+
+    def test__stream(self, *args):
+        def entities(handler, body):
+            page = int(handler.path.split('page=')[1].split('&')[0])
+            return 200, {}, {
+                'count': 5,
+                'next': 'next' if page < 3 else None,
+                'results': [
+                    {'id': page * 10 + i, 'payload': PAYLOAD}
+                    for i in range(2 if page < 3 else 1)
+                ],
+            }
+
+        with StubServer({'/kernel/entities.json': entities}) as server:
+            external_apps = {'aether-kernel': {'test': {'url': f'{server.url}/kernel', 'token': 'kernel'}}}
+            with override_settings(EXTERNAL_APPS=external_apps, KERNEL_PAGE_SIZE=2):
+                response = self.client.get(self.url + '?status=Publishable&page_size=1')
+                self.assertTrue(response.streaming)
+                content = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content['count'], 5)
+        self.assertEqual([entity['id'] for entity in content['results']], [10, 11, 20, 21, 30])
+        for entity in content['results']:
+            self.assertEqual(entity['payload'], {'name': 'John', 'address': {'city': 'Berlin'}})
+
+        self.assertEqual(len(server.requests), 3)
+        for _, path, _, headers in server.requests:
+            self.assertIn(f'project={self.survey.pk}', path)
+            self.assertIn('status=Publishable', path)
+            self.assertIn('passthrough=true', path)
+            self.assertIn('page_size=2', path)
+            self.assertEqual(headers['Authorization'], 'Token ABCDEFGH')
+        # the pages after the first one are fetched concurrently reusing the pooled connections
+        self.assertLessEqual(len(set([address for _, _, address, _ in server.requests])), 2)
+
+    def test__page(self, *args):
+        page = {'count': 5, 'next': 'next', 'results': [{'id': 1, 'payload': PAYLOAD}]}
+        with mock.patch('gather.api.upstream.request',
+                        return_value=MockResponse(200, page)) as mock_req:
+            response = self.client.get(self.url + '?page=3&page_size=1')
+
+            mock_req.assert_called_once()
+            params = mock_req.call_args[1]['params']
+            self.assertEqual(params['page'], '3')
+            self.assertEqual(params['page_size'], '1')
+            self.assertEqual(params['project'], str(self.survey.pk))
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.json(), {
+            'count': 5,
+            'results': [{'id': 1, 'payload': {'name': 'John', 'address': {'city': 'Berlin'}}}],
+        })
+
+    def test__kernel_error(self, *args):
+        def forbidden(*args, **kwargs):
+            return upstream_response(403, b'{"detail": "Forbidden"}', {'Content-Type': 'application/json'})
+
+        with mock.patch('gather.api.upstream.request', side_effect=forbidden):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 403)
+            self.assertFalse(response.streaming)
+            self.assertEqual(response.json(), {'detail': 'Forbidden'})
+
+            response = self.client.get(self.url + '?page=1')
+            self.assertEqual(response.status_code, 403)
+
+    def test__no_token(self, mock_token):
+        mock_token.return_value = None
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,196 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from time import sleep
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from prometheus_client import REGISTRY
+from requests.exceptions import RequestException
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from . import StubServer
+from .. import cache, metrics, upstream
+from ...context_processors import clear_gather_context, gather_context
+
+
+def get_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        super(MetricsTests, self).setUp()
+        upstream.close_sessions()
+
+    def tearDown(self):
+        upstream.close_sessions()
+        super(MetricsTests, self).tearDown()
+
+    def test__get_route(self):
+        self.assertEqual(
+            metrics.get_route('http://kernel/projects/1234/schemas-skeleton.json?page=2'),
+            '/projects/{id}/schemas-skeleton.json',
+        )
+        self.assertEqual(
+            metrics.get_route('/kernel/entities/2c8bc20b-fb4a-4ba9-a6b1-69e0b6ec7b5e.json'),
+            '/entities/{id}.json',
+        )
+        self.assertEqual(metrics.get_route('/kernel/entities/'), '/entities/')
+        self.assertEqual(metrics.get_route('/odk/media-files/3/content/'), '/media-files/{id}/content/')
+        self.assertEqual(metrics.get_route('projects-stats.json'), '/projects-stats.json')
+
+        # the unknown paths share the same route
+        for url in ('', '/slow', '/admin/login/', '/projects/wrong.json', '/kernel/superprojects.json'):
+            self.assertEqual(metrics.get_route(url), metrics.OTHER_ROUTE, url)
+
+    def test__request(self):
+        labels = {'app': 'aether-kernel', 'route': '/projects/{id}.json', 'status': '200'}
+        count = get_value('gather_upstream_latency_seconds_count', **labels)
+        size = get_value('gather_upstream_response_bytes_sum', **labels)
+
+        routes = {'/projects/1.json': (200, {}, {'count': 0})}
+        with StubServer(routes) as server:
+            upstream.request('aether-kernel', 'get', f'{server.url}/projects/1.json')
+
+        self.assertEqual(get_value('gather_upstream_latency_seconds_count', **labels), count + 1)
+        self.assertEqual(get_value('gather_upstream_response_bytes_sum', **labels), size + len(b'{"count": 0}'))
+        self.assertEqual(get_value('gather_upstream_in_flight_requests', app='aether-kernel'), 0)
+
+    def test__request__in_flight(self):
+        def slow(*args):
+            value = get_value('gather_upstream_in_flight_requests', app='aether-kernel')
+            return 200, {}, {'in_flight': value}
+
+        with StubServer({'/slow': slow}) as server:
+            response = upstream.request('aether-kernel', 'get', f'{server.url}/slow')
+            self.assertEqual(response.json(), {'in_flight': 1})
+
+        self.assertEqual(get_value('gather_upstream_in_flight_requests', app='aether-kernel'), 0)
+
+    @override_settings(UPSTREAM_RETRIES_BACKOFF=0)
+    def test__request__retries(self):
+        labels = {'app': 'aether-kernel', 'route': '/projects.json'}
+        retries = get_value('gather_upstream_retries_total', **labels)
+
+        statuses = [503, 502, 200]
+        routes = {'/projects.json': lambda *args: (statuses.pop(0), {}, {})}
+        with StubServer(routes) as server:
+            response = upstream.request('aether-kernel', 'get', f'{server.url}/projects.json')
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(get_value('gather_upstream_retries_total', **labels), retries + 2)
+
+    @override_settings(UPSTREAM_RETRIES=0, UPSTREAM_READ_TIMEOUT=0.1)
+    def test__request__timeout(self):
+        labels = {'app': 'aether-kernel', 'route': 'other'}
+        timeouts = get_value('gather_upstream_timeouts_total', **labels)
+
+        def slow(*args):
+            sleep(0.5)
+            return 200, {}, {}
+
+        with StubServer({'/slow': slow}) as server:
+            with self.assertRaises(RequestException):
+                upstream.request('aether-kernel', 'get', f'{server.url}/slow')
+
+        self.assertEqual(get_value('gather_upstream_timeouts_total', **labels), timeouts + 1)
+        self.assertEqual(get_value('gather_upstream_in_flight_requests', app='aether-kernel'), 0)
+
+    def test__gather_context(self):
+        clear_gather_context()
+        hits = get_value('gather_cache_requests_total', cache='gather_context', result='hit')
+        misses = get_value('gather_cache_requests_total', cache='gather_context', result='miss')
+
+        request = RequestFactory().get('/')
+        gather_context(request)
+        gather_context(request)
+
+        self.assertEqual(get_value('gather_cache_requests_total', cache='gather_context', result='hit'), hits + 1)
+        self.assertEqual(get_value('gather_cache_requests_total', cache='gather_context', result='miss'), misses + 1)
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class MetricsProxyTests(TestCase):
+
+    def setUp(self):
+        super(MetricsProxyTests, self).setUp()
+        upstream.close_sessions()
+        cache.clear()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        self.user = get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+    def tearDown(self):
+        upstream.close_sessions()
+        cache.clear()
+        super(MetricsProxyTests, self).tearDown()
+
+    def test__proxy__streamed_size(self, *args):
+        body = b'x' * 1000
+        routes = {'/kernel/entities.json': lambda *args: (200, {}, body)}
+        labels = {'app': 'aether-kernel', 'route': '/entities.json', 'status': '200'}
+        size = get_value('gather_upstream_response_bytes_sum', **labels)
+
+        with StubServer(routes) as server:
+            external_apps = {'aether-kernel': {'test': {'url': f'{server.url}/kernel', 'token': 'kernel'}}}
+            with override_settings(EXTERNAL_APPS=external_apps):
+                response = self.client.get(reverse('kernel-proxy-path', kwargs={'path': 'entities.json'}))
+                # not reported till the body is consumed
+                self.assertEqual(get_value('gather_upstream_response_bytes_sum', **labels), size)
+                self.assertEqual(b''.join(response.streaming_content), body)
+
+        self.assertEqual(get_value('gather_upstream_response_bytes_sum', **labels), size + 1000)
+
+    @override_settings(PROXY_CACHE_ENABLED=True)
+    def test__proxy__cache(self, *args):
+        hits = get_value('gather_cache_requests_total', cache='proxy', result='hit')
+        misses = get_value('gather_cache_requests_total', cache='proxy', result='miss')
+
+        routes = {'/kernel/projects-stats.json': (200, {}, {'count': 1})}
+        with StubServer(routes) as server:
+            external_apps = {'aether-kernel': {'test': {'url': f'{server.url}/kernel', 'token': 'kernel'}}}
+            with override_settings(EXTERNAL_APPS=external_apps):
+                url = reverse('kernel-proxy-path', kwargs={'path': 'projects-stats.json'})
+                for _ in range(3):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertEqual(get_value('gather_cache_requests_total', cache='proxy', result='hit'), hits + 2)
+        self.assertEqual(get_value('gather_cache_requests_total', cache='proxy', result='miss'), misses + 1)
+
+    def test__metrics_endpoint(self, *args):
+        self.user.is_staff = True
+        self.user.is_superuser = True
+        self.user.save()
+
+        response = self.client.get('/admin/~prometheus/metrics')
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('gather_upstream_latency_seconds', content)
+        self.assertIn('gather_cache_requests_total', content)
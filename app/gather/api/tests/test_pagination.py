@@ -0,0 +1,191 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from aether.sdk.multitenancy.models import MtInstance
+
+from .. import pagination
+from ..models import Survey, Mask
+from .test_views import create_surveys
+
+
+class PaginationTests(TestCase):
+
+    def setUp(self):
+        super(PaginationTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        create_surveys(surveys=10, masks=3)
+
+    def get_all(self, url, params):
+        results = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            content = response.json()
+            results += content['results']
+            if not content['next']:
+                return results, content
+            response = self.client.get(content['next'])
+
+    def test__cursor(self):
+        values = ['survey 1', '0a1b2c3d-0000-0000-0000-000000000000']
+        cursor = pagination.encode_cursor(values, reverse=True)
+        self.assertEqual(pagination.decode_cursor(cursor, 2), (values, True))
+
+        for wrong in ('wrong', pagination.encode_cursor(values[:1]), pagination.encode_cursor([values[0], None])):
+            with self.assertRaises(pagination.NotFound):
+                pagination.decode_cursor(wrong, 2)
+
+    def test__keyset_filter__nulls(self):
+        # the NULL names go last
+        for i in range(3):
+            survey = Survey.objects.create(name=None)
+            MtInstance.objects.create(instance=survey, realm=settings.DEFAULT_REALM)
+
+        fields = ('name', 'project_id')
+        expected = list(
+            Survey.objects
+                  .order_by(*pagination.get_keyset_ordering(fields))
+                  .values_list(*fields)
+        )
+        self.assertEqual(expected[-1][0], None)
+        self.assertEqual(expected[0][0], 'other')
+
+        queryset = Survey.objects.values_list(*fields)
+        for index, values in enumerate(expected):
+            self.assertEqual(pagination.get_keyset_rows(queryset, fields, values), expected[index + 1:])
+            self.assertEqual(
+                pagination.get_keyset_rows(queryset, fields, values, limit=2),
+                expected[index + 1:index + 3],
+            )
+            self.assertEqual(
+                pagination.get_keyset_rows(queryset, fields, values, reverse=True),
+                expected[:index][::-1],
+            )
+
+    def test__keyset_filter__index_range(self):
+        fields = ('name', 'project_id')
+        values = ['survey 000005', '0a1b2c3d-0000-0000-0000-000000000000']
+        queryset = (
+            Survey.objects
+                  .filter(pagination.get_keyset_filter(fields, values))
+                  .order_by(*pagination.get_keyset_ordering(fields))[:3]
+        )
+        with connection.cursor() as cursor:
+            # the tables are too small to use the indexes otherwise
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertIn('survey_name_keyset', plan)
+        self.assertIn("Index Cond: (name >= 'survey 000005'::text)", plan)
+
+    def test__surveys_list(self):
+        url = reverse('survey-list')
+
+        # surveys (no count) + session + user
+        with self.assertNumQueries(2 + 2):
+            response = self.client.get(url, {'cursor': '', 'page_size': 3})
+        content = response.json()
+        self.assertIsNone(content['count'])
+        self.assertIsNone(content['previous'])
+        self.assertEqual([s['name'] for s in content['results']], ['survey 000000', 'survey 000001', 'survey 000002'])
+
+        # deep pages do not need more queries
+        with self.assertNumQueries(2 + 2):
+            response = self.client.get(content['next'])
+        content = response.json()
+        self.assertEqual([s['name'] for s in content['results']], ['survey 000003', 'survey 000004', 'survey 000005'])
+        self.assertNotIn('page=', content['next'])
+
+        # and back
+        response = self.client.get(content['previous'])
+        self.assertEqual(
+            [s['name'] for s in response.json()['results']],
+            ['survey 000000', 'survey 000001', 'survey 000002'],
+        )
+        self.assertIsNone(response.json()['previous'])
+
+        # going through all of them (the requested ordering is ignored)
+        results, last = self.get_all(url, {'cursor': '', 'page_size': 4, 'ordering': '-name'})
+        self.assertEqual(
+            [s['name'] for s in results],
+            [f'survey {i:06}' for i in range(10)],
+        )
+        self.assertEqual(len(last['results']), 2)
+
+        # with the search filter
+        results, _ = self.get_all(url, {'cursor': '', 'page_size': 1, 'search': '00000'})
+        self.assertEqual(len(results), 10)
+
+        # the same as the page number pagination
+        response = self.client.get(url, {'page_size': 100})
+        self.assertEqual(response.json()['results'], results)
+
+        response = self.client.get(url, {'cursor': 'wrong'})
+        self.assertEqual(response.status_code, 404)
+
+    def analyze(self):
+        # the planner estimations are based on the tables statistics
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Survey._meta.db_table}')
+            cursor.execute(f'ANALYZE {MtInstance._meta.db_table}')
+
+    def test__estimate_count(self):
+        self.analyze()
+        # 10 surveys + the "other" realm one
+        self.assertEqual(pagination.estimate_count(Survey.objects.order_by('name')), 11)
+
+    def test__surveys_list__count(self):
+        url = reverse('survey-list')
+
+        response = self.client.get(url, {'cursor': '', 'page_size': 3, 'count': 'exact'})
+        self.assertEqual(response.json()['count'], 10)
+
+        # all the rows not the ones after the cursor
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(response.json()['count'], 10)
+
+        self.analyze()
+        response = self.client.get(url, {'cursor': '', 'page_size': 3, 'count': 'estimated'})
+        self.assertEqual(response.status_code, 200)
+        # the realm filter (join) is estimated with the columns statistics
+        self.assertAlmostEqual(response.json()['count'], 10, delta=1)
+
+    def test__masks_list(self):
+        url = reverse('mask-list')
+
+        results, _ = self.get_all(url, {'cursor': '', 'page_size': 7, 'column': 'd1'})
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(['d1' in mask['columns'] for mask in results]))
+
+        results, _ = self.get_all(url, {'cursor': '', 'page_size': 7})
+        self.assertEqual(len(results), 30)
+        self.assertEqual(
+            [mask['id'] for mask in results],
+            list(Mask.objects.exclude(name='other').order_by('survey', 'name').values_list('id', flat=True)),
+        )
@@ -0,0 +1,175 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import io
+
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from requests import Response
+from urllib3.response import HTTPResponse
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from ..proxy import stream_content
+
+
+def upstream_response(status=200, body=b'', headers={}):
+    response = Response()
+    response.status_code = status
+    response.headers.update(headers)
+    response.raw = HTTPResponse(
+        body=io.BytesIO(body),
+        headers=headers,
+        status=status,
+        preload_content=False,
+        decode_content=False,
+    )
+    return response
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class ProxyViewsTests(TestCase):
+
+    def setUp(self):
+        super(ProxyViewsTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        self.user = get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+    def test__stream(self, *args):
+        body = b'[' + b','.join([b'{"a": 1}'] * 10000) + b']'
+        headers = {
+            'Content-Type': 'application/json',
+            'Content-Length': str(len(body)),
+            'ETag': '"123456"',
+            'Connection': 'keep-alive',
+        }
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(200, body, headers)) as mock_req:
+            response = self.client.get(
+                reverse('kernel-proxy-path', kwargs={'path': 'entities.json'}) + '?page=2',
+                HTTP_RANGE='bytes=0-',
+            )
+
+            mock_req.assert_called_once()
+            kwargs = mock_req.call_args[1]
+            self.assertEqual(kwargs['method'], 'GET')
+            self.assertEqual(kwargs['url'], 'http://kernel-test/entities.json?page=2')
+            self.assertTrue(kwargs['stream'])
+            self.assertEqual(kwargs['headers']['Authorization'], 'Token ABCDEFGH')
+            self.assertEqual(kwargs['headers']['Range'], 'bytes=0-')
+            self.assertNotIn('Host', kwargs['headers'])
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], str(len(body)))
+        self.assertEqual(response['ETag'], '"123456"')
+        self.assertFalse(response.has_header('Connection'))
+        self.assertEqual(b''.join(response.streaming_content), body)
+
+    def test__stream__compressed(self, *args):
+        body = gzip.compress(b'{"a": 1}')
+        headers = {
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip',
+            'Content-Length': str(len(body)),
+        }
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(200, body, headers)):
+            response = self.client.get(reverse('kernel-proxy-root'))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(b''.join(response.streaming_content), body)
+
+    def test__stream__partial_content(self, *args):
+        headers = {
+            'Content-Type': 'image/png',
+            'Content-Range': 'bytes 0-3/100',
+            'Accept-Ranges': 'bytes',
+            'Access-Control-Expose-Headers': '*',
+            'Authorization': 'Token secret',
+        }
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(206, b'1234', headers)):
+            response = self.client.get(
+                reverse('kernel-proxy-path', kwargs={'path': 'attachments/1/content'}),
+                HTTP_RANGE='bytes=0-3',
+            )
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-3/100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertFalse(response.has_header('Authorization'))
+        self.assertEqual(b''.join(response.streaming_content), b'1234')
+
+    def test__no_content(self, *args):
+        for status in (204, 304):
+            upstream = upstream_response(status, b'', {'ETag': '"123456"'})
+            with mock.patch('gather.api.upstream.request', return_value=upstream):
+                response = self.client.get(
+                    reverse('odk-proxy-path', kwargs={'path': 'xforms.json'}),
+                    HTTP_IF_NONE_MATCH='"123456"',
+                )
+
+            self.assertFalse(response.streaming)
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(response['ETag'], '"123456"')
+            self.assertTrue(upstream.raw.closed)
+
+    def test__head(self, *args):
+        upstream = upstream_response(200, b'', {'Content-Length': '1000'})
+        with mock.patch('gather.api.upstream.request', return_value=upstream):
+            response = self.client.head(reverse('kernel-proxy-root'))
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Length'], '1000')
+
+    @override_settings(PROXY_STREAMING=False)
+    def test__no_streaming(self, *args):
+        upstream = upstream_response(200, b'{}', {'Content-Length': '2'})
+        with mock.patch('gather.api.upstream.request', return_value=upstream) as mock_req:
+            response = self.client.post(reverse('kernel-proxy-root'), data={'a': 1})
+            mock_req.assert_called_once()
+            self.assertEqual(mock_req.call_args[1]['app_name'], 'aether-kernel')
+            self.assertEqual(mock_req.call_args[1]['method'], 'POST')
+
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '2')
+        self.assertEqual(response.content, b'{}')
+        self.assertTrue(upstream.raw.closed)
+
+    def test__stream_content__closed(self, *args):
+        upstream = upstream_response(200, b'a' * 100)
+        content = stream_content(upstream, 10)
+
+        self.assertEqual(next(content), b'a' * 10)
+        # the client goes away
+        content.close()
+        self.assertTrue(upstream.raw.closed)
@@ -0,0 +1,70 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from django.apps import apps
+from django.test import TestCase, override_settings
+
+from prometheus_client import REGISTRY
+
+from .. import querycache
+from ..models import Survey, Mask
+
+
+def get_count(model, result):
+    labels = {'cache': f'orm:{model._meta.label_lower}', 'result': result}
+    return REGISTRY.get_sample_value('gather_cache_requests_total', labels) or 0
+
+
+class QueryCacheTests(TestCase):
+
+    def test__invalidate(self):
+        with mock.patch('cacheops.invalidate_model') as mock_invalidate:
+            with override_settings(DJANGO_USE_CACHE=False, CACHEOPS_ENABLED=True):
+                querycache.invalidate(Survey)
+            with override_settings(DJANGO_USE_CACHE=True, CACHEOPS_ENABLED=False):
+                querycache.invalidate(Survey)
+            mock_invalidate.assert_not_called()
+
+            with override_settings(DJANGO_USE_CACHE=True, CACHEOPS_ENABLED=True):
+                querycache.invalidate(Survey, Mask)
+                self.assertEqual(mock_invalidate.call_args_list, [mock.call(Survey), mock.call(Mask)])
+
+                # REDIS is down
+                mock_invalidate.side_effect = ConnectionError
+                querycache.invalidate(Survey)
+
+    def test__invalidate_on_migrate(self):
+        with mock.patch('gather.api.querycache.invalidate') as mock_invalidate:
+            querycache.invalidate_on_migrate(sender=apps.get_app_config('auth'))
+            mock_invalidate.assert_not_called()
+
+            querycache.invalidate_on_migrate(sender=apps.get_app_config('gather'))
+            mock_invalidate.assert_called_once_with(Survey, Mask)
+
+    def test__count_read(self):
+        hits = get_count(Survey, 'hit')
+        misses = get_count(Survey, 'miss')
+
+        querycache.count_read(sender=Survey, func=None, hit=True)
+        querycache.count_read(sender=Survey, func=None, hit=False)
+        querycache.count_read(sender=None, func=len, hit=True)  # cached functions
+
+        self.assertEqual(get_count(Survey, 'hit'), hits + 1)
+        self.assertEqual(get_count(Survey, 'miss'), misses + 1)
@@ -0,0 +1,236 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import io
+import uuid
+
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+
+from aether.sdk.auth.apptoken.models import AppToken
+from aether.sdk.multitenancy.models import MtInstance
+
+from .. import reconcile, upstream
+from ..models import Survey, Mask
+from .test_kernel import stub_kernel
+
+
+def create_survey(name, realm=None, project_id=None):
+    survey = Survey.objects.create(project_id=project_id or uuid.uuid4(), name=name)
+    MtInstance.objects.create(instance=survey, realm=realm or settings.DEFAULT_REALM)
+    return survey
+
+
+class ReconcileTests(TestCase):
+
+    def setUp(self):
+        super(ReconcileTests, self).setUp()
+        upstream.close_sessions()
+
+        self.unchanged = create_survey('unchanged')
+        self.renamed = create_survey('old name')
+        self.deleted = create_survey('deleted')
+        Mask.objects.create(survey=self.deleted, name='mask', columns=['a'])
+        self.other = create_survey('other', realm='other')
+
+        self.new_id = str(uuid.uuid4())
+        self.projects = [
+            {'id': str(self.unchanged.pk), 'name': 'unchanged', 'modified': '2020-01-01T00:00:00Z'},
+            {'id': str(self.renamed.pk), 'name': 'new name', 'modified': '2020-03-01T00:00:00Z'},
+            {'id': self.new_id, 'name': 'new', 'modified': '2020-03-01T00:00:00Z'},
+            {'id': str(self.other.pk), 'name': 'other realm', 'modified': '2020-03-01T00:00:00Z'},
+        ]
+
+    def tearDown(self):
+        upstream.close_sessions()
+        super(ReconcileTests, self).tearDown()
+
+    def projects_route(self, handler, body):
+        page = int(handler.path.split('page=')[1].split('&')[0])
+        return 200, {}, {
+            'count': len(self.projects),
+            'next': 'next' if page * 2 < len(self.projects) else None,
+            'results': self.projects[(page - 1) * 2:page * 2],
+        }
+
+    def reconcile(self, routes=None, **kwargs):
+        server, kernel_settings = stub_kernel({'/kernel/projects.json': self.projects_route, **(routes or {})})
+        with server, kernel_settings:
+            stats = reconcile.reconcile(realm=settings.DEFAULT_REALM, **kwargs)
+        return stats, server
+
+    def test__reconcile(self):
+        stats, server = self.reconcile(delete=True)
+        self.assertEqual(stats, {'created': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1, 'skipped': 1})
+
+        self.assertEqual(Survey.objects.get(pk=self.renamed.pk).name, 'new name')
+        new = Survey.objects.get(pk=self.new_id)
+        self.assertEqual(new.name, 'new')
+        self.assertEqual(new.get_realm(), settings.DEFAULT_REALM)
+        self.assertFalse(Survey.objects.filter(pk=self.deleted.pk).exists())
+        self.assertFalse(Mask.objects.exists())
+        self.assertEqual(Survey.objects.get(pk=self.other.pk).name, 'other')
+
+        for _, path, _, headers in server.requests[:-1]:
+            self.assertIn('fields=id%2Cname%2Cmodified', path)
+            self.assertEqual(headers['Authorization'], 'Token kernel')
+            self.assertEqual(headers[settings.REALM_COOKIE], settings.DEFAULT_REALM)
+
+        # the deleted survey was checked again with kernel
+        _, path, _, headers = server.requests[-1]
+        self.assertTrue(path.startswith(f'/kernel/projects/{self.deleted.pk}.json'))
+        self.assertEqual(headers[settings.REALM_COOKIE], settings.DEFAULT_REALM)
+
+        # nothing else to do
+        stats, _ = self.reconcile(delete=True)
+        self.assertEqual(stats, {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 3, 'skipped': 1})
+
+    def test__reconcile__no_delete_by_default(self):
+        stats, server = self.reconcile()
+        self.assertEqual(stats['deleted'], 0)
+        self.assertTrue(Survey.objects.filter(pk=self.deleted.pk).exists())
+        paths = [path.split('?')[0] for _, path, _, _ in server.requests]
+        self.assertNotIn(f'/kernel/projects/{self.deleted.pk}.json', paths)
+
+    def test__reconcile__incomplete_listing(self):
+        def projects_route(handler, body):
+            status, headers, content = self.projects_route(handler, body)
+            # kernel counts one more project than listed
+            return status, headers, {**content, 'count': len(self.projects) + 1}
+
+        stats, server = self.reconcile(routes={'/kernel/projects.json': projects_route}, delete=True)
+        self.assertEqual(stats['deleted'], 0)
+        self.assertEqual(stats['created'], 1)
+        self.assertTrue(Survey.objects.filter(pk=self.deleted.pk).exists())
+        # no project is checked
+        paths = [path.split('?')[0] for _, path, _, _ in server.requests]
+        self.assertEqual(set(paths), {'/kernel/projects.json'})
+
+    def test__reconcile__found_on_check(self):
+        # not listed but the project still exists
+        found = {f'/kernel/projects/{self.deleted.pk}.json': (200, {}, {'id': str(self.deleted.pk)})}
+        stats, _ = self.reconcile(routes=found, delete=True)
+        self.assertEqual(stats['deleted'], 0)
+        self.assertTrue(Survey.objects.filter(pk=self.deleted.pk).exists())
+
+    def test__reconcile__check_error(self):
+        forbidden = {f'/kernel/projects/{self.deleted.pk}.json': (403, {}, {'detail': 'Forbidden'})}
+        with self.assertRaises(reconcile.HTTPError):
+            self.reconcile(routes=forbidden, delete=True)
+        self.assertTrue(Survey.objects.filter(pk=self.deleted.pk).exists())
+
+    def test__reconcile__since(self):
+        self.projects[1]['modified'] = '2019-01-01T00:00:00Z'  # renamed but not modified since
+
+        stats, _ = self.reconcile(since=parse_datetime('2020-02-01T00:00:00Z'), delete=True)
+        self.assertEqual(stats, {'created': 1, 'updated': 0, 'deleted': 1, 'unchanged': 0, 'skipped': 1})
+        self.assertEqual(Survey.objects.get(pk=self.renamed.pk).name, 'old name')
+
+    def test__reconcile__invalidate(self):
+        with mock.patch('django.db.transaction.on_commit', side_effect=lambda func: func()), \
+                mock.patch('gather.api.querycache.invalidate') as mock_invalidate:
+            self.reconcile(delete=False)
+        mock_invalidate.assert_called_with(Survey, MtInstance)
+
+    def test__reconcile__dry_run(self):
+        stats, _ = self.reconcile(dry_run=True, delete=False)
+        self.assertEqual(stats, {'created': 1, 'updated': 1, 'deleted': 0, 'unchanged': 1, 'skipped': 1})
+        self.assertEqual(Survey.objects.count(), 4)
+        self.assertEqual(Survey.objects.get(pk=self.renamed.pk).name, 'old name')
+
+    def test__get_realms(self):
+        self.assertEqual(reconcile.get_realms(), sorted([settings.DEFAULT_REALM, 'other']))
+
+    def test__command(self):
+        output = io.StringIO()
+        server, kernel_settings = stub_kernel({'/kernel/projects.json': self.projects_route})
+        with server, kernel_settings:
+            call_command('reconcile_surveys', '--realm=other', '--since=2020-02-01', '--delete', stdout=output)
+
+        self.assertIn('Realm "other"', output.getvalue())
+        self.assertIn('Next --since: ', output.getvalue())
+        # the other realm surveys are the kernel ones
+        self.assertEqual(Survey.objects.filter(mt__realm='other').count(), 2)
+        self.assertEqual(Survey.objects.get(pk=self.other.pk).name, 'other realm')
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_surveys', '--since=yesterday', stdout=output)
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class ReconcileViewTests(TestCase):
+
+    def setUp(self):
+        super(ReconcileViewTests, self).setUp()
+        upstream.close_sessions()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        self.user = get_user_model().objects.create_user(username, email, password, is_staff=True)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        self.survey = create_survey('survey')
+
+    def tearDown(self):
+        upstream.close_sessions()
+        super(ReconcileViewTests, self).tearDown()
+
+    def test__reconcile(self, *args):
+        projects = {'count': 1, 'next': None, 'results': [{'id': str(self.survey.pk), 'name': 'renamed'}]}
+        server, kernel_settings = stub_kernel({'/kernel/projects.json': (200, {}, projects)})
+        with server, kernel_settings:
+            response = self.client.post(reverse('survey-reconcile'), {'dry_run': True},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['updated'], 1)
+            self.assertEqual(Survey.objects.get().name, 'survey')
+
+            response = self.client.post(reverse('survey-reconcile'))
+            self.assertEqual(response.json()['updated'], 1)
+            self.assertEqual(Survey.objects.get().name, 'renamed')
+
+        # on behalf of the user
+        self.assertEqual(server.requests[0][3]['Authorization'], 'Token ABCDEFGH')
+
+        response = self.client.post(reverse('survey-reconcile'), {'since': 'yesterday'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test__reconcile__not_admin(self, *args):
+        self.user.is_staff = False
+        self.user.save()
+
+        response = self.client.post(reverse('survey-reconcile'))
+        self.assertEqual(response.status_code, 403)
+
+    def test__reconcile__kernel_error(self, *args):
+        server, kernel_settings = stub_kernel({'/kernel/projects.json': (403, {}, {'detail': 'Forbidden'})})
+        with server, kernel_settings:
+            response = self.client.post(reverse('survey-reconcile'))
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Survey.objects.exists())
@@ -0,0 +1,131 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from aether.sdk.multitenancy.models import MtInstance
+
+from rest_framework.filters import OrderingFilter
+
+from .. import search
+from ..filters import ColumnsFilter, TrigramSearchFilter
+from ..models import Survey, Mask
+from ..views import MaskViewSet, SurveyViewSet
+
+MASK_FIELDS = ('survey__name', 'name', 'columns')
+
+
+class SearchTests(TestCase):
+
+    def setUp(self):
+        super(SearchTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        for name, masks in (('Households', ['census', 'water']), ('Health facilities', ['staff']), ('Other', [])):
+            survey = Survey.objects.create(name=name)
+            MtInstance.objects.create(instance=survey, realm=settings.DEFAULT_REALM)
+            for mask in masks:
+                Mask.objects.create(survey=survey, name=mask, columns=['a.b', f'{mask}.total'])
+
+    def test__search(self):
+        def names(model, fields, terms):
+            return sorted(search.search(model.objects.all(), fields, terms).values_list('name', flat=True))
+
+        self.assertEqual(names(Survey, ('name',), ['HOLD']), ['Households'])
+        self.assertEqual(names(Survey, ('name',), ['h', 'facil']), ['Health facilities'])
+        self.assertEqual(names(Survey, ('name',), ['nothing']), [])
+
+        self.assertEqual(names(Mask, MASK_FIELDS, ['house']), ['census', 'water'])  # survey name
+        self.assertEqual(names(Mask, MASK_FIELDS, ['STAF']), ['staff'])  # mask name
+        self.assertEqual(names(Mask, MASK_FIELDS, ['water.total']), ['water'])
+        self.assertEqual(names(Mask, MASK_FIELDS, ['a.b']), ['census', 'staff', 'water'])
+        self.assertEqual(names(Mask, MASK_FIELDS, ['SUS.TO']), ['census'])  # column substring
+        self.assertEqual(names(Mask, MASK_FIELDS, ['a.']), ['census', 'staff', 'water'])
+
+    def test__get_similarity_ordering(self):
+        self.assertEqual(search.get_similarity_ordering(Mask, MASK_FIELDS, []), [])
+        self.assertEqual(search.get_similarity_ordering(Mask, ('columns',), ['house']), [])
+
+        [ordering] = search.get_similarity_ordering(Mask, MASK_FIELDS, ['household'])
+        self.assertTrue(ordering.descending)
+        self.assertTrue(ordering.nulls_last)
+
+        # the survey name similarity is a subquery, no join with the surveys
+        queryset = Mask.objects.order_by(ordering, 'name')
+        self.assertNotIn('JOIN', str(queryset.query))
+        self.assertEqual(list(queryset.values_list('name', flat=True)), ['census', 'water', 'staff'])
+
+    def test__filter_backends(self):
+        # the defaults without the "SearchFilter"
+        self.assertEqual(SurveyViewSet.filter_backends, [OrderingFilter, TrigramSearchFilter])
+        self.assertEqual(MaskViewSet.filter_backends, [OrderingFilter, TrigramSearchFilter, ColumnsFilter])
+
+    def test__views(self):
+        # similarity('h', 'Households') = 1/12 > similarity('h', 'Health facilities') = 1/19 > 0
+        response = self.client.get(reverse('survey-list'), {'search': 'h'})
+        self.assertEqual(
+            [survey['name'] for survey in response.json()['results']],
+            ['Households', 'Health facilities', 'Other'],  # "Other" includes "h" too
+        )
+
+        # unless other ordering is requested
+        response = self.client.get(reverse('survey-list'), {'search': 'h', 'ordering': '-name'})
+        self.assertEqual(
+            [survey['name'] for survey in response.json()['results']],
+            ['Other', 'Households', 'Health facilities'],
+        )
+
+        response = self.client.get(reverse('mask-list'), {'search': 'households a.b'})
+        self.assertEqual(sorted([mask['name'] for mask in response.json()['results']]), ['census', 'water'])
+
+        # the columns substrings
+        response = self.client.get(reverse('mask-list'), {'search': '.total'})
+        self.assertEqual(
+            [mask['name'] for mask in response.json()['results']],
+            # no similarity, by survey and name
+            list(Mask.objects.order_by('survey', 'name').values_list('name', flat=True)),
+        )
+
+    def test__admin(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'adminadmin')
+        self.assertTrue(self.client.login(username='admin', password='adminadmin'))
+        url = reverse('admin:gather_survey_changelist')
+
+        response = self.client.get(url, {'q': 'hold'})
+        self.assertEqual([survey.name for survey in response.context['cl'].result_list], ['Households'])
+
+        response = self.client.get(url, {'q': 'h'})
+        self.assertEqual(
+            [survey.name for survey in response.context['cl'].result_list],
+            ['Households', 'Health facilities', 'Other'],
+        )
+
+        # the mask columns substrings, like the API
+        url = reverse('admin:gather_mask_changelist')
+        response = self.client.get(url, {'q': 'sus.to'})
+        self.assertEqual([mask.name for mask in response.context['cl'].result_list], ['census'])
+        response = self.client.get(url, {'q': 'a.'})
+        self.assertEqual(len(response.context['cl'].result_list), 3)
@@ -0,0 +1,188 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from django.contrib.auth import get_user_model, logout
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from .. import tokens
+from .test_cache import BrokenRedis
+from .test_proxy import upstream_response
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def setex(self, key, timeout, value):
+        self.data[key] = value.encode('utf-8')
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class TokensTests(TestCase):
+
+    def setUp(self):
+        super(TokensTests, self).setUp()
+        tokens.clear()
+        self.user = get_user_model().objects.create_user('test', 'test@example.com', 'testtest')
+
+    def tearDown(self):
+        tokens.clear()
+        super(TokensTests, self).tearDown()
+
+    @mock.patch('aether.sdk.auth.apptoken.models.AppToken.get_or_create_token')
+    def test__get_or_create_token(self, mock_token):
+        mock_token.return_value = AppToken(token='ABCDEFGH')
+
+        for _ in range(3):
+            app_token = tokens.get_or_create_token(self.user, 'aether-kernel')
+            self.assertEqual(app_token.token, 'ABCDEFGH')
+        mock_token.assert_called_once_with(self.user, 'aether-kernel')
+
+        # by app
+        tokens.get_or_create_token(self.user, 'aether-odk')
+        self.assertEqual(mock_token.call_count, 2)
+
+        # the invalid tokens are not cached
+        mock_token.return_value = None
+        tokens.invalidate(self.user.pk, 'aether-kernel')
+        self.assertIsNone(tokens.get_or_create_token(self.user, 'aether-kernel'))
+        self.assertIsNone(tokens.get_or_create_token(self.user, 'aether-kernel'))
+        self.assertEqual(mock_token.call_count, 4)
+        # the rest are still there
+        self.assertEqual(tokens.get_or_create_token(self.user, 'aether-odk').token, 'ABCDEFGH')
+        self.assertEqual(mock_token.call_count, 4)
+
+        # unknown apps
+        self.assertIsNone(tokens.get_or_create_token(self.user, 'unknown'))
+
+        with override_settings(APP_TOKEN_CACHE_TTL=0):
+            mock_token.return_value = AppToken(token='ABCDEFGH')
+            tokens.get_or_create_token(self.user, 'aether-kernel')
+            tokens.get_or_create_token(self.user, 'aether-kernel')
+            self.assertEqual(mock_token.call_count, 7)
+
+    @mock.patch('aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+                return_value=AppToken(token='ABCDEFGH'))
+    def test__invalidate(self, mock_token):
+        tokens.get_or_create_token(self.user, 'aether-kernel')
+        tokens.get_or_create_token(self.user, 'aether-odk')
+        self.assertEqual(mock_token.call_count, 2)
+
+        # logout
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        request.user = self.user
+        logout(request)
+
+        tokens.get_or_create_token(self.user, 'aether-kernel')
+        tokens.get_or_create_token(self.user, 'aether-odk')
+        self.assertEqual(mock_token.call_count, 4)
+
+        # new token
+        AppToken.objects.create(user=self.user, app='aether-kernel', token='12345678')
+        tokens.get_or_create_token(self.user, 'aether-kernel')
+        tokens.get_or_create_token(self.user, 'aether-odk')
+        self.assertEqual(mock_token.call_count, 5)
+
+    @override_settings(APP_TOKEN_CACHE_REDIS=True)
+    @mock.patch('aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+                return_value=AppToken(token='ABCDEFGH'))
+    def test__redis(self, mock_token):
+        redis = FakeRedis()
+        with mock.patch('gather.api.tokens.get_redis_client', return_value=redis):
+            tokens.get_or_create_token(self.user, 'aether-kernel')
+            self.assertEqual(redis.data, {f'gather:apptoken:{self.user.pk}:aether-kernel': b'ABCDEFGH'})
+
+            # other process
+            tokens.clear()
+            self.assertEqual(tokens.get_or_create_token(self.user, 'aether-kernel').token, 'ABCDEFGH')
+            self.assertEqual(mock_token.call_count, 1)
+
+            tokens.invalidate(self.user.pk)
+            self.assertEqual(redis.data, {})
+
+        with mock.patch('gather.api.tokens.get_redis_client', return_value=BrokenRedis()):
+            self.assertEqual(tokens.get_or_create_token(self.user, 'aether-kernel').token, 'ABCDEFGH')
+            self.assertEqual(tokens.get_or_create_token(self.user, 'aether-kernel').token, 'ABCDEFGH')
+            self.assertEqual(mock_token.call_count, 2)
+
+
+@mock.patch('aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+            return_value=AppToken(token='ABCDEFGH'))
+class TokensViewsTests(TestCase):
+
+    def setUp(self):
+        super(TokensViewsTests, self).setUp()
+        tokens.clear()
+        self.user = get_user_model().objects.create_user('test', 'test@example.com', 'testtest')
+        self.assertTrue(self.client.login(username='test', password='testtest'))
+
+    def tearDown(self):
+        tokens.clear()
+        super(TokensViewsTests, self).tearDown()
+
+    def test__app_token_required(self, mock_token):
+        view = tokens.app_token_required(lambda request: HttpResponse('ok'))
+        request = RequestFactory().get('/surveys/list/')
+        request.user = self.user
+
+        self.assertEqual(view(request).status_code, 200)
+        self.assertEqual(view(request).status_code, 200)
+        # one per external app
+        self.assertEqual(mock_token.call_count, 2)
+
+        tokens.clear()
+        mock_token.return_value = None
+        response = view(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('check-user-tokens', response.url)
+
+        request.user = AnonymousUser()
+        response = view(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('login', response.url)
+
+    def test__proxy(self, mock_token):
+        url = reverse('kernel-proxy-path', kwargs={'path': 'projects.json'})
+        with mock.patch('gather.api.upstream.request',
+                        side_effect=lambda *args, **kwargs: upstream_response(200, b'{}')) as mock_req:
+            for _ in range(3):
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(mock_req.call_args[1]['headers']['Authorization'], 'Token ABCDEFGH')
+            self.assertEqual(mock_token.call_count, 2)
+
+            # the app rejects the token
+            mock_req.side_effect = lambda *args, **kwargs: upstream_response(401, b'{}')
+            self.assertEqual(self.client.get(url).status_code, 401)
+            self.assertEqual(mock_token.call_count, 2)
+            self.assertEqual(self.client.get(url).status_code, 401)
+            self.assertEqual(mock_token.call_count, 3)
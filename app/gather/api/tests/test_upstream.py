@@ -0,0 +1,196 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+from time import sleep, time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from requests.exceptions import RequestException
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from . import StubServer
+from .. import upstream
+
+
+class UpstreamTests(TestCase):
+
+    def setUp(self):
+        super(UpstreamTests, self).setUp()
+        upstream.close_sessions()
+
+    def tearDown(self):
+        upstream.close_sessions()
+        super(UpstreamTests, self).tearDown()
+
+    def test__get_session(self):
+        session = upstream.get_session('aether-kernel')
+        self.assertEqual(session, upstream.get_session('aether-kernel'))
+        self.assertNotEqual(session, upstream.get_session('aether-odk'))
+
+        upstream.close_sessions()
+        self.assertNotEqual(session, upstream.get_session('aether-kernel'))
+
+    def test__request__keep_alive(self):
+        routes = {'/projects.json': (200, {'Set-Cookie': 'sessionid=123; Path=/'}, {'count': 0})}
+        with StubServer(routes) as server:
+            for _ in range(5):
+                response = upstream.request('aether-kernel', 'get', f'{server.url}/projects.json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {'count': 0})
+
+        self.assertEqual(len(server.requests), 5)
+        # all the calls reuse the same connection
+        self.assertEqual(len(set([address for _, _, address, _ in server.requests])), 1)
+        # and do not share cookies
+        self.assertFalse(any(['Cookie' in headers for _, _, _, headers in server.requests]))
+
+    @override_settings(UPSTREAM_POOL_SIZE=2)
+    def test__request__bounded_pool(self):
+        def slow(*args):
+            sleep(0.1)
+            return 200, {}, {'count': 0}
+
+        def call():
+            upstream.request('aether-kernel', 'get', f'{server.url}/projects.json')
+
+        with StubServer({'/projects.json': slow}) as server:
+            threads = [threading.Thread(target=call) for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(server.requests), 6)
+        # the calls waited for the pooled connections instead of opening new ones
+        self.assertLessEqual(len(set([address for _, _, address, _ in server.requests])), 2)
+
+    @override_settings(UPSTREAM_POOL_SIZE=1, UPSTREAM_POOL_TIMEOUT=0.2)
+    def test__request__pool_timeout(self):
+        with StubServer({'/projects.json': (200, {}, {'count': 0})}) as server:
+            url = f'{server.url}/projects.json'
+            # the streamed response keeps the only connection in use
+            response = upstream.request('aether-kernel', 'get', url, stream=True)
+
+            start = time()
+            with self.assertRaises(upstream.PoolTimeout):
+                upstream.request('aether-kernel', 'get', url)
+            self.assertLess(time() - start, 2)
+
+            # once released the connection is available again
+            response.close()
+            response = upstream.request('aether-kernel', 'get', url)
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(UPSTREAM_RETRIES_BACKOFF=0)
+    def test__request__retries(self):
+        statuses = [503, 502, 200]
+        routes = {'/projects.json': lambda *args: (statuses.pop(0), {}, {})}
+        with StubServer(routes) as server:
+            response = upstream.request('aether-kernel', 'get', f'{server.url}/projects.json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(server.requests), 3)
+
+            # not idempotent calls are not retried
+            statuses = [503, 200]
+            response = upstream.request('aether-kernel', 'post', f'{server.url}/projects.json')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(len(server.requests), 4)
+
+    @override_settings(UPSTREAM_RETRIES=0, UPSTREAM_READ_TIMEOUT=0.1)
+    def test__request__timeout(self):
+        def slow(*args):
+            sleep(0.5)
+            return 200, {}, {}
+
+        with StubServer({'/slow': slow}) as server:
+            with self.assertRaises(RequestException):
+                upstream.request('aether-kernel', 'get', f'{server.url}/slow')
+
+            # the default timeout can be replaced
+            response = upstream.request('aether-kernel', 'get', f'{server.url}/slow', timeout=2)
+            self.assertEqual(response.status_code, 200)
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class UpstreamProxyTests(TestCase):
+
+    def setUp(self):
+        super(UpstreamProxyTests, self).setUp()
+        upstream.close_sessions()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+    def tearDown(self):
+        upstream.close_sessions()
+        super(UpstreamProxyTests, self).tearDown()
+
+    def test__proxy(self, *args):
+        routes = {'/kernel/projects.json': (200, {}, {'count': 1})}
+        with StubServer(routes) as server:
+            external_apps = {
+                'aether-kernel': {'test': {'url': f'{server.url}/kernel', 'token': 'kernel'}},
+                'aether-odk': {'test': {'url': f'{server.url}/odk', 'token': 'odk'}},
+            }
+            with override_settings(EXTERNAL_APPS=external_apps):
+                for _ in range(3):
+                    response = self.client.get(reverse('kernel-proxy-path', kwargs={'path': 'projects.json'}))
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(b''.join(response.streaming_content), b'{"count": 1}')
+
+                response = self.client.get(reverse('odk-proxy-path', kwargs={'path': 'xforms.json'}))
+                self.assertEqual(response.status_code, 404)
+
+        self.assertEqual(len(server.requests), 4)
+        for method, path, _, headers in server.requests:
+            self.assertEqual(method, 'GET')
+            self.assertEqual(headers['Authorization'], 'Token ABCDEFGH')
+
+        # one connection per app
+        self.assertEqual(len(set([address for _, _, address, _ in server.requests])), 2)
+
+    @override_settings(UPSTREAM_POOL_SIZE=1, UPSTREAM_POOL_TIMEOUT=0.2)
+    def test__proxy__pool_timeout(self, *args):
+        routes = {'/kernel/projects.json': (200, {}, {'count': 1})}
+        with StubServer(routes) as server:
+            external_apps = {'aether-kernel': {'test': {'url': f'{server.url}/kernel', 'token': 'kernel'}}}
+            with override_settings(EXTERNAL_APPS=external_apps):
+                url = reverse('kernel-proxy-path', kwargs={'path': 'projects.json'})
+                # the streamed response is not consumed yet and keeps the only connection in use
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+                start = time()
+                response = self.client.get(url)
+                self.assertLess(time() - start, 2)
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.content, b'Service Unavailable')
+
+        self.assertEqual(len(server.requests), 1)
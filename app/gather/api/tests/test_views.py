@@ -0,0 +1,294 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import uuid
+
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from rest_framework.renderers import JSONRenderer
+
+from aether.sdk.auth.apptoken.models import AppToken
+from aether.sdk.multitenancy.models import MtInstance
+from aether.sdk.unittest import MockResponse
+
+from ..models import Survey, Mask
+from ..serializers import (
+    MASK_VALUES,
+    SURVEY_VALUES,
+    MaskSerializer,
+    SurveySerializer,
+    masks_to_representation,
+    surveys_to_representation,
+)
+from ..views import MaskViewSet, ValuesViewSetMixin
+from .test_proxy import upstream_response
+
+
+def create_surveys(surveys, masks):
+    for i in range(surveys):
+        survey = Survey.objects.create(name=f'survey {i:06}')
+        MtInstance.objects.create(instance=survey, realm=settings.DEFAULT_REALM)
+        Mask.objects.bulk_create([
+            Mask(survey=survey, name=f'mask {j}', columns=['a', 'b.c', f'd{j}'])
+            for j in range(masks)
+        ])
+
+    # other realm
+    survey = Survey.objects.create(name='other')
+    MtInstance.objects.create(instance=survey, realm='other')
+    Mask.objects.create(survey=survey, name='other', columns=['a'])
+
+
+def render(data):
+    return json.loads(JSONRenderer().render(data))
+
+
+class ViewsTests(TestCase):
+
+    def setUp(self):
+        super(ViewsTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        create_surveys(surveys=10, masks=3)
+        self.context = {'request': RequestFactory().get('/')}
+
+    def test__representation(self):
+        surveys = Survey.objects.order_by('name')
+        self.assertEqual(
+            render(surveys_to_representation(surveys.values(*SURVEY_VALUES))),
+            render(SurveySerializer(surveys, many=True, context=self.context).data),
+        )
+
+        masks = Mask.objects.order_by('survey', 'name')
+        self.assertEqual(
+            render(masks_to_representation(masks.values(*MASK_VALUES))),
+            render(MaskSerializer(masks, many=True, context=self.context).data),
+        )
+
+    def test__values_to_representation(self):
+        # the default one goes through the serializer
+        view = MaskViewSet(request=self.context['request'], format_kwarg=None, action='list')
+        rows = Mask.objects.order_by('survey', 'name').values(*MASK_VALUES)
+        self.assertEqual(
+            render(ValuesViewSetMixin.values_to_representation(view, rows)),
+            render(masks_to_representation(rows)),
+        )
+
+    def test__surveys_list(self):
+        url = reverse('survey-list')
+
+        # count + surveys + masks (the number of surveys does not matter)
+        with self.assertNumQueries(3 + 2):  # + session + user
+            response = self.client.get(url, {'page_size': 100})
+        self.assertEqual(response.status_code, 200)
+
+        content = response.json()
+        self.assertEqual(content['count'], 10)
+        self.assertEqual(
+            content['results'],
+            render(SurveySerializer(
+                Survey.objects.exclude(name='other').order_by('name'),
+                many=True,
+                context=self.context,
+            ).data),
+        )
+
+        response = self.client.get(url, {'search': '000001'})
+        self.assertEqual(response.json()['count'], 1)
+
+    def test__surveys_retrieve(self):
+        survey = Survey.objects.get(name='survey 000001')
+        url = reverse('survey-detail', kwargs={'pk': survey.pk})
+
+        # survey with realm + masks
+        with self.assertNumQueries(2 + 2):  # + session + user
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), render(SurveySerializer(survey, context=self.context).data))
+
+        other = Survey.objects.get(name='other')
+        response = self.client.get(reverse('survey-detail', kwargs={'pk': other.pk}))
+        self.assertEqual(response.status_code, 404)
+
+    def test__surveys_update(self):
+        survey = Survey.objects.get(name='survey 000001')
+        response = self.client.patch(
+            reverse('survey-detail', kwargs={'pk': survey.pk}),
+            data={'name': 'renamed'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'renamed')
+        self.assertEqual(len(response.json()['masks']), 3)
+
+    def test__masks_list(self):
+        url = reverse('mask-list')
+
+        with self.assertNumQueries(2 + 2):  # count + masks + session + user
+            response = self.client.get(url, {'page_size': 100})
+        self.assertEqual(response.status_code, 200)
+
+        content = response.json()
+        self.assertEqual(content['count'], 30)
+        self.assertEqual(
+            content['results'],
+            render(MaskSerializer(
+                Mask.objects.exclude(name='other').order_by('survey', 'name'),
+                many=True,
+                context=self.context,
+            ).data),
+        )
+
+    def test__masks_retrieve(self):
+        mask = Mask.objects.exclude(name='other').first()
+        url = reverse('mask-detail', kwargs={'pk': mask.pk})
+
+        with self.assertNumQueries(1 + 2):  # mask with survey realm + session + user
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), render(MaskSerializer(mask, context=self.context).data))
+
+    def test__dynamic_fields(self):
+        surveys = Survey.objects.exclude(name='other').order_by('name')
+        survey = surveys.first()
+        masks = Mask.objects.exclude(name='other').order_by('survey', 'name')
+
+        for params in ({'fields': 'name,masks'}, {'omit': 'masks'}, {'fields': 'project_id,name', 'omit': 'name'}):
+            kwargs = {key: value.split(',') for key, value in params.items()}
+
+            response = self.client.get(reverse('survey-list'), {**params, 'page_size': 100})
+            self.assertEqual(
+                response.json()['results'],
+                render(SurveySerializer(surveys, many=True, context=self.context, **kwargs).data),
+            )
+
+            response = self.client.get(reverse('survey-detail', kwargs={'pk': survey.pk}), params)
+            self.assertEqual(response.json(), render(SurveySerializer(survey, context=self.context, **kwargs).data))
+
+        for params in ({'fields': 'id,columns'}, {'omit': 'survey,columns'}):
+            kwargs = {key: value.split(',') for key, value in params.items()}
+
+            response = self.client.get(reverse('mask-list'), {**params, 'page_size': 100})
+            self.assertEqual(
+                response.json()['results'],
+                render(MaskSerializer(masks, many=True, context=self.context, **kwargs).data),
+            )
+
+    def test__masks_columns_filters(self):
+        url = reverse('mask-list')
+
+        def count(params):
+            return self.client.get(url, params).json()['count']
+
+        self.assertEqual(count({'column': 'b.c'}), 30)
+        self.assertEqual(count({'column': 'd1'}), 10)
+        self.assertEqual(count({'column': 'b'}), 0)  # not partial matches
+        self.assertEqual(count({'columns_any': 'd0,d1'}), 20)
+        self.assertEqual(count({'columns_any': ['d0', 'd1', 'z']}), 20)
+        self.assertEqual(count({'columns_all': 'a,d1'}), 10)
+        self.assertEqual(count({'columns_all': 'd0,d1'}), 0)
+        self.assertEqual(count({'columns_any': 'd0,d1', 'column': 'd2'}), 0)
+        self.assertEqual(count({'column': ''}), 30)
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class OverviewViewsTests(TestCase):
+
+    def setUp(self):
+        super(OverviewViewsTests, self).setUp()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+        create_surveys(surveys=2, masks=2)
+        self.survey = Survey.objects.get(name='survey 000000')
+        self.other = Survey.objects.get(name='other')
+
+    def test__overview(self, *args):
+        stats = {
+            'count': 30,
+            'next': 'http://kernel-test/projects-stats.json?active=true&page=3',
+            'previous': 'http://kernel-test/projects-stats.json?active=true',
+            'results': [
+                {'id': str(self.survey.pk), 'name': 'survey 000000', 'entities_count': 10},
+                {'id': str(self.other.pk), 'name': 'other', 'entities_count': 1},  # other realm
+                {'id': str(uuid.uuid4()), 'name': 'kernel', 'entities_count': 0},
+            ],
+        }
+        with mock.patch('gather.api.upstream.request', return_value=MockResponse(200, stats)) as mock_req:
+            response = self.client.get(reverse('survey-overview'), {'active': 'true', 'page': 2})
+            self.assertEqual(mock_req.call_args[1]['params'], {'active': 'true', 'page': '2'})
+
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual(content['count'], 30)
+        self.assertEqual(content['next'], 'http://testserver/api/gather/surveys/overview/?active=true&page=3')
+        self.assertEqual(content['previous'], 'http://testserver/api/gather/surveys/overview/?active=true')
+
+        results = content['results']
+        self.assertEqual(results[0]['entities_count'], 10)
+        self.assertEqual(sorted([mask['name'] for mask in results[0]['masks']]), ['mask 0', 'mask 1'])
+        self.assertEqual(results[1]['masks'], [])
+        self.assertEqual(results[2]['masks'], [])
+
+    def test__overview__error(self, *args):
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(500, b'error', {'Content-Type': 'text/plain'})):
+            response = self.client.get(reverse('survey-overview'))
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.content, b'error')
+
+    def test__overview_detail(self, *args):
+        pk = str(self.survey.pk)
+
+        def kernel_request(*args, **kwargs):
+            if kwargs['url'].endswith('schemas-skeleton.json'):
+                return MockResponse(200, {'jsonpaths': ['a']})
+            return MockResponse(200, {'id': pk, 'entities_count': 10})
+
+        with mock.patch('gather.api.upstream.request', side_effect=kernel_request) as mock_req:
+            response = self.client.get(reverse('survey-overview-detail', kwargs={'pk': pk}))
+            self.assertEqual(mock_req.call_count, 2)
+
+        self.assertEqual(response.status_code, 200)
+        content = response.json()
+        self.assertEqual(content['entities_count'], 10)
+        self.assertEqual(content['skeleton'], {'jsonpaths': ['a']})
+        self.assertEqual(len(content['masks']), 2)
+
+        with mock.patch('gather.api.upstream.request',
+                        return_value=upstream_response(404, b'{}', {'Content-Type': 'application/json'})):
+            response = self.client.get(reverse('survey-overview-detail', kwargs={'pk': pk}))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,143 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import logging
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.contrib.auth.signals import user_logged_out
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from aether.sdk.auth.apptoken.decorators import ERR_MSG_APP_TOKEN
+from aether.sdk.auth.apptoken.models import AppToken
+
+from .cache import LRUCache, get_redis_client
+
+'''
+Cache of the validated app tokens.
+
+``AppToken.get_or_create_token`` reads the user token from the database
+and validates it against the external app in each call, and it's called
+for each external app in every page and proxied request.
+
+The validated tokens are kept ``APP_TOKEN_CACHE_TTL`` seconds in process
+and, with ``APP_TOKEN_CACHE_REDIS``, in REDIS. The user tokens are removed
+on logout and whenever they change (new token) or the external app rejects them.
+'''
+
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.LOGGING_LEVEL)
+
+_tokens = LRUCache(maxsize=settings.APP_TOKEN_CACHE_SIZE)
+
+
+def _key(user_id, app_name):
+    return f'gather:apptoken:{user_id}:{app_name}'
+
+
+def _redis_call(method, *args):
+    if not settings.APP_TOKEN_CACHE_REDIS:
+        return None
+
+    try:
+        return getattr(get_redis_client(), method)(*args)
+    except Exception as e:
+        # degrade to the local cache
+        logger.warning(f'App token cache REDIS error: {str(e)}')
+        return None
+
+
+@receiver(setting_changed)
+def clear(*args, **kwargs):
+    _tokens.clear()
+
+
+def get_or_create_token(user, app_name):
+    '''
+    Cached version of ``AppToken.get_or_create_token``.
+
+    The returned app token is not linked to the database one, use it only to get its value.
+    '''
+
+    if not settings.APP_TOKEN_CACHE_TTL or app_name not in settings.EXTERNAL_APPS:
+        return AppToken.get_or_create_token(user, app_name)
+
+    key = _key(user.pk, app_name)
+    token = _tokens.get(key)
+    if token is None:
+        value = _redis_call('get', key)
+        if value is not None:
+            token = value.decode('utf-8')
+            _tokens.set(key, token, settings.APP_TOKEN_CACHE_TTL)
+
+    if token is not None:
+        return AppToken(user=user, app=app_name, token=token)
+
+    app_token = AppToken.get_or_create_token(user, app_name)
+    if app_token is not None:
+        _tokens.set(key, app_token.token, settings.APP_TOKEN_CACHE_TTL)
+        _redis_call('setex', key, int(settings.APP_TOKEN_CACHE_TTL), app_token.token)
+    return app_token
+
+
+def invalidate(user_id, app_name=None):
+    '''
+    Removes the user cached tokens (of the app or of all the external apps).
+    '''
+
+    keys = [_key(user_id, app) for app in ([app_name] if app_name else settings.EXTERNAL_APPS)]
+    for key in keys:
+        _tokens.delete(key)
+    _redis_call('delete', *keys)
+
+
+@receiver(user_logged_out)
+def invalidate_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate(user.pk)
+
+
+@receiver([post_save, post_delete], sender=AppToken)
+def invalidate_on_change(sender, instance, **kwargs):
+    invalidate(instance.user_id, instance.app)
+
+
+def app_token_required(function=None, redirect_field_name=None, login_url=None):
+    '''
+    Like ``aether.sdk.auth.apptoken.decorators.app_token_required``
+    but using the cached app tokens.
+    '''
+
+    def user_token_test(user):
+        try:
+            for app in settings.EXTERNAL_APPS:
+                if get_or_create_token(user, app) is None:
+                    logger.error(ERR_MSG_APP_TOKEN.format(user=user, app=app))
+                    return False
+            return True
+        except Exception:
+            return False
+
+    actual_decorator = user_passes_test(
+        test_func=user_token_test,
+        login_url=login_url or f'/{settings.CHECK_TOKEN_URL}',
+        redirect_field_name=redirect_field_name,
+    )
+    return login_required(actual_decorator(function) if function else actual_decorator)
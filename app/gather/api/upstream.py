@@ -0,0 +1,194 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+from http.cookiejar import DefaultCookiePolicy
+from time import time
+
+from django.conf import settings
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError, TimeoutError
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+'''
+Pooled HTTP client used in all the calls to the external apps.
+
+Each process keeps one ``requests.Session`` per external app,
+the session keeps alive up to ``UPSTREAM_POOL_SIZE`` connections
+with the app server that are reused across requests and threads.
+The pool is bounded, with all the connections in use the next
+calls wait for a free one instead of opening new ones, at most
+``UPSTREAM_POOL_TIMEOUT`` seconds, then they fail with ``PoolTimeout``.
+'''
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+class PoolTimeout(ConnectionError):
+    '''
+    Raised when there are no free pooled connections after ``UPSTREAM_POOL_TIMEOUT`` seconds.
+    '''
+
+
+class BoundedPoolMixin(object):
+
+    def _get_conn(self, timeout=None):
+        # `requests` never sets the pool timeout, without it the calls would wait forever
+        if timeout is None:
+            timeout = settings.UPSTREAM_POOL_TIMEOUT
+        return super(BoundedPoolMixin, self)._get_conn(timeout=timeout)
+
+
+class BoundedHTTPConnectionPool(BoundedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class BoundedHTTPSConnectionPool(BoundedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class BoundedHTTPAdapter(HTTPAdapter):
+    '''
+    Blocking pool adapter that waits a limited time for a free connection.
+    '''
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(BoundedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': BoundedHTTPConnectionPool,
+            'https': BoundedHTTPSConnectionPool,
+        }
+
+
+class MetricsRetry(Retry):
+    '''
+    Reports each retry of the connection pool in the ``gather_upstream_retries_total`` metric.
+    '''
+
+    def __init__(self, *args, app_name=None, **kwargs):
+        self.app_name = app_name
+        super(MetricsRetry, self).__init__(*args, **kwargs)
+
+    def new(self, **kwargs):
+        # the retry object is replaced with a new one on each attempt
+        return super(MetricsRetry, self).new(app_name=self.app_name, **kwargs)
+
+    def increment(self, method=None, url=None, *args, **kwargs):
+        new_retry = super(MetricsRetry, self).increment(method, url, *args, **kwargs)
+        metrics.UPSTREAM_RETRIES.labels(self.app_name, metrics.get_route(url or '')).inc()
+        return new_retry
+
+
+def build_session(app_name=None):
+    retries = MetricsRetry(
+        app_name=app_name,
+        total=settings.UPSTREAM_RETRIES,
+        backoff_factor=settings.UPSTREAM_RETRIES_BACKOFF,
+        # only the idempotent methods are retried (urllib3 default)
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = BoundedHTTPAdapter(
+        pool_connections=1,  # one host per external app
+        pool_maxsize=settings.UPSTREAM_POOL_SIZE,
+        pool_block=True,
+        max_retries=retries,
+    )
+
+    session = Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # the session is shared among users, never keep their cookies
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session(app_name):
+    '''
+    Returns the current process session linked to the external app.
+    '''
+
+    try:
+        return _sessions[app_name]
+    except KeyError:
+        with _lock:
+            if app_name not in _sessions:
+                _sessions[app_name] = build_session(app_name)
+        return _sessions[app_name]
+
+
+def close_sessions():
+    '''
+    Closes all the pooled connections.
+    '''
+
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def is_timeout(error):
+    '''
+    Indicates if the requests error is a timeout one, the read timeouts
+    after the last retry are raised as connection errors.
+    '''
+
+    if isinstance(error, Timeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, TimeoutError)
+
+
+def request(app_name, method, url, **kwargs):
+    '''
+    Executes the request call to the external app using the pooled session.
+
+    The call is reported in the ``gather.api.metrics`` ones.
+
+    Raises ``PoolTimeout`` if all the pooled connections are still in use
+    after ``UPSTREAM_POOL_TIMEOUT`` seconds.
+    '''
+
+    kwargs.setdefault('timeout', (settings.UPSTREAM_CONNECT_TIMEOUT, settings.UPSTREAM_READ_TIMEOUT))
+    route = metrics.get_route(url)
+    in_flight = metrics.UPSTREAM_IN_FLIGHT.labels(app_name)
+
+    start = time()
+    in_flight.inc()
+    try:
+        response = get_session(app_name).request(method=method, url=url, **kwargs)
+    except EmptyPoolError as e:
+        raise PoolTimeout(e)
+    except (ConnectionError, Timeout) as e:
+        if is_timeout(e):
+            metrics.UPSTREAM_TIMEOUTS.labels(app_name, route).inc()
+        raise
+    finally:
+        in_flight.dec()
+
+    metrics.observe_response(response, app_name, route, time() - start, streamed=kwargs.get('stream', False))
+    return response
@@ -21,10 +21,9 @@ from django.urls import path, include
 
 from rest_framework import routers
 
-from aether.sdk.auth.apptoken.decorators import app_token_required
-from aether.sdk.auth.apptoken.views import TokenProxyView
-
 from . import views
+from .proxy import ProxyView
+from .tokens import app_token_required
 
 router = routers.DefaultRouter()
 
@@ -35,6 +34,7 @@ router.register('masks', views.MaskViewSet)
 
 urlpatterns = [
     path(route='gather/', view=include(router.urls)),
+    path(route='batch', view=views.batch_view, name='batch'),
 ]
 
 for app in settings.AETHER_APPS:
@@ -42,9 +42,9 @@ for app in settings.AETHER_APPS:
 
     urlpatterns += [
         path(route=f'{app}/',
-             view=app_token_required(TokenProxyView.as_view(app_name=external_app)),
+             view=app_token_required(ProxyView.as_view(app_name=external_app)),
              name=f'{app}-proxy-root'),
         path(route=f'{app}/<path:path>',
-             view=app_token_required(TokenProxyView.as_view(app_name=external_app)),
+             view=app_token_required(ProxyView.as_view(app_name=external_app)),
              name=f'{app}-proxy-path'),
     ]
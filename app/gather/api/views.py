@@ -16,31 +16,457 @@
 # specific language governing permissions and limitations
 # under the License.
 
+from itertools import chain
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils.text import slugify
+from django.utils.translation import gettext as _
+from requests.exceptions import HTTPError
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.viewsets import ModelViewSet
 
+from aether.sdk.multitenancy.utils import get_current_realm
 from aether.sdk.multitenancy.views import MtViewSetMixin
+from . import aggregations, batch, bulk, exports, kernel, metrics, reconcile
+from .filters import ColumnsFilter, get_filter_backends, get_list_param
+from .masks import apply_mask, build_columns_tree, stream_entities
 from .models import Survey, Mask
-from .serializers import SurveySerializer, MaskSerializer
+from .pagination import KeysetPagination
+from .serializers import (
+    MASK_VALUES,
+    SURVEY_VALUES,
+    AggregationsSerializer,
+    BatchSerializer,
+    MaskBulkSerializer,
+    MaskSerializer,
+    ReconcileSerializer,
+    SurveySerializer,
+    masks_to_representation,
+    surveys_to_representation,
+)
+
+
+class ValuesViewSetMixin(object):
+    '''
+    Read only fast path for the ``list`` and ``retrieve`` actions.
+
+    The response content is built from ``values()`` querysets with
+    the ``values_to_representation`` method instead of the serializer
+    (by default the serializer with the model instances built from the rows,
+    the view sets replace it with a faster one).
 
+    The ``fields`` and ``omit`` query parameters (comma separated) indicate
+    the fields to include or exclude, like the ``DynamicFieldsModelSerializer``
+    ``fields`` and ``omit`` arguments.
 
-class SurveyViewSet(MtViewSetMixin, ModelViewSet):
+    Expects ``values_fields`` property (the model fields "attname").
+    '''
+
+    values_fields = ()
+
+    def values_to_representation(self, rows):
+        model = self.queryset.model
+        return self.get_serializer([model(**row) for row in rows], many=True).data
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).values(*self.values_fields)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self._to_representation(page))
+
+        return Response(self._to_representation(queryset))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()  # checks the object permissions
+        row = {field: getattr(instance, field) for field in self.values_fields}
+        return Response(self._to_representation([row])[0])
+
+    def _to_representation(self, rows):
+        data = self.values_to_representation(rows)
+
+        fields = get_list_param(self.request, 'fields')
+        omit = get_list_param(self.request, 'omit')
+        if not fields and not omit:
+            return data
+
+        return [
+            {
+                key: value
+                for key, value in item.items()
+                if (not fields or key in fields) and key not in omit
+            }
+            for item in data
+        ]
+
+
+class SurveyViewSet(ValuesViewSetMixin, MtViewSetMixin, ModelViewSet):
     '''
     Handle Survey entries.
+
+    With ``?cursor=`` the list is paginated by name (see ``gather.api.pagination``).
     '''
 
     queryset = Survey.objects.all()
     serializer_class = SurveySerializer
     search_fields = ('name',)
+    filter_backends = get_filter_backends()
     ordering = ('name',)
+    pagination_class = KeysetPagination
+    keyset_fields = ('name', 'project_id')
+    values_fields = SURVEY_VALUES
+
+    def get_queryset(self):
+        qs = super(SurveyViewSet, self).get_queryset()
+        if settings.MULTITENANCY:
+            # the realm is checked with each instance
+            qs = qs.select_related('mt')
+        if self.action not in ('list', 'retrieve'):
+            # the serializer includes the survey masks
+            qs = qs.prefetch_related('masks')
+        return qs
+
+    def values_to_representation(self, rows):
+        return surveys_to_representation(rows)
+
+    def _get_surveys(self, ids):
+        rows = self.get_queryset().filter(pk__in=ids).values(*SURVEY_VALUES)
+        return {survey['project_id']: survey for survey in surveys_to_representation(rows)}
 
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def reconcile(self, request, *args, **kwargs):
+        '''
+        Reconciles the current realm surveys with the kernel projects
+        (see ``gather.api.reconcile``). Only for admin users.
 
-class MaskViewSet(MtViewSetMixin, ModelViewSet):
+        Reachable at ``.../surveys/reconcile/`` with the optional body:
+
+            {"since": "2020-03-01T00:00:00Z", "delete": false, "dry_run": false}
+
+        Returns the number of created, updated, deleted, unchanged and skipped surveys.
+        '''
+
+        serializer = ReconcileSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            stats = reconcile.reconcile(
+                realm=get_current_realm(request) if settings.MULTITENANCY else None,
+                request=request,
+                **serializer.validated_data,
+            )
+        except HTTPError as e:
+            return kernel.error_response(e)
+        return Response(stats)
+
+    @action(detail=False, methods=['get'])
+    def overview(self, request, *args, **kwargs):
+        '''
+        Returns a page of the kernel projects stats along with
+        the masks of their Gather surveys.
+
+        Reachable at ``.../surveys/overview/?page={page}&page_size={page_size}``
+
+        The query parameters are passed to kernel (``search``, ``active``...).
+        '''
+
+        params = {key: value for key, value in request.query_params.items() if key != 'format'}
+        [stats] = kernel.get_pages(request, [('projects-stats.json', params)])
+        if isinstance(stats, Exception):
+            return kernel.error_response(stats)
+
+        surveys = self._get_surveys([project['id'] for project in stats['results']])
+        url = request.build_absolute_uri()
+
+        def get_link(kernel_url):
+            if not kernel_url:
+                return None
+            page = parse_qs(urlparse(kernel_url).query).get('page', ['1'])[0]
+            return replace_query_param(url, 'page', page) if page != '1' else remove_query_param(url, 'page')
+
+        return Response({
+            'count': stats['count'],
+            'next': get_link(stats.get('next')),
+            'previous': get_link(stats.get('previous')),
+            'results': [
+                {**project, 'masks': surveys.get(project['id'], {}).get('masks', [])}
+                for project in stats['results']
+            ],
+        })
+
+    @action(detail=True, methods=['get'], url_path='overview', url_name='overview-detail')
+    def overview_detail(self, request, pk=None, *args, **kwargs):
+        '''
+        Returns the kernel project stats and schemas skeleton along with
+        the masks of the Gather survey.
+
+        Reachable at ``.../surveys/{pk}/overview/``
+        '''
+
+        stats, skeleton = kernel.get_pages(request, [
+            (f'projects-stats/{pk}.json', None),
+            (f'projects/{pk}/schemas-skeleton.json', None),
+        ])
+        for result in (stats, skeleton):
+            if isinstance(result, Exception):
+                return kernel.error_response(result)
+
+        surveys = self._get_surveys([stats['id']])
+        return Response({
+            **stats,
+            'skeleton': skeleton,
+            'masks': surveys.get(stats['id'], {}).get('masks', []),
+        })
+
+
+class MaskViewSet(ValuesViewSetMixin, MtViewSetMixin, ModelViewSet):
     '''
     Handle Survey Mask entries.
+
+    With ``?cursor=`` the list is paginated by survey and name (see ``gather.api.pagination``).
     '''
 
     queryset = Mask.objects.all()
     serializer_class = MaskSerializer
     search_fields = ('survey__name', 'name', 'columns',)
+    filter_backends = get_filter_backends(ColumnsFilter)
     ordering = ('survey', 'name',)
+    pagination_class = KeysetPagination
+    keyset_fields = ('survey_id', 'name', 'id')
     mt_field = 'survey'
+    values_fields = MASK_VALUES
+
+    def get_queryset(self):
+        qs = super(MaskViewSet, self).get_queryset()
+        if settings.MULTITENANCY:
+            # the realm is checked with each instance
+            qs = qs.select_related('survey__mt')
+        return qs
+
+    def values_to_representation(self, rows):
+        return masks_to_representation(rows)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        '''
+        Creates, updates and deletes masks of one or more surveys at once.
+
+        Reachable at ``.../masks/bulk/`` with the body:
+
+            {
+                "create": [{"survey": "uuid", "name": "name", "columns": ["a", "b.c"]}, ...],
+                "update": [{"id": 1, "name": "new name"}, ...],
+                "delete": [2, 3, ...]
+            }
+
+        If any mask is not valid nothing is written (status 400).
+        Returns the result of each mask (see ``gather.api.bulk``).
+        '''
+
+        serializer = MaskBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        status_code, results = bulk.execute(request, serializer.validated_data)
+        return Response(data=results, status=status_code)
+
+    @action(detail=True, methods=['get'])
+    def entities(self, request, pk=None, *args, **kwargs):
+        '''
+        Returns the survey entities with only the mask columns in their payload.
+
+        Reachable at ``.../masks/{pk}/entities/?page={page}&page_size={page_size}``
+
+        Without ``page`` goes through all the kernel entities and streams them,
+        the rest of query parameters are passed to kernel as entity filters.
+        '''
+
+        mask = self.get_object()
+        tree = build_columns_tree(mask.columns)
+        params = self._get_entities_params(request, mask)
+
+        try:
+            if 'page' in request.query_params:
+                page = kernel.get_page(request, 'entities.json', {
+                    **params,
+                    'page': request.query_params['page'],
+                    'page_size': request.query_params.get('page_size', settings.KERNEL_PAGE_SIZE),
+                })
+                return Response({
+                    'count': page['count'],
+                    'results': [apply_mask(entity, tree) for entity in page['results']],
+                })
+
+            pages = kernel.fetch_pages(request, 'entities.json', params)
+            # the first call is done here to return the kernel errors as they are
+            first_page = next(pages)
+        except HTTPError as e:
+            return kernel.error_response(e)
+
+        return StreamingHttpResponse(
+            streaming_content=stream_entities(chain([first_page], pages), tree),
+            content_type='application/json',
+        )
+
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None, *args, **kwargs):
+        '''
+        Exports the survey entities with only the mask columns
+        as a CSV, NDJSON or XLSX file (see ``gather.api.exports``).
+
+        Reachable at ``.../masks/{pk}/export/?file_format={csv|ndjson|xlsx}``
+
+        The file is streamed in the response unless ``storage`` is indicated,
+        in that case the file is written into the storage and the response
+        contains its name, url and the export stats.
+        The rest of query parameters are passed to kernel as entity filters.
+
+        With ``EXPORT_CACHE_ENABLED`` the files are kept in the storage and
+        the identical requests get the stored file till the entities change.
+        '''
+
+        file_format = request.query_params.get('file_format', exports.CSV_FORMAT)
+        if file_format not in exports.EXPORT_FORMATS:
+            raise ValidationError({'file_format': [_('Unknown file format "{}".').format(file_format)]})
+
+        mask = self.get_object()
+        params = self._get_entities_params(request, mask)
+        filename = f'{slugify(mask.survey.name)}-{slugify(mask.name)}.{file_format}'
+        storage = 'storage' in request.query_params
+
+        key = None
+        if settings.EXPORT_CACHE_ENABLED:
+            try:
+                # the latest modified entity indicates if the stored file is still valid
+                latest = kernel.get_page(request, 'entities.json', {
+                    **params,
+                    'page': 1,
+                    'page_size': 1,
+                    'ordering': '-modified',
+                    'fields': 'id,modified',
+                })
+            except HTTPError as e:
+                return kernel.error_response(e)
+
+            key = exports.build_key(mask, file_format, params, exports.get_version(latest))
+            export_file = exports.get_export_file(key)
+            if export_file:
+                if storage:
+                    response = Response({
+                        'name': export_file.file.name,
+                        'url': export_file.file.url,
+                        'rows': export_file.rows,
+                    })
+                else:
+                    response = FileResponse(
+                        export_file.file.open('rb'),
+                        as_attachment=True,
+                        filename=filename,
+                        content_type=exports.CONTENT_TYPES[file_format],
+                    )
+                response['X-Gather-Cache'] = 'HIT'
+                metrics.count_cache('export', 'HIT')
+                return response
+
+        try:
+            pages = kernel.fetch_pages(request, 'entities.json', params)
+            # the first call is done here to return the kernel errors as they are
+            first_page = next(pages)
+        except HTTPError as e:
+            return kernel.error_response(e)
+
+        stats = exports.ExportStats()
+        content = exports.export_content(
+            pages=chain([first_page], pages),
+            columns=mask.columns,
+            tree=build_columns_tree(mask.columns),
+            file_format=file_format,
+            stats=stats,
+        )
+
+        def save(fp):
+            return exports.save_export_file(key, mask, file_format, fp, filename, stats)
+
+        if storage:
+            if key:
+                with exports.temporary_file(content) as fp:
+                    name = save(fp).file.name
+            else:
+                name = exports.write_to_storage(content, f'exports/{mask.survey_id}/{filename}')
+            response = Response({'name': name, 'url': default_storage.url(name), **stats.as_dict()})
+        else:
+            response = StreamingHttpResponse(
+                streaming_content=exports.cache_content(content, save) if key else content,
+                content_type=exports.CONTENT_TYPES[file_format],
+            )
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+        if key:
+            response['X-Gather-Cache'] = 'MISS'
+            metrics.count_cache('export', 'MISS')
+        return response
+
+    @action(detail=True, methods=['get'])
+    def aggregations(self, request, pk=None, *args, **kwargs):
+        '''
+        Aggregates the mask columns over all the survey entities
+        (see ``gather.api.aggregations``).
+
+        Reachable at ``.../masks/{pk}/aggregations/`` with the optional parameters:
+
+            - ``columns``:      comma separated list of mask columns (all of them by default),
+            - ``approximate``:  estimates the distinct values, quartiles and histograms from the start,
+            - ``bins``:         number of intervals of the numbers histogram (``10``),
+            - ``interval``:     ``day``, ``week``, ``month`` (default) or ``year`` of the dates buckets,
+            - ``top``:          number of most common categories (``20``).
+
+        The rest of query parameters are passed to kernel as entity filters.
+        '''
+
+        mask = self.get_object()
+        serializer = AggregationsSerializer(data=request.query_params, context={'mask': mask})
+        serializer.is_valid(raise_exception=True)
+        params = self._get_entities_params(request, mask, exclude=AggregationsSerializer().fields.keys())
+
+        try:
+            pages = kernel.fetch_pages(request, 'entities.json', {**params, 'fields': 'payload'})
+            result = aggregations.aggregate(pages, **serializer.validated_data)
+        except HTTPError as e:
+            return kernel.error_response(e)
+        return Response(result)
+
+    def _get_entities_params(self, request, mask, exclude=()):
+        return {
+            **{
+                key: value
+                for key, value in request.query_params.items()
+                if key not in ('page', 'page_size', 'format', 'file_format', 'storage', *exclude)
+            },
+            'project': str(mask.survey_id),
+            'passthrough': 'true',
+        }
+
+
+@api_view(['POST'])
+def batch_view(request, *args, **kwargs):
+    '''
+    Executes concurrently the GET calls to the indicated API urls
+    and returns all the responses at once.
+
+    Reachable at ``/api/batch`` with the body:
+
+        {"urls": ["/api/kernel/projects/{id}.json", "/api/gather/surveys/{id}/", ...]}
+
+    Returns the list of results (same order) ``{"url", "status", "body"}``.
+    '''
+
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+
+    return Response(batch.execute(request, serializer.validated_data['urls']))
@@ -23,3 +23,7 @@ class Config(AppConfig):
 
     name = 'gather'
     verbose_name = 'Gather'
+
+    def ready(self):
+        # registers the app tokens and queryset cache signal receivers
+        from .api import querycache, tokens  # noqa
@@ -0,0 +1,191 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import io
+import os
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+ASGI entry point (``uvicorn gather.asgi:application``).
+
+Django 2.2 does not serve ASGI requests, the server runs the Django WSGI
+handler in a pool of ``ASGI_THREADS`` threads, all the middlewares, views,
+authentication and permissions apply as usual.
+
+The proxy views to the external apps are the exception: they return an
+``UpstreamCall`` instead of calling the external app, the call is done here
+with a non blocking client (see ``gather.api.async_proxy``) and the slow
+upstream responses do not hold any thread while waiting.
+'''
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gather.settings')
+
+from django.core.wsgi import get_wsgi_application  # noqa
+
+# sets up Django before importing the app modules
+wsgi_application = get_wsgi_application()
+
+from django.conf import settings  # noqa
+
+from .api import async_proxy  # noqa
+from .api.proxy import ASYNC_PROXY_KEY, UpstreamCall  # noqa
+
+# the upstream response headers replace these ones
+UPSTREAM_HEADERS = ['content-length', 'content-type']
+
+
+def build_environ(scope, body, async_proxy=True):
+    '''
+    Builds the WSGI environ of the ASGI http request.
+    '''
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        ASYNC_PROXY_KEY: async_proxy,
+    }
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').lower()
+        value = value.decode('latin1')
+        if name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        elif name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key in environ:
+                # the cookies are separated by "; " (RFC 6265), the rest of headers by ","
+                separator = '; ' if key == 'HTTP_COOKIE' else ','
+                environ[key] = f'{environ[key]}{separator}{value}'
+            else:
+                environ[key] = value
+
+    return environ
+
+
+class ASGIHandler(object):
+    '''
+    ASGI application that serves the requests with the Django WSGI application.
+
+    With ``async_proxy=False`` the proxy views call the external apps
+    within the thread, like in the WSGI server.
+    '''
+
+    def __init__(self, wsgi_application, threads, async_proxy=True):
+        self.wsgi_application = wsgi_application
+        self.async_proxy = async_proxy
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f'Unsupported ASGI scope type: {scope["type"]}')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_proxy.close_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    def call_wsgi(self, environ, send):
+        '''
+        Executes the Django request and sends the response within the same
+        thread, the ``request_finished`` signal (``close_old_connections``...)
+        must run in the thread that used the database connection.
+
+        Returns the ``UpstreamCall`` of the proxy views without sending it.
+        '''
+
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        response = self.wsgi_application(environ, start_response)
+        try:
+            if isinstance(response, UpstreamCall):
+                return started['headers'], response
+
+            send({
+                'type': 'http.response.start',
+                'status': started['status'],
+                'headers': async_proxy.encode_headers(started['headers']),
+            })
+            for chunk in response:
+                if chunk:
+                    send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send({'type': 'http.response.body', 'body': b''})
+            return None, None
+        finally:
+            # finishes the Django request (releases the database connection...)
+            response.close()
+
+    async def http(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        loop = asyncio.get_event_loop()
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        environ = build_environ(scope, body, self.async_proxy)
+        headers, response = await self.run(self.call_wsgi, environ, send_from_thread)
+
+        if isinstance(response, UpstreamCall):
+            headers = [(key, value) for key, value in headers if key.lower() not in UPSTREAM_HEADERS]
+            await async_proxy.forward(response, headers, send)
+
+
+application = ASGIHandler(wsgi_application, settings.ASGI_THREADS)
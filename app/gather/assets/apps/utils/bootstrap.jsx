@@ -0,0 +1,63 @@
+/*
+ * Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+ *
+ * See the NOTICE file distributed with this work for additional information
+ * regarding copyright ownership.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+
+/**
+ * The server embeds in the page (see `BootstrapView`) the assets settings and
+ * the responses of the first API calls of the page indexed by their url.
+ */
+const BOOTSTRAP_ID = '__gather_bootstrap__'
+
+let bootstrap = null
+
+const getBootstrap = () => {
+  if (!bootstrap) {
+    const element = document.getElementById(BOOTSTRAP_ID)
+    try {
+      bootstrap = JSON.parse(element.textContent)
+    } catch (e) {
+      bootstrap = {}
+    }
+    bootstrap.data = bootstrap.data || {}
+  }
+  return bootstrap
+}
+
+/**
+ * Returns the embedded assets settings (if any).
+ */
+export const getBootstrapSettings = () => getBootstrap().settings
+
+/**
+ * Returns the embedded response of the url (if any).
+ * Each response is returned only once, the following calls
+ * (refresh, pagination...) must go to the server.
+ */
+export const popBootstrapData = (url) => {
+  const { data } = getBootstrap()
+  const content = data[url]
+  delete data[url]
+  return content
+}
+
+/**
+ * Forgets the embedded content (only for testing purposes).
+ */
+export const resetBootstrap = () => {
+  bootstrap = null
+}
@@ -0,0 +1,98 @@
+/*
+ * Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+ *
+ * See the NOTICE file distributed with this work for additional information
+ * regarding copyright ownership.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+
+/* global describe, it, beforeEach, afterEach */
+
+import assert from 'assert'
+import nock from 'nock'
+
+import { getBootstrapSettings, popBootstrapData, resetBootstrap } from './bootstrap'
+import { getData } from './request'
+import { getSettings } from './settings'
+
+const BOOTSTRAP = {
+  settings: {
+    aether_apps: ['kernel'],
+    export_max_rows_size: 100,
+    es_consumer_url: null
+  },
+  data: {
+    'http://localhost/api/kernel/projects-stats.json?passthrough=true': { count: 1 }
+  }
+}
+
+const setBootstrap = (content) => {
+  const element = document.createElement('script')
+  element.id = '__gather_bootstrap__'
+  element.type = 'application/json'
+  element.textContent = JSON.stringify(content)
+  document.body.appendChild(element)
+}
+
+describe('Bootstrap utils', () => {
+  beforeEach(() => {
+    nock.cleanAll()
+    resetBootstrap()
+  })
+
+  afterEach(() => {
+    nock.isDone()
+    nock.cleanAll()
+    const element = document.getElementById('__gather_bootstrap__')
+    if (element) {
+      document.body.removeChild(element)
+    }
+    resetBootstrap()
+  })
+
+  it('should work without embedded content', () => {
+    assert.strictEqual(getBootstrapSettings(), undefined)
+    assert.strictEqual(popBootstrapData('http://localhost/api/kernel/projects.json'), undefined)
+  })
+
+  it('should return the embedded data only once', () => {
+    setBootstrap(BOOTSTRAP)
+    const url = 'http://localhost/api/kernel/projects-stats.json?passthrough=true'
+
+    nock('http://localhost')
+      .get('/api/kernel/projects-stats.json?passthrough=true')
+      .reply(200, { count: 2 })
+
+    return getData(url)
+      .then(response => {
+        assert.deepStrictEqual(response, { count: 1 })
+        return getData(url)
+      })
+      .then(response => {
+        assert.deepStrictEqual(response, { count: 2 })
+      })
+  })
+
+  it('should return the embedded settings', () => {
+    setBootstrap(BOOTSTRAP)
+
+    return getSettings().then(settings => {
+      assert.deepStrictEqual(settings, {
+        ODK_ACTIVE: false,
+        EXPORT_MAX_ROWS_SIZE: 100,
+        ES_CONSUMER_URL: null
+      })
+    })
+  })
+})
@@ -19,6 +19,7 @@
  */
 
 import { goTo } from './index'
+import { popBootstrapData } from './bootstrap'
 
 const CSRF_TOKEN = 'csrfmiddlewaretoken'
 
@@ -179,10 +180,15 @@ export const deleteData = (url, opts = {}) => (
 
 /**
  * Request GET from an url.
+ * The first call uses the response embedded in the page (if any).
  */
-export const getData = (url, opts = {}) => (
-  request('GET', url, opts)
-)
+export const getData = (url, opts = {}) => {
+  const content = opts.download ? undefined : popBootstrapData(url)
+  if (content !== undefined) {
+    return Promise.resolve(content)
+  }
+  return request('GET', url, opts)
+}
 
 /**
  * Request POST from an url.
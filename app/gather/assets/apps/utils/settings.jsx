@@ -20,6 +20,7 @@
 
 import { getSettingsPath } from './paths'
 import { getData } from './request'
+import { getBootstrapSettings } from './bootstrap'
 import { ODK_APP } from './constants'
 
 const DEFAULT_SETTINGS = {
@@ -29,7 +30,10 @@ const DEFAULT_SETTINGS = {
 }
 
 export const getSettings = () => new Promise(resolve => {
-  getData(getSettingsPath())
+  const bootstrap = getBootstrapSettings()
+  const settings = bootstrap ? Promise.resolve(bootstrap) : getData(getSettingsPath())
+
+  settings
     .then(response => {
       resolve({
         ODK_ACTIVE: (response.aether_apps || []).indexOf(ODK_APP) > -1,
@@ -0,0 +1,388 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIRequest
+from django.test import RequestFactory, override_settings
+from django.urls import resolve, reverse
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import force_authenticate
+
+from aether.sdk.multitenancy.models import MtInstance
+
+from ..api import async_proxy, tokens
+from ..api.aggregations import aggregate
+from ..api.exports import EXPORT_FORMATS, export_content
+from ..api.kernel import KERNEL_APP, fetch_pages
+from ..api.masks import build_columns_tree
+from ..api.models import Mask, Survey
+from ..api.pagination import encode_cursor
+from ..api.proxy import ProxyView
+from ..api.serializers import (
+    MASK_VALUES,
+    SURVEY_VALUES,
+    MaskSerializer,
+    SurveySerializer,
+    masks_to_representation,
+    surveys_to_representation,
+)
+from ..api.tests import StubServer, build_pages
+from ..api.views import MaskViewSet, SurveyViewSet
+from ..asgi import ASGIHandler
+from ..context_processors import clear_gather_context, gather_context
+from ..middleware import BROTLI, GZIP, brotli, compress
+from ..views import assets_settings
+
+'''
+Benchmark cases: ``(name, function, repeat)`` tuples.
+
+The serializer cases need surveys and masks in the database,
+``create_data`` creates them (run it inside a rolled back transaction).
+
+The upstream cases call a local stub kernel with some latency.
+'''
+
+MASKS_BY_SURVEY = 2
+USERNAME = 'benchmark'
+
+ENTITY_PAYLOAD = {
+    'name': 'John',
+    'age': 30,
+    'address': {'city': 'Berlin', 'street': 'Main', 'number': 1},
+    'children': [{'name': 'Ann', 'age': 1}, {'name': 'Tom', 'age': 3}],
+}
+EXPORT_COLUMNS = ['name', 'address.city', 'children.#.name', 'other']
+AGGREGATION_COLUMNS = ['name', 'age', 'weight', 'visit']
+
+KERNEL_ENTITIES = 2000
+KERNEL_PAGE_SIZE = 100
+KERNEL_LATENCY = 0.01
+
+ASGI_REQUESTS = 100
+ASGI_THREADS = 10
+ASGI_UPSTREAM_LATENCY = 0.2
+
+
+def create_data(rows):
+    '''
+    Creates ``rows`` surveys with ``MASKS_BY_SURVEY`` masks each.
+    '''
+
+    batch_size = 500
+    surveys = [Survey(name=f'survey {i:06}') for i in range(rows)]
+    Survey.objects.bulk_create(surveys, batch_size=batch_size)
+    if settings.MULTITENANCY:
+        MtInstance.objects.bulk_create(
+            [MtInstance(instance=survey, realm=settings.DEFAULT_REALM) for survey in surveys],
+            batch_size=batch_size,
+        )
+    Mask.objects.bulk_create(
+        [
+            Mask(survey=survey, name=f'mask {j}', columns=['a', 'b.c', f'd{j}'])
+            for survey in surveys
+            for j in range(MASKS_BY_SURVEY)
+        ],
+        batch_size=batch_size,
+    )
+    return get_user_model().objects.create_user(USERNAME, f'{USERNAME}@example.com', USERNAME)
+
+
+def render(data):
+    return JSONRenderer().render(data)
+
+
+def get_payload(i):
+    '''
+    Returns the ``ENTITY_PAYLOAD`` with some values depending on ``i``.
+    '''
+
+    return {
+        **ENTITY_PAYLOAD,
+        'name': f'name {i % 101}',
+        'age': i % 100,
+        'weight': 50 + (i % 61) / 2,
+        'visit': f'2020-{i % 12 + 1:02}-{i % 28 + 1:02}',
+    }
+
+
+def get_stub_kernel(routes):
+    '''
+    Returns a function that starts the stub kernel server (only the first time)
+    and returns the settings that link the kernel app to it.
+    '''
+
+    server = None
+
+    def stub_kernel():
+        nonlocal server
+        if server is None:
+            server = StubServer(routes).__enter__()
+
+        app = {'url': f'{server.url}/kernel', 'token': 'benchmark'}
+        return override_settings(EXTERNAL_APPS={KERNEL_APP: {'test': app} if settings.TESTING else app})
+
+    return stub_kernel
+
+
+def get_proxy_application(user):
+    '''
+    Returns a WSGI application that serves the kernel proxy view to the user.
+
+    The ASGI server threads do not see the benchmark data (it is not committed),
+    the application skips the middlewares and authenticates the given user.
+    '''
+
+    view = ProxyView.as_view(app_name=KERNEL_APP)
+
+    def application(environ, start_response):
+        request = WSGIRequest(environ)
+        request.user = user
+        response = view(request, path=request.path_info.split('/api/kernel/', 1)[-1])
+        start_response(f'{response.status_code} {response.reason_phrase}', list(response.items()))
+        return response
+
+    return application
+
+
+async def asgi_get(application, path):
+    '''
+    Executes the ASGI GET request, returns the response status.
+    '''
+
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await application({'type': 'http', 'method': 'GET', 'path': path, 'headers': []}, receive, send)
+    return sent[0]['status']
+
+
+def export(pages, file_format):
+    '''
+    Returns the size of the export file of the pages.
+    '''
+
+    return sum([
+        len(chunk)
+        for chunk in export_content(iter(pages), EXPORT_COLUMNS, build_columns_tree(EXPORT_COLUMNS), file_format)
+    ])
+
+
+def get_cases(sizes, repeat, user=None):
+    request = RequestFactory().get('/')
+    context = {'request': request}
+
+    def cold_gather_context():
+        clear_gather_context()
+        return gather_context(request)
+
+    cases = [
+        ('urls.resolve', lambda: resolve('/surveys/view/0a1b2c3d-0000-0000-0000-000000000000'), repeat),
+        ('urls.reverse', lambda: reverse('surveys', kwargs={'action': 'list'}), repeat),
+        ('gather_context', lambda: gather_context(request), repeat),
+        ('gather_context.cold', cold_gather_context, repeat),
+        ('assets_settings', lambda: assets_settings(request), repeat),
+    ]
+
+    # the kernel entities pages fetched concurrently
+    kernel_pages = build_pages([get_payload(i) for i in range(KERNEL_ENTITIES)], KERNEL_PAGE_SIZE)
+
+    def kernel_page(handler, body):
+        page = int(parse_qs(urlsplit(handler.path).query)['page'][0])
+        sleep(KERNEL_LATENCY)
+        return 200, {}, kernel_pages[page - 1]
+
+    def slow(handler, body):
+        sleep(ASGI_UPSTREAM_LATENCY)
+        return 200, {}, {}
+
+    stub_kernel = get_stub_kernel({
+        '/kernel/entities.json': kernel_page,
+        '/kernel/slow': slow,
+        f'/kernel/{settings.TOKEN_URL}': (200, {}, {'token': 'benchmark'}),
+    })
+
+    def fetch_kernel_pages(workers):
+        with stub_kernel():
+            pages = fetch_pages(request, 'entities.json', page_size=KERNEL_PAGE_SIZE, workers=workers,
+                                headers={'Authorization': 'Token benchmark'})
+            return sum([len(page['results']) for page in pages])
+
+    cases += [
+        (
+            f'kernel.fetch_pages.{workers}',
+            lambda w=workers: fetch_kernel_pages(w),
+            min(repeat, 10),
+        )
+        for workers in (1, 2, 4, 8)
+    ]
+
+    for size in sizes:
+        # the biggest sizes take seconds per call
+        size_repeat = max(3, min(repeat, repeat * 100 // size))
+        surveys = Survey.objects.order_by('name')
+        masks = Mask.objects.order_by('survey__name', 'name')
+        mask_rows = size * MASKS_BY_SURVEY
+
+        cases += [
+            (
+                f'SurveySerializer.{size}',
+                lambda s=size: render(SurveySerializer(
+                    surveys.prefetch_related('masks')[:s], many=True, context=context).data),
+                size_repeat,
+            ),
+            (
+                f'surveys_to_representation.{size}',
+                lambda s=size: render(surveys_to_representation(surveys.values(*SURVEY_VALUES)[:s])),
+                size_repeat,
+            ),
+            (
+                f'MaskSerializer.{mask_rows}',
+                lambda s=mask_rows: render(MaskSerializer(masks[:s], many=True, context=context).data),
+                size_repeat,
+            ),
+            (
+                f'masks_to_representation.{mask_rows}',
+                lambda s=mask_rows: render(masks_to_representation(masks.values(*MASK_VALUES)[:s])),
+                size_repeat,
+            ),
+        ]
+
+        # export files and aggregations of as many entities as surveys (no database access)
+        pages = build_pages([get_payload(i) for i in range(size)], 1000)
+        cases += [
+            (
+                f'export.{file_format}.{size}',
+                lambda p=pages, f=file_format: export(p, f),
+                size_repeat,
+            )
+            for file_format in EXPORT_FORMATS
+        ]
+        cases += [
+            (
+                f'aggregate.{size}',
+                lambda p=pages: aggregate(iter(p), AGGREGATION_COLUMNS),
+                size_repeat,
+            ),
+            (
+                f'aggregate.approximate.{size}',
+                lambda p=pages: aggregate(iter(p), AGGREGATION_COLUMNS, approximate=True),
+                size_repeat,
+            ),
+        ]
+
+    if sizes:
+        # compression of the biggest masks page with the different encodings and levels
+        size = max(sizes)
+        size_repeat = max(3, min(repeat, repeat * 100 // size))
+        content = render(masks_to_representation(
+            Mask.objects.order_by('survey__name', 'name').values(*MASK_VALUES)[:size * MASKS_BY_SURVEY]))
+        levels = [(GZIP, level) for level in (1, 6, 9)]
+        if brotli is not None:
+            levels += [(BROTLI, quality) for quality in (1, 4, 11)]
+
+        cases += [
+            (
+                f'compress.{encoding}.{level}.{size * MASKS_BY_SURVEY}',
+                lambda e=encoding, lv=level: compress(content, e, lv),
+                size_repeat,
+            )
+            for encoding, level in levels
+        ]
+
+    if user is not None:
+        # concurrent requests to a slow upstream, the proxy call within the threads or asynchronous
+        def get_asgi_proxy(async_proxy_enabled):
+            application = ASGIHandler(get_proxy_application(user), ASGI_THREADS, async_proxy_enabled)
+
+            async def load():
+                return await asyncio.gather(*[
+                    asgi_get(application, '/api/kernel/slow')
+                    for _ in range(ASGI_REQUESTS)
+                ])
+
+            def call():
+                with stub_kernel():
+                    # the app token is cached before leaving the current thread
+                    tokens.get_or_create_token(user, KERNEL_APP)
+                    loop = asyncio.new_event_loop()
+                    try:
+                        return loop.run_until_complete(load())
+                    finally:
+                        loop.run_until_complete(async_proxy.close_clients())
+                        loop.close()
+            return call
+
+        cases += [
+            ('asgi.proxy.threads', get_asgi_proxy(False), min(repeat, 3)),
+            ('asgi.proxy.async', get_asgi_proxy(True), min(repeat, 3)),
+        ]
+
+        def get_view(viewset, path, params):
+            view = viewset.as_view({'get': 'list'})
+            view_request = RequestFactory().get(path, params)
+            force_authenticate(view_request, user=user)
+
+            def call():
+                response = view(view_request)
+                response.render()
+                return response
+            return call
+
+        cases.append((
+            'MaskViewSet.search',
+            get_view(MaskViewSet, '/api/gather/masks/', {'search': 'survey 0001', 'page_size': 100}),
+            repeat,
+        ))
+
+        # the last page of surveys: offset (with count) vs keyset pagination
+        path = '/api/gather/surveys/'
+        page_size = 10
+        rows = Survey.objects.count()
+        offset = max(0, (rows - 1) // page_size * page_size)
+        cursor = ''
+        if offset:
+            fields = SurveyViewSet.keyset_fields
+            values = Survey.objects.order_by(*fields).values_list(*fields)[offset - 1]
+            cursor = encode_cursor(values)
+
+        cases += [
+            (
+                'SurveyViewSet.page.last',
+                get_view(SurveyViewSet, path, {'page': offset // page_size + 1, 'page_size': page_size}),
+                repeat,
+            ),
+            (
+                'SurveyViewSet.cursor.last',
+                get_view(SurveyViewSet, path, {'cursor': cursor, 'page_size': page_size}),
+                repeat,
+            ),
+        ]
+
+    return cases
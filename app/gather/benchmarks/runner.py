@@ -0,0 +1,110 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import math
+import platform
+
+from time import perf_counter
+
+import django
+from django.conf import settings
+from django.utils import timezone
+
+
+def percentile(samples, value):
+    '''
+    Returns the nearest-rank percentile of the sorted samples.
+    '''
+
+    index = max(math.ceil(value / 100 * len(samples)) - 1, 0)
+    return samples[index]
+
+
+def measure(func, repeat=100, warmup=10, min_time=0.001):
+    '''
+    Measures the execution time of the function.
+
+    After ``warmup`` calls, collects ``repeat`` samples. Each sample runs the
+    function as many times as needed to last at least ``min_time`` seconds
+    (the timer resolution does not distort the fastest functions)
+    and takes the time per call.
+
+    Returns the stats in seconds per call and the calls per second.
+    '''
+
+    for _ in range(warmup):
+        func()
+
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        if perf_counter() - start >= min_time:
+            break
+        number *= 10
+
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((perf_counter() - start) / number)
+
+    samples.sort()
+    mean = sum(samples) / len(samples)
+    return {
+        'samples': len(samples),
+        'number': number,
+        'mean': mean,
+        'min': samples[0],
+        'max': samples[-1],
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        'ops': 1 / mean if mean else 0.0,
+    }
+
+
+def get_environment():
+    return {
+        'version': settings.VERSION,
+        'revision': settings.REVISION,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'date': timezone.now().isoformat(),
+    }
+
+
+def compare(current, previous, threshold=0.1):
+    '''
+    Compares the ``p50`` of the current results with the previous ones.
+
+    Returns the list of ``(name, ratio, is_regression)``, where the ratio is
+    the current time divided by the previous one, and the regressions are
+    the ratios beyond ``1 + threshold``.
+    '''
+
+    comparison = []
+    for name, stats in current.items():
+        if name not in previous or not previous[name]['p50']:
+            continue
+        ratio = stats['p50'] / previous[name]['p50']
+        comparison.append((name, ratio, ratio > 1 + threshold))
+    return comparison
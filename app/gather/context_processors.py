@@ -17,17 +17,38 @@
 # under the License.
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
-from django.urls import reverse
+from django.urls import get_script_prefix, reverse
 
 from aether.sdk.multitenancy.utils import get_path_realm
 from aether.sdk.health.utils import get_external_app_url
 
+from .api.cache import LRUCache
+from .api.metrics import count_cache
 
-def gather_context(request):
+# the context only depends on the realm (gateway path) and on the settings,
+# the number of entries is limited because the realm comes from the request path
+_contexts = LRUCache(maxsize=100)
+
+
+@receiver(setting_changed)
+def clear_gather_context(*args, **kwargs):
+    _contexts.clear()
+
+
+def _get_realm(request):
+    # the current path is already resolved while rendering the templates
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.kwargs.get('realm')
+    return get_path_realm(request)
+
+
+def _build_context(request, realm):
     def get_url(view_name, kwargs=None):
         # get the url using the gateway path if needed.
-        realm = get_path_realm(request)
         kwargs = kwargs or {}
         kwargs = {**kwargs, 'realm': realm} if realm else kwargs
         return reverse(view_name, kwargs=kwargs)
@@ -50,3 +71,18 @@ def gather_context(request):
         context[f'{name}_url'] = get_external_app_url(external_app, request)
 
     return context
+
+
+def gather_context(request):
+    realm = _get_realm(request)
+    key = (realm, get_script_prefix())
+
+    context = _contexts.get(key)
+    if context is None:
+        count_cache('gather_context', 'MISS')
+        context = _build_context(request, realm)
+        _contexts.set(key, context)
+    else:
+        count_cache('gather_context', 'HIT')
+
+    return {**context, 'navigation_list': list(context['navigation_list'])}
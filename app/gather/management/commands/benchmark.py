@@ -0,0 +1,140 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from gather.benchmarks.cases import create_data, get_cases
+from gather.benchmarks.runner import compare, get_environment, measure
+
+
+class Command(BaseCommand):
+
+    help = _('Measure the request hot paths (the test data is created within a rolled back transaction)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filter',
+            '-f',
+            type=str,
+            help=_('Run only the benchmarks whose name matches this regular expression'),
+            dest='filter',
+            action='store',
+            required=False,
+        )
+        parser.add_argument(
+            '--sizes',
+            type=str,
+            help=_('Comma separated list of rows for the serializer benchmarks'),
+            dest='sizes',
+            action='store',
+            required=False,
+            default='10,1000,100000',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            help=_('Number of samples of each benchmark'),
+            dest='repeat',
+            action='store',
+            required=False,
+            default=100,
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            help=_('Number of calls before measuring'),
+            dest='warmup',
+            action='store',
+            required=False,
+            default=3,
+        )
+        parser.add_argument(
+            '--output',
+            '-o',
+            type=str,
+            help=_('JSON file to store the results'),
+            dest='output',
+            action='store',
+            required=False,
+        )
+        parser.add_argument(
+            '--compare',
+            '-c',
+            type=str,
+            help=_('JSON file with previous results, fails if any p50 is worse than the threshold'),
+            dest='compare',
+            action='store',
+            required=False,
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            help=_('Allowed slowdown ratio compared with the previous results'),
+            dest='threshold',
+            action='store',
+            required=False,
+            default=0.1,
+        )
+
+    def handle(self, *args, **options):
+        '''
+        Runs the benchmarks and prints (and stores) the results.
+        '''
+
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        pattern = re.compile(options['filter'] or '.*')
+        results = {}
+
+        with transaction.atomic():
+            user = create_data(max(sizes or [0]))
+
+            for name, func, repeat in get_cases(sizes, options['repeat'], user):
+                if not pattern.search(name):
+                    continue
+
+                stats = measure(func, repeat=repeat, warmup=options['warmup'])
+                results[name] = stats
+                self.stdout.write(
+                    f'{name:<40} p50 {stats["p50"] * 1e3:10.3f} ms   p95 {stats["p95"] * 1e3:10.3f} ms   '
+                    f'p99 {stats["p99"] * 1e3:10.3f} ms   {stats["ops"]:12.1f} ops/s'
+                )
+
+            # the benchmark data is not kept
+            transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                json.dump({'environment': get_environment(), 'results': results}, fp, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as fp:
+                previous = json.load(fp)['results']
+
+            regressions = []
+            for name, ratio, is_regression in compare(results, previous, options['threshold']):
+                self.stdout.write(f'{name:<40} {ratio:6.2f}x{"   REGRESSION" if is_regression else ""}')
+                if is_regression:
+                    regressions.append(name)
+
+            if regressions:
+                raise CommandError(_('Regressions: {}').format(', '.join(regressions)))
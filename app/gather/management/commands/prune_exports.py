@@ -0,0 +1,69 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext_lazy as _
+
+from gather.api.exports import prune_export_files
+
+
+class Command(BaseCommand):
+
+    help = _('Delete the least recently used export files')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-files',
+            type=int,
+            help=_('Maximum number of export files to keep'),
+            dest='max_files',
+            action='store',
+            required=False,
+            default=settings.EXPORT_CACHE_MAX_FILES,
+        )
+        parser.add_argument(
+            '--max-size',
+            type=int,
+            help=_('Maximum size in bytes of the export files to keep'),
+            dest='max_size',
+            action='store',
+            required=False,
+            default=settings.EXPORT_CACHE_MAX_SIZE,
+        )
+        parser.add_argument(
+            '--max-age',
+            type=int,
+            help=_('Delete the export files not used in the last indicated days'),
+            dest='max_age',
+            action='store',
+            required=False,
+            default=settings.EXPORT_CACHE_MAX_AGE,
+        )
+
+    def handle(self, *args, **options):
+        '''
+        Deletes the export files beyond the indicated limits.
+        '''
+
+        deleted = prune_export_files(
+            max_files=options['max_files'],
+            max_size=options['max_size'],
+            max_age=options['max_age'],
+        )
+        self.stdout.write(_('Deleted {} export files').format(deleted))
@@ -0,0 +1,88 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.translation import gettext_lazy as _
+
+from gather.api.reconcile import get_realms, reconcile
+
+
+class Command(BaseCommand):
+
+    help = _('Reconcile the surveys with the Aether Kernel projects')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--realm',
+            '-r',
+            type=str,
+            help=_('Realm to reconcile (all the realms with surveys by default)'),
+            dest='realms',
+            action='append',
+            required=False,
+        )
+        parser.add_argument(
+            '--since',
+            '-s',
+            type=str,
+            help=_('Upsert only the projects modified after this date or datetime (ISO 8601)'),
+            dest='since',
+            action='store',
+            required=False,
+        )
+        parser.add_argument(
+            '--delete',
+            help=_('Delete the surveys without project'),
+            dest='delete',
+            action='store_true',
+        )
+        parser.add_argument(
+            '--dry-run',
+            help=_('Count the changes without applying them'),
+            dest='dry_run',
+            action='store_true',
+        )
+
+    def handle(self, *args, **options):
+        '''
+        Reconciles the surveys of each realm and prints the next "since" value.
+        '''
+
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None and parse_date(options['since']):
+                since = parse_datetime(options['since'] + 'T00:00:00')
+            if since is None:
+                raise CommandError(_('Invalid date "{}"').format(options['since']))
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since, timezone.utc)
+
+        start = timezone.now()
+        for realm in options['realms'] or get_realms():
+            stats = reconcile(
+                realm=realm,
+                since=since,
+                delete=options['delete'],
+                dry_run=options['dry_run'],
+            )
+            self.stdout.write(_('Realm "{}": {}').format(realm, stats))
+
+        self.stdout.write(_('Next --since: {}').format(start.isoformat()))
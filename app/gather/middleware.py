@@ -0,0 +1,181 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+from .api.proxy import UpstreamCall
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+'''
+Compression of the API responses (gzip and, if ``brotli`` is installed, brotli).
+'''
+
+GZIP = 'gzip'
+BROTLI = 'br'
+
+# the streamed content is flushed to the client at least every 64KB of content
+FLUSH_SIZE = 64 * 1024
+
+
+def get_encodings():
+    return [BROTLI, GZIP] if brotli is not None else [GZIP]
+
+
+def get_encoding(accept_encoding):
+    '''
+    Returns the preferred encoding within the ``Accept-Encoding`` header ones,
+    ``None`` if none of them is supported.
+
+        gzip, deflate, br  => br
+        br;q=0.5, gzip     => gzip
+        identity           => None
+    '''
+
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        try:
+            quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        accepted[name.strip()] = quality
+
+    candidates = [
+        (accepted.get(encoding, accepted.get('*', 0.0)), -index, encoding)
+        for index, encoding in enumerate(get_encodings())
+    ]
+    quality, _, encoding = max(candidates)
+    return encoding if quality > 0 else None
+
+
+def get_compressor(encoding, level=None):
+    '''
+    Returns the ``process``, ``flush`` and ``finish`` functions of a new compressor,
+    the default level comes from the settings.
+    '''
+
+    if encoding == BROTLI:
+        quality = settings.COMPRESSION_BROTLI_QUALITY if level is None else level
+        compressor = brotli.Compressor(quality=quality)
+        return compressor.process, compressor.flush, compressor.finish
+
+    # 16 + MAX_WBITS: gzip header and trailer
+    level = settings.COMPRESSION_GZIP_LEVEL if level is None else level
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def compress(content, encoding, level=None):
+    process, _, finish = get_compressor(encoding, level)
+    return process(content) + finish()
+
+
+def is_compressible(headers, size=None):
+    '''
+    Indicates if the response with these headers and content size (``None`` if unknown)
+    is worth compressing, the already encoded or partial responses are not.
+    '''
+
+    content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+    return (
+        'Content-Encoding' not in headers and
+        'Content-Range' not in headers and
+        content_type in settings.COMPRESSION_CONTENT_TYPES and
+        (size is None or size >= settings.COMPRESSION_MIN_SIZE)
+    )
+
+
+def compress_sequence(sequence, encoding):
+    '''
+    Compresses the chunks as they come without buffering the whole content.
+    '''
+
+    process, flush, finish = get_compressor(encoding)
+    pending = 0
+    for chunk in sequence:
+        data = process(chunk)
+        pending += len(chunk)
+        if pending >= FLUSH_SIZE:
+            data += flush()
+            pending = 0
+        if data:
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    '''
+    Compresses the responses of the ``COMPRESSION_CONTENT_TYPES``
+    bigger than ``COMPRESSION_MIN_SIZE`` with the encoding preferred
+    by the client (``Accept-Encoding``).
+
+    The streamed responses are compressed chunk by chunk and the already
+    encoded responses (like the proxied ones compressed by the external app)
+    are passed through untouched.
+
+    The ``UpstreamCall`` responses have no body yet, the ASGI server compresses
+    it as it comes (see ``gather.api.async_proxy.forward``).
+    '''
+
+    def process_response(self, request, response):
+        if not settings.COMPRESSION_ENABLED:
+            return response
+
+        if isinstance(response, UpstreamCall):
+            response.accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+            return response
+
+        if response.streaming:
+            # the size is unknown unless the streamed content comes with it
+            size = int(response.get('Content-Length') or settings.COMPRESSION_MIN_SIZE)
+        else:
+            size = len(response.content)
+        if not is_compressible(response, size):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = get_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_sequence(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            content = compress(response.content, encoding)
+            if len(content) >= size:
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # the compressed content is not byte by byte the same
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+
+        return response
@@ -20,9 +20,13 @@ import os
 
 from aether.sdk.conf.settings import *  # noqa
 from aether.sdk.conf.settings import (
+    MIDDLEWARE,
     TEMPLATES,
     MIGRATION_MODULES,
-    EXTERNAL_APPS
+    DJANGO_USE_CACHE,
+    EXTERNAL_APPS,
+    REDIS_REQUIRED,
+    REQUEST_ERROR_RETRIES,
 )
 
 
@@ -56,6 +60,10 @@ MIGRATION_MODULES['gather'] = 'gather.api.migrations'
 # Assets settings
 EXPORT_MAX_ROWS_SIZE = os.environ.get('EXPORT_MAX_ROWS_SIZE', '0')
 
+# Embed the first API responses of each page within the page
+BOOTSTRAP_DATA = bool(os.environ.get('BOOTSTRAP_DATA'))
+BOOTSTRAP_DATA_DEADLINE = float(os.environ.get('BOOTSTRAP_DATA_DEADLINE', 0.3))  # seconds
+
 
 # ------------------------------------------------------------------------------
 # Aether external modules
@@ -72,6 +80,124 @@ AETHER_APPS = [
 # ElasticSearch consumer URL
 ES_CONSUMER_URL = os.environ.get('ES_CONSUMER_URL')
 
+# Pooled HTTP connections with the external apps (per process and app)
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 10))
+UPSTREAM_POOL_TIMEOUT = float(os.environ.get('UPSTREAM_POOL_TIMEOUT', 10))  # seconds
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))  # seconds
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 300))  # seconds
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', REQUEST_ERROR_RETRIES))
+UPSTREAM_RETRIES_BACKOFF = float(os.environ.get('UPSTREAM_RETRIES_BACKOFF', 0.5))  # seconds
+# concurrent calls to the external apps within the same request
+UPSTREAM_MAX_WORKERS = int(os.environ.get('UPSTREAM_MAX_WORKERS', 4))
+
+# Forward the proxied responses in chunks instead of loading them in memory
+PROXY_STREAMING = bool(os.environ.get('PROXY_STREAMING', True))
+PROXY_STREAMING_CHUNK_SIZE = int(os.environ.get('PROXY_STREAMING_CHUNK_SIZE', 64 * 1024))  # 64KB
+
+# ASGI server (`gather.asgi`): threads serving the Django requests,
+# the proxied calls wait for the external apps without holding any of them
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 20))
+ASYNC_PROXY_MAX_CONNECTIONS = int(os.environ.get('ASYNC_PROXY_MAX_CONNECTIONS', 1000))  # per process and app
+
+# Cache the proxied GET responses of the indicated routes (path regular expressions)
+PROXY_CACHE_ENABLED = bool(os.environ.get('PROXY_CACHE_ENABLED'))
+PROXY_CACHE_TTL = int(os.environ.get('PROXY_CACHE_TTL', 30))  # seconds
+# after TTL the entries are revalidated with the external app (ETag) till they expire
+PROXY_CACHE_STALE_TTL = int(os.environ.get('PROXY_CACHE_STALE_TTL', 60 * 10))  # 10 minutes
+PROXY_CACHE_SIZE = int(os.environ.get('PROXY_CACHE_SIZE', 1000))  # entries in process
+PROXY_CACHE_MAX_BODY_SIZE = int(os.environ.get('PROXY_CACHE_MAX_BODY_SIZE', 1024 * 1024))  # 1MB
+PROXY_CACHE_REDIS = bool(os.environ.get('PROXY_CACHE_REDIS')) and REDIS_REQUIRED
+PROXY_CACHE_REDIS_TIMEOUT = float(os.environ.get('PROXY_CACHE_REDIS_TIMEOUT', 0.5))  # seconds
+
+# The identical concurrent GET requests of the cached routes share the same upstream call,
+# with REDIS also the requests in other processes (requires `PROXY_CACHE_REDIS`)
+PROXY_COALESCE_ENABLED = bool(os.environ.get('PROXY_COALESCE_ENABLED', True))
+PROXY_COALESCE_TIMEOUT = float(os.environ.get('PROXY_COALESCE_TIMEOUT', 30))  # seconds
+PROXY_COALESCE_REDIS = bool(os.environ.get('PROXY_COALESCE_REDIS')) and PROXY_CACHE_REDIS
+
+_proxy_cache_routes = {
+    'kernel': r'projects-stats,projects/[^/]+/schemas-skeleton',
+    'odk': r'surveyors,xforms',
+}
+PROXY_CACHE_ROUTES = {
+    app: os.environ.get(
+        f'PROXY_CACHE_{app.upper()}_ROUTES',
+        _proxy_cache_routes.get(app, ''),
+    ).split(',')
+    for app in AETHER_APPS
+}
+# The responses of these cached routes depend only on the realm,
+# they are cached and coalesced for all the users of the realm
+_proxy_cache_shared_routes = {
+    'kernel': _proxy_cache_routes['kernel'],
+}
+PROXY_CACHE_SHARED_ROUTES = {
+    app: os.environ.get(
+        f'PROXY_CACHE_{app.upper()}_SHARED_ROUTES',
+        _proxy_cache_shared_routes.get(app, ''),
+    ).split(',')
+    for app in AETHER_APPS
+}
+
+# Validated app tokens of the users (see `gather.api.tokens`), set TTL to 0 to disable it
+APP_TOKEN_CACHE_TTL = int(os.environ.get('APP_TOKEN_CACHE_TTL', 60))  # seconds
+APP_TOKEN_CACHE_SIZE = int(os.environ.get('APP_TOKEN_CACHE_SIZE', 10000))  # entries in process
+APP_TOKEN_CACHE_REDIS = bool(os.environ.get('APP_TOKEN_CACHE_REDIS')) and REDIS_REQUIRED
+
+# Cached ORM reads of surveys and masks (see `gather.api.querycache`), requires `DJANGO_USE_CACHE`
+SURVEY_CACHE_TTL = int(os.environ.get('SURVEY_CACHE_TTL', 60 * 60))  # seconds
+MASK_CACHE_TTL = int(os.environ.get('MASK_CACHE_TTL', 60 * 10))  # seconds
+
+if DJANGO_USE_CACHE:
+    from aether.sdk.conf.settings import CACHEOPS
+
+    _cached_ops = ('fetch', 'get', 'count', 'exists')
+    CACHEOPS = {
+        **CACHEOPS,
+        'gather.survey': {'ops': _cached_ops, 'timeout': SURVEY_CACHE_TTL},
+        'gather.mask': {'ops': _cached_ops, 'timeout': MASK_CACHE_TTL},
+        # the last access is written with `update` on each read
+        'gather.exportfile': None,
+    }
+
+# Batch of API calls (`/api/batch`)
+BATCH_MAX_URLS = int(os.environ.get('BATCH_MAX_URLS', 20))
+BATCH_DEADLINE = float(os.environ.get('BATCH_DEADLINE', 30))  # seconds
+BATCH_MAX_BODY_SIZE = int(os.environ.get('BATCH_MAX_BODY_SIZE', 1024 * 1024))  # 1MB
+# threads shared by all the batches of the process
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', UPSTREAM_MAX_WORKERS * 4))
+
+# Page size used to go through the kernel entities (masked entities and exports)
+KERNEL_PAGE_SIZE = int(os.environ.get('KERNEL_PAGE_SIZE', 1000))
+# Number of kernel entities pages fetched at the same time
+KERNEL_FETCH_WORKERS = int(os.environ.get('KERNEL_FETCH_WORKERS', UPSTREAM_MAX_WORKERS))
+
+# Distinct values of each column kept by the aggregations (`/api/gather/masks/{id}/aggregations/`),
+# beyond this number the distinct count, quartiles and histograms are estimated
+AGGREGATION_EXACT_LIMIT = int(os.environ.get('AGGREGATION_EXACT_LIMIT', 10000))
+
+# Export files kept in the storage to serve the identical export requests
+EXPORT_CACHE_ENABLED = bool(os.environ.get('EXPORT_CACHE_ENABLED', True))
+EXPORT_CACHE_MAX_FILES = int(os.environ.get('EXPORT_CACHE_MAX_FILES', 100))
+EXPORT_CACHE_MAX_SIZE = int(os.environ.get('EXPORT_CACHE_MAX_SIZE', 1024 * 1024 * 1024))  # 1GB
+EXPORT_CACHE_MAX_AGE = int(os.environ.get('EXPORT_CACHE_MAX_AGE', 7))  # days (see `prune_exports` command)
+
+
+# Compression of the API and proxied responses (gzip and brotli)
+COMPRESSION_ENABLED = bool(os.environ.get('COMPRESSION_ENABLED', True))
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))  # bytes
+COMPRESSION_CONTENT_TYPES = os.environ.get(
+    'COMPRESSION_CONTENT_TYPES',
+    'application/json,application/x-ndjson,text/csv',
+).split(',')
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))  # 1 (fastest) to 9
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 4))  # 0 (fastest) to 11
+
+if COMPRESSION_ENABLED:
+    # compresses the responses after the rest of middlewares
+    _index = MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1
+    MIDDLEWARE = [*MIDDLEWARE[:_index], 'gather.middleware.CompressionMiddleware', *MIDDLEWARE[_index:]]
+
 
 # Upload files
 # ------------------------------------------------------------------------------
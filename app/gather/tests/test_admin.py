@@ -0,0 +1,54 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from ..api.models import Survey, Mask
+
+
+class AdminTests(TestCase):
+
+    def setUp(self):
+        super(AdminTests, self).setUp()
+
+        username = 'admin'
+        email = 'admin@example.com'
+        password = 'adminadmin'
+        get_user_model().objects.create_superuser(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+
+    def test__mask_search(self):
+        survey = Survey.objects.create(name='survey')
+        Mask.objects.create(survey=survey, name='first', columns=['a.b', 'c'])
+        Mask.objects.create(survey=survey, name='second', columns=['a.b.c'])
+
+        url = reverse('admin:gather_mask_changelist')
+
+        def search(term):
+            response = self.client.get(url, {'q': term})
+            self.assertEqual(response.status_code, 200)
+            return sorted([mask.name for mask in response.context['cl'].result_list])
+
+        # the columns substrings
+        self.assertEqual(search('a.b'), ['first', 'second'])
+        self.assertEqual(search('b.c'), ['second'])
+        self.assertEqual(search('surv'), ['first', 'second'])
+        self.assertEqual(search('sec'), ['second'])
+        self.assertEqual(search('x'), [])
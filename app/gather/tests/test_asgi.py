@@ -0,0 +1,274 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import gzip
+import json
+import threading
+
+from time import sleep
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished, request_started
+from django.middleware.csrf import _get_new_csrf_token
+from django.test import TransactionTestCase, override_settings
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from ..api import async_proxy, cache
+from ..api.tests.test_kernel import stub_kernel
+from ..asgi import ASGIHandler, application, build_environ, wsgi_application
+
+
+async def call(app, method, path, headers=None, body=b''):
+    '''
+    Executes the ASGI request, returns the status, headers and body of the response.
+    '''
+
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path.split('?')[0],
+        'query_string': (path.split('?')[1] if '?' in path else '').encode('latin1'),
+        'root_path': '',
+        'headers': [(key.lower().encode('latin1'), value.encode('latin1')) for key, value in (headers or {}).items()],
+        'server': ('testserver', 80),
+        'client': ('127.0.0.1', 12345),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    return (
+        start['status'],
+        {key.decode('latin1'): value.decode('latin1') for key, value in start['headers']},
+        b''.join([message.get('body', b'') for message in sent[1:]]),
+    )
+
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+class ASGITestCase(TransactionTestCase):
+
+    def setUp(self):
+        super(ASGITestCase, self).setUp()
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        cache.clear()
+
+        username = 'test'
+        email = 'test@example.com'
+        password = 'testtest'
+        get_user_model().objects.create_user(username, email, password)
+        self.assertTrue(self.client.login(username=username, password=password))
+        csrf_token = _get_new_csrf_token()
+        self.headers = {
+            'Cookie': f'sessionid={self.client.cookies["sessionid"].value}; csrftoken={csrf_token}',
+            'X-CSRFToken': csrf_token,
+        }
+
+    def tearDown(self):
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(async_proxy.close_clients())
+        loop.close()
+        cache.clear()
+        super(ASGITestCase, self).tearDown()
+
+
+@mock.patch(
+    'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+    return_value=AppToken(token='ABCDEFGH'),
+)
+class ASGITests(ASGITestCase):
+
+    def test__build_environ(self, *args):
+        environ = build_environ({
+            'type': 'http',
+            'method': 'POST',
+            'path': '/api/kernel/projects.json',
+            'query_string': b'page=1',
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', b'2'),
+                (b'accept', b'text/html'),
+                (b'accept', b'application/json'),
+                (b'cookie', b'sessionid=abc'),
+                (b'cookie', b'csrftoken=def'),
+            ],
+        }, b'{}')
+
+        self.assertEqual(environ['REQUEST_METHOD'], 'POST')
+        self.assertEqual(environ['PATH_INFO'], '/api/kernel/projects.json')
+        self.assertEqual(environ['QUERY_STRING'], 'page=1')
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['CONTENT_LENGTH'], '2')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'text/html,application/json')
+        self.assertEqual(environ['HTTP_COOKIE'], 'sessionid=abc; csrftoken=def')
+        self.assertEqual(environ['wsgi.input'].read(), b'{}')
+        self.assertTrue(environ['gather.async_proxy'])
+
+    def test__django(self, *args):
+        status, headers, body = run(call(application, 'GET', '/assets-settings'))
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/json')
+        self.assertIn(b'"aether_apps"', body)
+
+        # the authentication is checked by Django
+        status, headers, body = run(call(application, 'GET', '/api/kernel/projects.json'))
+        self.assertEqual(status, 302)
+
+    def test__request_finished__same_thread(self, *args):
+        local = threading.local()
+        finished = []
+
+        def on_started(**kwargs):
+            local.requests = getattr(local, 'requests', 0) + 1
+
+        def on_finished(**kwargs):
+            # the thread that started the request finishes it
+            finished.append(getattr(local, 'requests', 0))
+            local.requests = 0
+
+        app = ASGIHandler(wsgi_application, threads=4)
+
+        async def load(path, headers=None):
+            return await asyncio.gather(*[call(app, 'GET', path, headers) for _ in range(8)])
+
+        request_started.connect(on_started)
+        request_finished.connect(on_finished)
+        server, settings = stub_kernel({'/kernel/projects.json': (200, {}, {'count': 1})})
+        try:
+            with server, settings:
+                run(load('/assets-settings'))
+                run(load('/api/kernel/projects.json', self.headers))
+        finally:
+            request_started.disconnect(on_started)
+            request_finished.disconnect(on_finished)
+
+        self.assertEqual(finished, [1] * 16)
+
+    def test__proxy(self, *args):
+        routes = {'/kernel/projects.json': (200, {'ETag': '"v1"', 'X-Other': 'other'}, {'count': 1})}
+        server, settings = stub_kernel(routes)
+        with server, settings:
+            status, headers, body = run(call(application, 'GET', '/api/kernel/projects.json?page=1', self.headers))
+            self.assertEqual(status, 200)
+            self.assertEqual(body, b'{"count": 1}')
+            self.assertEqual(headers['content-type'], 'application/json')
+            self.assertEqual(headers['content-length'], '12')
+            self.assertEqual(headers['etag'], '"v1"')
+            self.assertNotIn('x-other', headers)
+            # added by the middlewares
+            self.assertEqual(headers['x-frame-options'], 'SAMEORIGIN')
+
+            status, headers, body = run(call(application, 'HEAD', '/api/kernel/projects.json', self.headers))
+            self.assertEqual(status, 200)
+            self.assertEqual(body, b'')
+
+        self.assertEqual(len(server.requests), 2)
+        method, path, _, request_headers = server.requests[0]
+        request_headers = {key.lower(): value for key, value in request_headers.items()}
+        self.assertEqual(method, 'GET')
+        self.assertEqual(path, '/kernel/projects.json?page=1')
+        self.assertEqual(request_headers['authorization'], 'Token ABCDEFGH')
+        self.assertEqual(request_headers['accept-encoding'], 'identity')
+
+    def test__proxy__compression(self, *args):
+        content = [{'id': i, 'name': 'entity', 'payload': {'a': 1}} for i in range(100)]
+        routes = {
+            '/kernel/entities.json': (200, {'ETag': '"v1"'}, {'results': content}),
+            '/kernel/compressed.json': (200, {'Content-Encoding': 'br'}, {'results': content}),
+            '/kernel/small.json': (200, {}, {'count': 1}),
+        }
+        server, settings = stub_kernel(routes)
+        headers = {**self.headers, 'Accept-Encoding': 'gzip'}
+        with server, settings:
+            status, response_headers, body = run(call(application, 'GET', '/api/kernel/entities.json', headers))
+            self.assertEqual(status, 200)
+            self.assertEqual(response_headers['content-encoding'], 'gzip')
+            self.assertEqual(response_headers['etag'], 'W/"v1"')
+            self.assertIn('Accept-Encoding', response_headers['vary'])
+            self.assertNotIn('content-length', response_headers)
+            self.assertEqual(json.loads(gzip.decompress(body)), {'results': content})
+
+            # not accepted by the client
+            _, response_headers, body = run(call(application, 'GET', '/api/kernel/entities.json', self.headers))
+            self.assertNotIn('content-encoding', response_headers)
+            self.assertIn('Accept-Encoding', response_headers['vary'])
+            self.assertEqual(json.loads(body), {'results': content})
+
+            # already compressed by the external app
+            _, response_headers, _ = run(call(application, 'GET', '/api/kernel/compressed.json', headers))
+            self.assertEqual(response_headers['content-encoding'], 'br')
+
+            # too small
+            _, response_headers, body = run(call(application, 'GET', '/api/kernel/small.json', headers))
+            self.assertNotIn('content-encoding', response_headers)
+            self.assertEqual(body, b'{"count": 1}')
+
+            with override_settings(COMPRESSION_ENABLED=False):
+                _, response_headers, _ = run(call(application, 'GET', '/api/kernel/entities.json', headers))
+                self.assertNotIn('content-encoding', response_headers)
+
+    def test__proxy__cached_routes(self, *args):
+        routes = {
+            '/kernel/projects-stats.json': (200, {}, {'count': 1}),
+            '/kernel/projects/1.json': (204, {}, b''),
+        }
+        server, settings = stub_kernel(routes)
+        with server, settings, override_settings(PROXY_CACHE_ENABLED=True):
+            status, headers, _ = run(call(application, 'GET', '/api/kernel/projects-stats.json', self.headers))
+            self.assertEqual(headers['x-gather-cache'], 'MISS')
+            status, headers, _ = run(call(application, 'GET', '/api/kernel/projects-stats.json', self.headers))
+            self.assertEqual(headers['x-gather-cache'], 'HIT')
+
+            # the writes invalidate the cached responses
+            status, _, _ = run(call(application, 'DELETE', '/api/kernel/projects/1.json', self.headers))
+            self.assertEqual(status, 204)
+            status, headers, _ = run(call(application, 'GET', '/api/kernel/projects-stats.json', self.headers))
+            self.assertEqual(headers['x-gather-cache'], 'MISS')
+
+        self.assertEqual(len(server.requests), 3)
+
+    @override_settings(UPSTREAM_READ_TIMEOUT=0.1)
+    def test__proxy__errors(self, *args):
+        def slow(*args):
+            sleep(0.5)
+            return 200, {}, {}
+
+        server, settings = stub_kernel({'/kernel/slow': slow})
+        with server, settings:
+            status, _, body = run(call(application, 'GET', '/api/kernel/slow', self.headers))
+            self.assertEqual(status, 504)
+            self.assertEqual(body, b'Gateway Timeout')
+
+        # the server is down
+        status, _, body = run(call(application, 'GET', '/api/kernel/slow', self.headers))
+        self.assertEqual(status, 502)
+        self.assertEqual(body, b'Bad Gateway')
@@ -0,0 +1,120 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from ..api.models import Mask, Survey
+from ..benchmarks.cases import ASGI_REQUESTS, KERNEL_ENTITIES, create_data, get_cases
+from ..benchmarks.runner import compare, measure, percentile
+
+
+class BenchmarksTests(TestCase):
+
+    def test__percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 95), 95)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test__measure(self):
+        calls = []
+        stats = measure(lambda: calls.append(1), repeat=10, warmup=2, min_time=0.0001)
+
+        self.assertEqual(stats['samples'], 10)
+        self.assertGreater(len(calls), 2 + stats['number'] * 10)  # warm-up + calibration + samples
+        self.assertLessEqual(stats['min'], stats['p50'])
+        self.assertLessEqual(stats['p50'], stats['p95'])
+        self.assertLessEqual(stats['p95'], stats['p99'])
+        self.assertLessEqual(stats['p99'], stats['max'])
+        self.assertGreater(stats['ops'], 0)
+
+    def test__compare(self):
+        current = {'a': {'p50': 1.0}, 'b': {'p50': 1.5}, 'c': {'p50': 1.0}}
+        previous = {'a': {'p50': 1.0}, 'b': {'p50': 1.0}}
+        self.assertEqual(compare(current, previous, threshold=0.1), [('a', 1.0, False), ('b', 1.5, True)])
+
+    def test__cases(self):
+        user = create_data(5)
+        self.assertEqual(Survey.objects.count(), 5)
+        self.assertEqual(Mask.objects.count(), 10)
+
+        cases = {name: func for name, func, _ in get_cases([5], repeat=10, user=user)}
+        self.assertIn('SurveySerializer.5', cases)
+        self.assertIn('MaskSerializer.10', cases)
+        self.assertEqual(len(json.loads(cases['surveys_to_representation.5']())), 5)
+        self.assertEqual(len(json.loads(cases['MaskSerializer.10']())), 10)
+        self.assertEqual(cases['MaskViewSet.search']().status_code, 200)
+        self.assertEqual(
+            cases['SurveyViewSet.page.last']().data['results'],
+            cases['SurveyViewSet.cursor.last']().data['results'],
+        )
+        self.assertEqual(gzip.decompress(cases['compress.gzip.6.10']()), cases['masks_to_representation.10']())
+        for file_format in ('csv', 'ndjson', 'xlsx'):
+            self.assertGreater(cases[f'export.{file_format}.5'](), 0)
+        self.assertEqual(cases['aggregate.5']()['rows'], 5)
+        self.assertEqual(cases['aggregate.approximate.5']()['rows'], 5)
+        self.assertEqual(cases['kernel.fetch_pages.1'](), KERNEL_ENTITIES)
+        self.assertEqual(cases['kernel.fetch_pages.8'](), KERNEL_ENTITIES)
+        self.assertEqual(cases['asgi.proxy.threads'](), [200] * ASGI_REQUESTS)
+        self.assertEqual(cases['asgi.proxy.async'](), [200] * ASGI_REQUESTS)
+
+    def test__command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'results.json')
+            stdout = io.StringIO()
+            call_command('benchmark', '--sizes=5', '--repeat=3', '--warmup=1', '-f', 'urls|5$', '-o', output,
+                         stdout=stdout)
+
+            self.assertIn('urls.resolve', stdout.getvalue())
+            with open(output) as fp:
+                content = json.load(fp)
+            self.assertIn('environment', content)
+            self.assertEqual(
+                sorted(content['results'].keys()),
+                [
+                    'SurveySerializer.5',
+                    'aggregate.5',
+                    'aggregate.approximate.5',
+                    'export.csv.5',
+                    'export.ndjson.5',
+                    'export.xlsx.5',
+                    'surveys_to_representation.5',
+                    'urls.resolve',
+                    'urls.reverse',
+                ],
+            )
+            # the benchmark data is not kept
+            self.assertFalse(Survey.objects.exists())
+
+            # much faster before
+            for stats in content['results'].values():
+                stats['p50'] /= 100
+            with open(output, 'w') as fp:
+                json.dump(content, fp)
+
+            with self.assertRaises(CommandError):
+                call_command('benchmark', '--sizes=5', '--repeat=3', '-f', 'urls', '-c', output, stdout=stdout)
+            self.assertIn('REGRESSION', stdout.getvalue())
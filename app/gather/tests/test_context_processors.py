@@ -16,14 +16,48 @@
 # specific language governing permissions and limitations
 # under the License.
 
+from unittest import mock
+
 from django.test import RequestFactory, override_settings
 from aether.sdk.unittest import UrlsTestCase
 
-from ..context_processors import gather_context
+from ..context_processors import _build_context, clear_gather_context, gather_context
 
 
 class ContextProcessorsTests(UrlsTestCase):
 
+    def setUp(self):
+        super(ContextProcessorsTests, self).setUp()
+        clear_gather_context()
+
+    def test_gather_context__cache(self):
+        request = RequestFactory().get('/')
+        with mock.patch('gather.context_processors._build_context', wraps=_build_context) as mock_build:
+            context = gather_context(request)
+            context['navigation_list'].append('changed')
+
+            self.assertEqual(gather_context(request)['navigation_list'], context['navigation_list'][:-1])
+            mock_build.assert_called_once()
+
+            # other prefix
+            with mock.patch('gather.context_processors.get_script_prefix', return_value='/other/'):
+                gather_context(request)
+            self.assertEqual(mock_build.call_count, 2)
+
+            # settings changes invalidate the cache
+            with override_settings(INSTANCE_NAME='Other'):
+                self.assertEqual(gather_context(request)['instance_name'], 'Other')
+            self.assertEqual(mock_build.call_count, 3)
+            self.assertNotEqual(gather_context(request)['instance_name'], 'Other')
+            self.assertEqual(mock_build.call_count, 4)
+
+    def test_gather_context__resolver_match(self):
+        request = RequestFactory().get('/')
+        request.resolver_match = mock.Mock(kwargs={})
+        with mock.patch('gather.context_processors.get_path_realm') as mock_realm:
+            self.assertEqual(gather_context(request)['gather_url'], '')
+            mock_realm.assert_not_called()
+
     def test_gather_context(self):
         request = RequestFactory().get('/')
         context = gather_context(request)
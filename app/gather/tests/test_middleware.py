@@ -0,0 +1,153 @@
+# Copyright (C) 2019 by eHealth Africa : http://www.eHealthAfrica.org
+#
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import json
+
+from unittest import mock, skipUnless
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from .. import middleware
+from ..api.proxy import UpstreamCall
+
+CONTENT = json.dumps([{'id': i, 'name': 'entity', 'payload': {'a': 1, 'b': [1, 2, 3]}} for i in range(100)])
+CONTENT = CONTENT.encode('utf-8')
+
+
+def get_response(content=CONTENT, content_type='application/json', streaming=False, **headers):
+    if streaming:
+        chunks = [content] if isinstance(content, bytes) else content
+        response = StreamingHttpResponse(streaming_content=chunks, content_type=content_type)
+    else:
+        response = HttpResponse(content=content, content_type=content_type)
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+def process(response, accept_encoding='gzip'):
+    request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+    return middleware.CompressionMiddleware().process_response(request, response)
+
+
+class CompressionMiddlewareTests(TestCase):
+
+    def test__get_encoding(self):
+        with mock.patch('gather.middleware.brotli', new=object()):
+            self.assertEqual(middleware.get_encoding('gzip, deflate, br'), 'br')
+            self.assertEqual(middleware.get_encoding('br;q=0.5, gzip'), 'gzip')
+            self.assertEqual(middleware.get_encoding('gzip;q=0.5, br;q=1.0'), 'br')
+            self.assertEqual(middleware.get_encoding('br;q=0, gzip;q=0'), None)
+            self.assertEqual(middleware.get_encoding('*'), 'br')
+            self.assertEqual(middleware.get_encoding('gzip;q=wrong, br'), 'br')
+
+        with mock.patch('gather.middleware.brotli', new=None):
+            self.assertEqual(middleware.get_encoding('gzip, deflate, br'), 'gzip')
+            self.assertEqual(middleware.get_encoding('br'), None)
+            self.assertEqual(middleware.get_encoding('*;q=0.1'), 'gzip')
+
+        self.assertEqual(middleware.get_encoding('identity'), None)
+        self.assertEqual(middleware.get_encoding(''), None)
+
+    def test__gzip(self):
+        response = process(get_response(ETag='"v1"'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['ETag'], 'W/"v1"')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(CONTENT) / 10)
+        self.assertEqual(gzip.decompress(response.content), CONTENT)
+
+    @skipUnless(middleware.brotli, 'brotli is not installed')
+    def test__brotli(self):
+        response = process(get_response(), accept_encoding='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(middleware.brotli.decompress(response.content), CONTENT)
+
+        response = process(get_response(streaming=True), accept_encoding='br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(middleware.brotli.decompress(b''.join(response.streaming_content)), CONTENT)
+
+    def test__streaming(self):
+        chunks = [CONTENT[i:i + 100] for i in range(0, len(CONTENT), 100)]
+        response = process(get_response(content=chunks, streaming=True, **{'Content-Length': str(len(CONTENT))}))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+
+        # compressed as they come
+        with mock.patch('gather.middleware.FLUSH_SIZE', 1000):
+            response = process(get_response(content=chunks, streaming=True))
+            compressed = list(response.streaming_content)
+        self.assertGreater(len(compressed), 2)
+        self.assertEqual(gzip.decompress(b''.join(compressed)), CONTENT)
+
+        # small content
+        response = process(get_response(content=[b'{}'], streaming=True, **{'Content-Length': '2'}))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test__skipped(self):
+        # not accepted
+        response = process(get_response(), accept_encoding='identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response.content, CONTENT)
+
+        # already encoded (by the external app)
+        response = process(get_response(content=b'compressed', **{'Content-Encoding': 'br'}))
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(response.content, b'compressed')
+
+        # partial content
+        response = process(get_response(**{'Content-Range': 'bytes 0-100/1000'}))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        # other content types
+        response = process(get_response(content_type='text/html; charset=utf-8'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+        # small content
+        response = process(get_response(content=b'{"a": 1}'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        # not worth it
+        with override_settings(COMPRESSION_MIN_SIZE=10):
+            response = process(get_response(content=b'{"abcdefghijklmnopqrstuvwxyz": 1}'))
+            self.assertFalse(response.has_header('Content-Encoding'))
+
+        # the ASGI server compresses the body later
+        call = UpstreamCall('aether-kernel', 'GET', 'http://kernel', {}, b'')
+        call = process(call, accept_encoding='gzip, br')
+        self.assertFalse(call.has_header('Content-Encoding'))
+        self.assertEqual(call.accept_encoding, 'gzip, br')
+
+        with override_settings(COMPRESSION_ENABLED=False):
+            self.assertFalse(process(get_response()).has_header('Content-Encoding'))
+            self.assertIsNone(process(UpstreamCall('aether-kernel', 'GET', 'http://kernel', {}, b'')).accept_encoding)
+
+    def test__api(self):
+        response = self.client.get('/assets-settings', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))  # too small
+
+        es_url = 'http://es/' + 'consumer/' * 200
+        with override_settings(ES_CONSUMER_URL=es_url):
+            response = self.client.get('/assets-settings', HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(json.loads(gzip.decompress(response.content))['es_consumer_url'], es_url)
@@ -16,8 +16,18 @@
 # specific language governing permissions and limitations
 # under the License.
 
+from time import sleep, time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
-from django.test import TestCase
+
+from aether.sdk.auth.apptoken.models import AppToken
+
+from ..api.tests.test_proxy import upstream_response
+from ..views import BootstrapView, surveyors_bootstrap_urls, surveys_bootstrap_urls
 
 
 class ViewsTest(TestCase):
@@ -32,3 +42,76 @@ class ViewsTest(TestCase):
             'export_max_rows_size': 1000,
             'es_consumer_url': 'http://es-consumer-url',
         })
+
+    def test__bootstrap_urls(self):
+        self.assertEqual(surveys_bootstrap_urls(action='add'), [])
+        self.assertEqual(surveys_bootstrap_urls(action='view'), [])
+        self.assertEqual(len(surveys_bootstrap_urls(action='list')), 2)
+        self.assertEqual(surveys_bootstrap_urls(action='view', survey_id='1234'), [
+            '/api/kernel/projects-stats/1234.json?passthrough=true',
+            '/api/kernel/projects/1234/schemas-skeleton.json?passthrough=true',
+        ])
+        self.assertEqual(surveyors_bootstrap_urls(action='list'), ['/api/odk/surveyors.json?page=1&page_size=36'])
+        self.assertEqual(surveyors_bootstrap_urls(action='edit'), [])
+
+    def test__bootstrap_view(self):
+        request = RequestFactory().get('/surveys/view/1234')
+        request.user = get_user_model().objects.create_user('test', 'test@example.com', 'testtest')
+        view = BootstrapView(
+            request=request,
+            template_name='gather/pages/surveys.html',
+            bootstrap_urls=surveys_bootstrap_urls,
+        )
+
+        results = [
+            {'url': '/api/kernel/projects-stats/1234.json?passthrough=true', 'status': 200, 'body': {'id': '1234'}},
+            {'url': '/api/kernel/projects/1234/schemas-skeleton.json?passthrough=true', 'status': 504, 'body': {}},
+        ]
+        with override_settings(BOOTSTRAP_DATA=True), \
+                mock.patch('gather.views.batch.execute', return_value=results) as mock_execute:
+            context = view.get_context_data(action='view', survey_id='1234')
+            mock_execute.assert_called_once_with(request, [
+                '/api/kernel/projects-stats/1234.json?passthrough=true',
+                '/api/kernel/projects/1234/schemas-skeleton.json?passthrough=true',
+            ], deadline=0.3)
+
+        self.assertEqual(context['bootstrap'], {
+            'settings': {
+                'aether_apps': ['kernel', 'odk'],
+                'export_max_rows_size': 1000,
+                'es_consumer_url': 'http://es-consumer-url',
+            },
+            # only the successful responses
+            'data': {'/api/kernel/projects-stats/1234.json?passthrough=true': {'id': '1234'}},
+        })
+
+        # opt-in
+        with mock.patch('gather.views.batch.execute') as mock_execute:
+            context = view.get_context_data(action='view', survey_id='1234')
+            mock_execute.assert_not_called()
+        self.assertEqual(context['bootstrap']['data'], {})
+
+    @override_settings(BOOTSTRAP_DATA=True)
+    @mock.patch(
+        'aether.sdk.auth.apptoken.models.AppToken.get_or_create_token',
+        return_value=AppToken(token='ABCDEFGH'),
+    )
+    def test__bootstrap_view__deadline(self, *args):
+        request = RequestFactory().get('/surveys/view/1234')
+        request.user = get_user_model().objects.create_user('test', 'test@example.com', 'testtest')
+        SessionMiddleware().process_request(request)
+        view = BootstrapView.as_view(template_name='gather/pages/surveys.html', bootstrap_urls=surveys_bootstrap_urls)
+
+        def slow(*args, **kwargs):
+            sleep(2)
+            return upstream_response(200, b'{}', {'Content-Type': 'application/json'})
+
+        with mock.patch('gather.api.upstream.request', side_effect=slow):
+            start = time()
+            response = view(request, action='view', survey_id='1234')
+            # the page does not wait for the slow calls
+            self.assertLess(time() - start, 1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['bootstrap']['data'], {})
+        self.assertIn('settings', response.context_data['bootstrap'])
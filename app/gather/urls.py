@@ -19,15 +19,18 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.urls import include, path, re_path
-from django.views.generic import TemplateView
 
 from aether.sdk.conf.urls import generate_urlpatterns
 
 # Any entry here needs the decorator `app_token_required` if it's going to execute
 # AJAX request to any of the external apps
-from aether.sdk.auth.apptoken.decorators import app_token_required
-
-from .views import assets_settings
+from .api.tokens import app_token_required
+from .views import (
+    BootstrapView,
+    assets_settings,
+    surveyors_bootstrap_urls,
+    surveys_bootstrap_urls,
+)
 
 
 app_urls = [
@@ -41,20 +44,26 @@ app_urls = [
     # ----------------------
     # Welcome page
     path(route='',
-         view=login_required(TemplateView.as_view(template_name='gather/pages/index.html')),
+         view=login_required(BootstrapView.as_view(template_name='gather/pages/index.html')),
          name='index-page'),
 
     # ----------------------
     # surveys app
     re_path(route=r'^surveys/(?P<action>\w+)/(?P<survey_id>[0-9a-f-]+)?$',
-            view=app_token_required(TemplateView.as_view(template_name='gather/pages/surveys.html')),
+            view=app_token_required(BootstrapView.as_view(
+                template_name='gather/pages/surveys.html',
+                bootstrap_urls=surveys_bootstrap_urls,
+            )),
             name='surveys'),
 ]
 
 if 'odk' in settings.AETHER_APPS:
     app_urls += [
         re_path(route=r'^surveyors/(?P<action>\w+)/(?P<surveyor_id>[0-9]+)?$',
-                view=app_token_required(TemplateView.as_view(template_name='gather/pages/surveyors.html')),
+                view=app_token_required(BootstrapView.as_view(
+                    template_name='gather/pages/surveyors.html',
+                    bootstrap_urls=surveyors_bootstrap_urls,
+                )),
                 name='odk-surveyors'),
     ]
 
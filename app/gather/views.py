@@ -18,6 +18,18 @@
 
 from django.conf import settings
 from django.http import JsonResponse
+from django.views.generic import TemplateView
+
+from .api import batch
+from .context_processors import gather_context
+
+
+def get_assets_settings():
+    return {
+        'aether_apps': settings.AETHER_APPS,
+        'export_max_rows_size': int(settings.EXPORT_MAX_ROWS_SIZE),
+        'es_consumer_url': settings.ES_CONSUMER_URL,
+    }
 
 
 def assets_settings(*args, **kwargs):
@@ -25,8 +37,64 @@ def assets_settings(*args, **kwargs):
     Returns the list of settings needed by the assets
     '''
 
-    return JsonResponse({
-        'aether_apps': settings.AETHER_APPS,
-        'export_max_rows_size': int(settings.EXPORT_MAX_ROWS_SIZE),
-        'es_consumer_url': settings.ES_CONSUMER_URL,
-    })
+    return JsonResponse(get_assets_settings())
+
+
+class BootstrapView(TemplateView):
+    '''
+    Includes in the page context the ``bootstrap`` content (embedded as JSON
+    in the page) to save the initial calls of the assets:
+
+        - ``settings``: the assets settings (see ``assets_settings``),
+        - ``data``: the responses of the first API calls done by the page
+          (``bootstrap_urls``) indexed by their url.
+
+    The API calls are executed like in a batch (see ``gather.api.batch``),
+    the ones that fail or take more than ``BOOTSTRAP_DATA_DEADLINE`` seconds
+    are not included and the assets request them as usual.
+    Opt-in with ``BOOTSTRAP_DATA``, the page render waits for the calls.
+    '''
+
+    # function that receives the url kwargs and returns the list of API urls
+    # (relative to the gather url) exactly as the assets build them
+    bootstrap_urls = None
+
+    def get_context_data(self, **kwargs):
+        context = super(BootstrapView, self).get_context_data(**kwargs)
+        context['bootstrap'] = {
+            'settings': get_assets_settings(),
+            'data': self.get_bootstrap_data(**kwargs),
+        }
+        return context
+
+    def get_bootstrap_data(self, **kwargs):
+        if not settings.BOOTSTRAP_DATA or not self.bootstrap_urls:
+            return {}
+
+        gather_url = gather_context(self.request)['gather_url']
+        urls = [gather_url + url for url in self.bootstrap_urls(**kwargs)]
+        results = batch.execute(self.request, urls, deadline=settings.BOOTSTRAP_DATA_DEADLINE)
+        return {result['url']: result['body'] for result in results if result['status'] == 200}
+
+
+def surveys_bootstrap_urls(action=None, survey_id=None, **kwargs):
+    if action == 'list':
+        return [
+            # active and inactive surveys lists
+            '/api/kernel/projects-stats.json?passthrough=true&active=true&page=1&page_size=12',
+            '/api/kernel/projects-stats.json?passthrough=true&active=false&page=1&page_size=10',
+        ]
+
+    if action == 'view' and survey_id:
+        return [
+            f'/api/kernel/projects-stats/{survey_id}.json?passthrough=true',
+            f'/api/kernel/projects/{survey_id}/schemas-skeleton.json?passthrough=true',
+        ]
+
+    return []
+
+
+def surveyors_bootstrap_urls(action=None, **kwargs):
+    if action == 'list':
+        return ['/api/odk/surveyors.json?page=1&page_size=36']
+    return []